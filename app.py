@@ -1,23 +1,37 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import time
 import math
 import pytz
 import os
 import json
-import bcrypt
 import hashlib
+import hmac
 import random
 import re
-import tempfile
+import io
+import zipfile
+import threading
+import select
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date, timedelta
-from collections import defaultdict
+from collections import defaultdict, deque
+from contextlib import contextmanager
 from streamlit_js_eval import get_geolocation
-from sqlalchemy import create_engine, text
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from sqlalchemy import create_engine, text, event
+from sqlalchemy.pool import NullPool
 import pydeck as pdk
 import plotly.express as px
 import plotly.graph_objects as go
 from web3 import Web3
+from geo_index import haversine_vec, build_facility_index, facilities_within, nearest_facilities
+from ping_ingest import POSITION_QUEUE_MAX, start_position_ingest, queue_position, pop_geofence_exit
+from pool_workers import LOCAL_TZ, PDF_ACTIVE, generate_poc_hash, verify_poc_chunk, create_paystub_pdf, render_compliance_report, render_export_job
+from auth import hash_password, verify_password, new_auth_rate_limiter, admit_login_attempt
+from db_schema import ROLLUP_ACTIONS, WORKER_ROLLUPS_BACKFILL_SQL, SCHEMA_MIGRATIONS, bootstrap_schema, explain_hot_queries, SQL_ROLLING_WEEKLY_GROSS, SQL_FATIGUE_HISTORY, SQL_FATIGUE_ACCOLADES, SQL_FLEX_ORACLE, SQL_SPEND_BY_DEPT_DAY, SQL_PAYSTUB_PAGE, SQL_PERIOD_PAYSTUBS, SQL_POC_DAY_RANGE, SQL_PENDING_CFO_SETTLEMENTS, SQL_DEPT_CHANNEL, SQL_HOSPITAL_CHANNEL, SQL_DM_THREAD, SQL_POC_FEED, SQL_POC_EMR_EXCEPTIONS, SQL_OBT_PORTFOLIO, SQL_ACTIVE_FLEET, SQL_OPEN_MARKETPLACE, SQL_SCHEDULED_BASELINE, SQL_MY_UPCOMING_SHIFTS, SQL_PENDING_OT_BIDS, SQL_PENDING_PTO, SQL_ACTIVE_PROTOCOLS
 
 # --- WEB3 BLOCKCHAIN ENGINE ---
 # These will pull from your Render Environment Variables once you are ready to go live
@@ -28,40 +42,307 @@ CONTRACT_ADDRESS = os.environ.get("WEB3_CONTRACT_ADDRESS", "0x000000000000000000
 # Truncated ABI teaching Python how to push the mint button
 CONTRACT_ABI = json.loads('[{"inputs":[{"internalType":"address","name":"account","type":"address"},{"internalType":"uint256","name":"id","type":"uint256"},{"internalType":"uint256","name":"amount","type":"uint256"}],"name":"mintClinicalAccolade","outputs":[],"stateMutability":"nonpayable","type":"function"}]')
 
-def mint_sbt_on_chain(target_wallet, action_id):
-    if not PRIVATE_KEY or CONTRACT_ADDRESS == "0x0000000000000000000000000000000000000000":
-        return "Simulated (No Private Key)"
-    
+def web3_ready():
+    return bool(PRIVATE_KEY) and CONTRACT_ADDRESS != "0x0000000000000000000000000000000000000000"
+
+GAS_SAFETY_MARGIN = float(os.environ.get("WEB3_GAS_SAFETY_MARGIN", 1.25))
+FEE_HISTORY_BLOCKS = 20 # blocks fetched per eth_feeHistory refresh
+FEE_WINDOW_BLOCKS = 200 # rolling window the priority tip is taken from
+FEE_REFRESH_SECONDS = 15
+MIN_PRIORITY_FEE_WEI = 10**6 # 0.001 gwei floor for quiet L2 blocks
+# Opt-in for development: without WEB3_PRIVATE_KEY, rollup anchors can go to a dev chain instead: "eth-tester" (in-process,
+# needs requirements-dev.txt) or a dev node URL such as anvil's http://127.0.0.1:8545. Dev-chain anchors never mark a day
+# CONFIRMED or touch obt_ledger; those days stay SIMULATED until a live chain anchors them.
+SIMULATED_CHAIN = os.environ.get("WEB3_SIMULATED_CHAIN", "off")
+ANCHOR_RESUBMIT_SECONDS = int(os.environ.get("ANCHOR_RESUBMIT_SECONDS", 3600)) # a live anchor with no receipt after this long is sent again
+
+def rpc_latency_middleware(metrics):
+    def middleware(make_request, w3):
+        def timed_request(method, params):
+            started = time.perf_counter()
+            try: return make_request(method, params)
+            finally:
+                metrics["rpc_calls"] += 1
+                metrics["rpc_latency"].append((method, (time.perf_counter() - started) * 1000))
+        return timed_request
+    return middleware
+
+def build_web3_client(provider, account_for, fee_history=True):
+    """Client dict around one provider. Chain id is read once, nonces are counted locally so several txs can be in flight,
+    and every RPC round trip is timed into client["metrics"]. fee_history=False prices from eth_gasPrice for nodes without eth_feeHistory."""
+    metrics = {"rpc_calls": 0, "rpc_latency": deque(maxlen=500), "calls_per_send": deque(maxlen=200), "gas": deque(maxlen=200)}
+    w3 = Web3(provider)
+    w3.middleware_onion.add(rpc_latency_middleware(metrics), name="rpc_latency")
+    return {
+        "w3": w3, "account": account_for(w3), "contract": w3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI), "chain_id": w3.eth.chain_id,
+        "nonce": None, "lock": threading.Lock(), "metrics": metrics, "gas_limits": {}, "simulated": False,
+        "fees": {"at": 0.0, "last_block": -1, "next_base": 0, "window": deque(maxlen=FEE_WINDOW_BLOCKS), "history": fee_history},
+    }
+
+@st.cache_resource
+def get_web3_client():
+    """One provider, account and contract per process."""
+    return build_web3_client(Web3.HTTPProvider(RPC_URL, request_kwargs={"timeout": 10}), lambda w3: w3.eth.account.from_key(PRIVATE_KEY))
+
+def fund_dev_account(w3):
+    """A throwaway account funded from the dev node's first unlocked account (eth-tester and anvil both prefund and unlock theirs)."""
+    account = w3.eth.account.create()
+    w3.eth.wait_for_transaction_receipt(w3.eth.send_transaction({"from": w3.eth.accounts[0], "to": account.address, "value": 10**20}), timeout=30)
+    return account
+
+@st.cache_resource
+def get_simulated_web3_client():
+    """Dev-chain client so rollup anchoring runs end to end without a key. Nothing it sends reaches a public chain.
+    None when SIMULATED_CHAIN is off, eth-tester is not installed or the dev node is unreachable."""
+    if SIMULATED_CHAIN.lower() in ("", "off", "none"): return None
+    in_process = not SIMULATED_CHAIN.startswith(("http://", "https://"))
     try:
-        w3 = Web3(Web3.HTTPProvider(RPC_URL))
-        account = w3.eth.account.from_key(PRIVATE_KEY)
-        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=CONTRACT_ABI)
-        
-        # Build the transaction
-        nonce = w3.eth.get_transaction_count(account.address)
-        tx = contract.functions.mintClinicalAccolade(target_wallet, action_id, 1).build_transaction({
-            'chainId': 84532, # Base Sepolia Chain ID
-            'gas': 2000000,
-            'maxFeePerGas': w3.to_wei('2', 'gwei'),
-            'maxPriorityFeePerGas': w3.to_wei('1', 'gwei'),
-            'nonce': nonce,
-        })
-        
-        # Sign and Broadcast
-        signed_tx = w3.eth.account.sign_transaction(tx, private_key=account.key)
-        tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
-        return f"0x{w3.to_hex(tx_hash)[2:]}" # Returns the immutable blockchain receipt
-    except Exception as e:
-        return f"Web3 Error: {str(e)}"
-# --- EXTERNAL LIBRARIES ---
-try: 
-    from fpdf import FPDF
-    PDF_ACTIVE = True
-except ImportError: 
-    PDF_ACTIVE = False
+        provider = Web3.EthereumTesterProvider() if in_process else Web3.HTTPProvider(SIMULATED_CHAIN, request_kwargs={"timeout": 10})
+        return dict(build_web3_client(provider, fund_dev_account, fee_history=not in_process), simulated=True)
+    except Exception: return None
+
+def anchor_client():
+    """The client rollup anchors go through: the live chain when a key is configured, else the simulated dev chain (possibly None)."""
+    return get_web3_client() if web3_ready() else get_simulated_web3_client()
+
+def chain_tag(client):
+    """Stored with every anchor, so rows sent to one chain are never settled (or verified) against another."""
+    return f"{'simulated' if client['simulated'] else 'live'}:{client['chain_id']}"
+
+def next_nonce(client):
+    if client["nonce"] is None: client["nonce"] = client["w3"].eth.get_transaction_count(client["account"].address, "pending")
+    nonce = client["nonce"]; client["nonce"] += 1
+    return nonce
+
+def current_fees(client):
+    """EIP-1559 caps: the median p50 tip over the rolling window, plus twice the next block's base fee. eth_feeHistory is hit at most every FEE_REFRESH_SECONDS."""
+    cache = client["fees"]
+    if time.time() - cache["at"] > FEE_REFRESH_SECONDS:
+        if not cache["history"]: cache["next_base"] = client["w3"].eth.gas_price # eth-tester has no eth_feeHistory; the tip stays at the floor
+        else:
+            history = client["w3"].eth.fee_history(FEE_HISTORY_BLOCKS, "latest", [50])
+            for offset, reward in enumerate(history["reward"]):
+                block = history["oldestBlock"] + offset
+                if block > cache["last_block"]: cache["window"].append((history["baseFeePerGas"][offset], reward[0])); cache["last_block"] = block
+            cache["next_base"] = history["baseFeePerGas"][-1]
+        cache["at"] = time.time()
+    tips = sorted(tip for _, tip in cache["window"])
+    priority = max(tips[len(tips) // 2] if tips else 0, MIN_PRIORITY_FEE_WEI)
+    return {"maxFeePerGas": 2 * cache["next_base"] + priority, "maxPriorityFeePerGas": priority}
+
+def sign_and_send(client, tx):
+    """Completes tx with chain id, fee caps, a margin-padded gas estimate (unless tx sets gas) and the next local nonce, then broadcasts it.
+    The estimate runs before a nonce is taken, so a call that would revert fails here without burning one."""
+    w3, account, metrics = client["w3"], client["account"], client["metrics"]
+    with client["lock"]:
+        calls_before = metrics["rpc_calls"]
+        tx = dict(tx, chainId=client["chain_id"], **current_fees(client))
+        tx["from"] = account.address
+        if "gas" not in tx: tx["gas"] = int(w3.eth.estimate_gas(tx) * GAS_SAFETY_MARGIN)
+        nonce = next_nonce(client)
+        try:
+            signed_tx = account.sign_transaction(dict(tx, nonce=nonce))
+            tx_hash = w3.eth.send_raw_transaction(signed_tx.rawTransaction)
+        except Exception:
+            client["nonce"] = None # resync from the node; a failed send may or may not have consumed the nonce
+            raise
+        metrics["calls_per_send"].append(metrics["rpc_calls"] - calls_before)
+    tx_hex = f"0x{w3.to_hex(tx_hash)[2:]}" # Returns the immutable blockchain receipt
+    if len(client["gas_limits"]) >= 1000: client["gas_limits"].pop(next(iter(client["gas_limits"])))
+    client["gas_limits"][tx_hex] = tx["gas"]
+    return tx_hex
+
+def record_receipt(client, tx_hash, receipt):
+    limit = client["gas_limits"].pop(tx_hash, None)
+    if limit: client["metrics"]["gas"].append((receipt["gasUsed"], limit))
+
+def send_mint(client, target_wallet, action_id):
+    # Encoding locally skips the estimate/fee lookups build_transaction would make on every call.
+    data = client["contract"].encodeABI(fn_name="mintClinicalAccolade", args=[target_wallet, action_id, 1])
+    return sign_and_send(client, {'to': client["contract"].address, 'value': 0, 'data': data})
+
+def web3_metrics_snapshot(client):
+    m = client["metrics"]
+    latencies = np.array([ms for _, ms in m["rpc_latency"]]) if m["rpc_latency"] else None
+    gas = np.array(m["gas"], dtype=float) if m["gas"] else None
+    fees = current_fees(client)
+    return {
+        "chain_id": client["chain_id"], "rpc_calls": m["rpc_calls"],
+        "rpc_p50_ms": float(np.percentile(latencies, 50)) if latencies is not None else None,
+        "rpc_p95_ms": float(np.percentile(latencies, 95)) if latencies is not None else None,
+        "calls_per_send": float(np.mean(m["calls_per_send"])) if m["calls_per_send"] else None,
+        "gas_used_vs_limit": float(np.mean(gas[:, 0] / gas[:, 1])) if gas is not None else None,
+        "max_fee_gwei": fees["maxFeePerGas"] / 1e9, "priority_fee_gwei": fees["maxPriorityFeePerGas"] / 1e9, "fee_window_blocks": len(client["fees"]["window"]),
+    }
+
+# Daily Merkle roots are anchored as calldata on a zero-value self-transfer: no contract method is needed and the cost is fixed.
+ANCHOR_PREFIX = b"ECPL"
+
+def anchor_payload(day_str, root_hex):
+    return ANCHOR_PREFIX + day_str.encode('ascii') + bytes.fromhex(root_hex)
+
+def send_anchor(client, payload):
+    return sign_and_send(client, {
+        'to': client["account"].address, 'value': 0, 'data': payload,
+        'gas': 21000 + sum(16 if b else 4 for b in payload), # exact intrinsic gas of a plain transfer with calldata
+    })
+
+def mint_sbt_on_chain(target_wallet, action_id):
+    if not web3_ready(): return "Simulated (No Private Key)"
+    try: return send_mint(get_web3_client(), target_wallet, action_id)
+    except Exception as e: return f"Web3 Error: {str(e)}"
+
+# --- MINT OUTBOX (durable queue drained by one background worker per process) ---
+MINT_BATCH_SIZE = int(os.environ.get("MINT_BATCH_SIZE", 10))
+MINT_POLL_SECONDS = float(os.environ.get("MINT_POLL_SECONDS", 2))
+MINT_MAX_ATTEMPTS = 5
+MINT_WORKER_LOCK_ID = 60050003 # only one process signs at a time, so local nonce counters never collide
+# "anchor": accolades ride on the day's anchored Merkle root (one tx per day). "mint": one mintClinicalAccolade tx per event.
+SBT_ISSUANCE_MODE = os.environ.get("SBT_ISSUANCE_MODE", "anchor")
+
+def enqueue_mint(token_id, target_wallet, action_id, conn):
+    run_transaction("INSERT INTO mint_outbox (mint_id, token_id, wallet, action_id) VALUES (:m, :t, :w, :a)", {"m": f"MINT-{token_id}", "t": token_id, "w": target_wallet, "a": action_id}, conn=conn)
+
+def process_mint_outbox(engine, client, limit=MINT_BATCH_SIZE):
+    """One worker cycle: broadcast up to `limit` queued mints on consecutive nonces, then poll receipts for everything in flight.
+    Every row is committed as soon as its RPC call returns, so a crash never re-sends a mint that already went out.
+    client=None settles rows as simulated, the same as mint_sbt_on_chain without a key. Any object shaped like get_web3_client() works, including a mock."""
+    stats = {"sent": 0, "confirmed": 0, "failed": 0}
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": MINT_WORKER_LOCK_ID}).scalar(): return stats
+        try:
+            queued = conn.execute(text("SELECT mint_id, token_id, wallet, action_id, attempts FROM mint_outbox WHERE status='QUEUED' ORDER BY created_at LIMIT :n"), {"n": limit}).fetchall()
+            for mint_id, token_id, wallet, action_id, attempts in queued:
+                err = None
+                if client is None: tx_hash, status = "Simulated (No Private Key)", "SIMULATED"
+                else:
+                    try: tx_hash, status = send_mint(client, wallet, int(action_id)), "SENT"
+                    except Exception as e: tx_hash, err = None, str(e); status = "FAILED" if attempts + 1 >= MINT_MAX_ATTEMPTS else "QUEUED"
+                conn.execute(text("UPDATE mint_outbox SET status=:s, tx_hash=:h, attempts=attempts+1, last_error=:e, updated_at=NOW() WHERE mint_id=:m"), {"s": status, "h": tx_hash, "e": err, "m": mint_id})
+                if status != "QUEUED": conn.execute(text("UPDATE obt_ledger SET encryption_hash=:h WHERE token_id=:t"), {"h": tx_hash or f"Web3 Error: {err}", "t": token_id})
+                conn.commit()
+                stats["sent" if tx_hash else "failed"] += status != "QUEUED"
+            if client is not None:
+                in_flight = conn.execute(text("SELECT mint_id, token_id, tx_hash FROM mint_outbox WHERE status='SENT' ORDER BY updated_at LIMIT :n"), {"n": limit * 5}).fetchall()
+                for mint_id, token_id, tx_hash in in_flight:
+                    try: receipt = client["w3"].eth.get_transaction_receipt(tx_hash)
+                    except Exception: continue # not mined yet, or the node is briefly unreachable
+                    record_receipt(client, tx_hash, receipt)
+                    status = "CONFIRMED" if receipt["status"] == 1 else "REVERTED"
+                    conn.execute(text("UPDATE mint_outbox SET status=:s, block_number=:b, updated_at=NOW() WHERE mint_id=:m"), {"s": status, "b": receipt["blockNumber"], "m": mint_id})
+                    if status == "REVERTED": conn.execute(text("UPDATE obt_ledger SET encryption_hash=:h WHERE token_id=:t"), {"h": f"Web3 Error: reverted in block {receipt['blockNumber']} ({tx_hash})", "t": token_id})
+                    conn.commit()
+                    stats["confirmed" if status == "CONFIRMED" else "failed"] += 1
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MINT_WORKER_LOCK_ID}); conn.commit()
+    return stats
+
+def process_rollup_anchors(engine, client, limit=MINT_BATCH_SIZE):
+    """One anchoring cycle: READY_FOR_L2 -> SUBMITTED for closed, finalized days, then SUBMITTED -> CONFIRMED once the anchor is mined.
+    On confirmation every accolade whose claim is a leaf of that day's tree picks up the anchor tx hash.
+    A simulated client settles days as SIMULATED and writes nothing to obt_ledger; a live client re-anchors SIMULATED days.
+    SUBMITTED rows whose transaction can no longer be found (a dev chain that restarted, a live tx dropped for ANCHOR_RESUBMIT_SECONDS)
+    go back to READY_FOR_L2 instead of waiting forever."""
+    stats = {"submitted": 0, "confirmed": 0, "failed": 0}
+    today = str(datetime.now(LOCAL_TZ).date())
+    tag, live = chain_tag(client), not client["simulated"]
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": MINT_WORKER_LOCK_ID}).scalar(): return stats
+        try:
+            ready = conn.execute(text("""
+                SELECT r.date, r.merkle_root FROM daily_rollups r
+                WHERE (r.status='READY_FOR_L2' OR (r.status='SIMULATED' AND :live)) AND r.date < :today AND r.merkle_root IS NOT NULL
+                AND NOT EXISTS (SELECT 1 FROM merkle_accumulators a WHERE a.rollup_date=r.date AND a.finalized_at IS NULL)
+                ORDER BY r.date LIMIT :n
+            """), {"live": live, "today": today, "n": limit}).fetchall()
+            for day, root in ready:
+                try: tx_hash = send_anchor(client, anchor_payload(day, root))
+                except Exception: stats["failed"] += 1; continue
+                conn.execute(text("UPDATE daily_rollups SET status='SUBMITTED', anchor_tx_hash=:h, anchor_chain=:c, anchor_block=NULL, anchored_at=NOW() WHERE date=:d AND merkle_root=:mr"), {"h": tx_hash, "c": tag, "d": day, "mr": root})
+                conn.commit(); stats["submitted"] += 1
+            # Rows tagged for another live chain are left for that chain's client; untagged and dev-chain rows are checked here.
+            submitted = conn.execute(text("""
+                SELECT date, anchor_tx_hash, anchor_chain, EXTRACT(EPOCH FROM NOW() - anchored_at) FROM daily_rollups
+                WHERE status='SUBMITTED' AND (anchor_chain=:c OR anchor_chain IS NULL OR (anchor_chain LIKE 'simulated:%' AND :live)) ORDER BY date
+            """), {"c": tag, "live": live}).fetchall()
+            for day, tx_hash, row_tag, age in submitted:
+                receipt = None
+                if row_tag in (tag, None): # a dev-chain tx can never turn up on the live chain
+                    try: receipt = client["w3"].eth.get_transaction_receipt(tx_hash)
+                    except Exception: pass
+                if receipt is None:
+                    # Dev chains mine instantly, so a missing receipt there means the chain is gone; live txs get ANCHOR_RESUBMIT_SECONDS.
+                    if row_tag != tag or client["simulated"] or (age or 0) > ANCHOR_RESUBMIT_SECONDS:
+                        conn.execute(text("UPDATE daily_rollups SET status='READY_FOR_L2' WHERE date=:d AND anchor_tx_hash=:h AND status='SUBMITTED'"), {"d": day, "h": tx_hash}); conn.commit()
+                    continue
+                record_receipt(client, tx_hash, receipt)
+                if receipt["status"] != 1:
+                    conn.execute(text("UPDATE daily_rollups SET status='READY_FOR_L2' WHERE date=:d AND anchor_tx_hash=:h"), {"d": day, "h": tx_hash}); conn.commit(); stats["failed"] += 1; continue
+                conn.execute(text("UPDATE daily_rollups SET status=:s, anchor_block=:b, anchor_chain=:c WHERE date=:d AND anchor_tx_hash=:h"), {"s": "CONFIRMED" if live else "SIMULATED", "b": receipt["blockNumber"], "c": tag, "d": day, "h": tx_hash})
+                if live: conn.execute(text("""
+                    UPDATE obt_ledger AS o SET encryption_hash=:h FROM merkle_leaves l, daily_rollups r
+                    WHERE l.claim_id=o.claim_id AND l.rollup_date=:d AND r.date=:d AND l.leaf_index < r.tx_count
+                """), {"h": tx_hash, "d": day})
+                conn.commit(); stats["confirmed"] += 1
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MINT_WORKER_LOCK_ID}); conn.commit()
+    return stats
+
+def finalize_closed_days(engine, limit=MINT_BATCH_SIZE):
+    """Publishes every accumulator whose LOCAL_TZ day has ended, so closed days reach READY_FOR_L2 without a manual Finalize. Returns days finalized."""
+    today = str(datetime.now(LOCAL_TZ).date())
+    with engine.connect() as conn:
+        days = [d for (d,) in conn.execute(text("SELECT rollup_date FROM merkle_accumulators WHERE finalized_at IS NULL AND rollup_date < :today ORDER BY rollup_date LIMIT :n"), {"today": today, "n": limit}).fetchall()]
+    return sum(finalize_rollup_day(d)[0] for d in days)
+
+def verify_accolade(token_id):
+    """An anchored accolade holds only if its claim's inclusion proof reaches the day's root, the day is CONFIRMED on a live chain,
+    and this process could read that anchor tx back and find the root in its calldata. Anything short of that carries a reason."""
+    row = run_query("SELECT o.claim_id, r.status, r.anchor_tx_hash, r.anchor_block, r.anchor_chain FROM obt_ledger o LEFT JOIN merkle_leaves l ON l.claim_id=o.claim_id LEFT JOIN daily_rollups r ON r.date=l.rollup_date WHERE o.token_id=:t", {"t": token_id})
+    if not row or not row[0][0]: return None
+    claim_id, status, anchor_tx, anchor_block, anchor_chain = row[0]
+    proof = get_inclusion_proof(claim_id)
+    if not proof: return {"claim_id": claim_id, "verified": False, "reason": "Claim is not in a finalized rollup yet."}
+    included = verify_proof(proof["leaf"], proof["siblings"], proof["root"], proof["scheme"])
+    on_chain, client = None, anchor_client() if anchor_tx else None
+    if client is not None and chain_tag(client) == anchor_chain:
+        try:
+            tx = client["w3"].eth.get_transaction(anchor_tx)
+            on_chain = bytes(tx.get("input", tx.get("data"))) == anchor_payload(proof["date"], proof["root"]) # eth-tester names calldata "data"
+        except Exception: on_chain = None
+    if not included: reason = "Inclusion proof does not reach the day's Merkle root."
+    elif status != "CONFIRMED": reason = {"SIMULATED": "The day's root was only anchored on a simulated dev chain.", "SUBMITTED": "The day's anchor transaction is awaiting confirmation."}.get(status, "The day's root has not been anchored yet.")
+    elif on_chain is None: reason = f"Anchor transaction could not be checked on chain ({anchor_chain or 'unknown chain'} is not reachable from this server)."
+    elif not on_chain: reason = "Anchor transaction calldata does not match the day's root."
+    else: reason = None
+    return {**proof, "anchor_status": status, "anchor_tx": anchor_tx, "anchor_block": anchor_block, "anchor_chain": anchor_chain, "included": included, "anchored_on_chain": on_chain, "verified": reason is None, "reason": reason}
+
+@st.cache_resource
+def get_mint_worker(_engine):
+    """Process-wide outbox drainer. Sessions only enqueue and set worker["wake"]; the worker owns the provider and its nonce counter."""
+    worker = {"wake": threading.Event(), "cycles": 0, "sent": 0, "confirmed": 0, "failed": 0, "days_finalized": 0, "anchors_submitted": 0, "anchors_confirmed": 0, "anchor_chain": None, "last_error": None}
+    def drain_forever():
+        while True:
+            worker["wake"].wait(MINT_POLL_SECONDS); worker["wake"].clear()
+            try:
+                client = get_web3_client() if web3_ready() else None
+                stats = process_mint_outbox(_engine, client)
+                for k, v in stats.items(): worker[k] += v
+                worker["days_finalized"] += finalize_closed_days(_engine)
+                anchors_via = anchor_client()
+                worker["anchor_chain"] = None if anchors_via is None else ("simulated" if anchors_via["simulated"] else "live")
+                if anchors_via is not None:
+                    anchors = process_rollup_anchors(_engine, anchors_via)
+                    worker["anchors_submitted"] += anchors["submitted"]; worker["anchors_confirmed"] += anchors["confirmed"]; worker["failed"] += anchors["failed"]
+                worker["cycles"] += 1
+            except Exception as e: worker["last_error"] = str(e)
+    worker["thread"] = threading.Thread(target=drain_forever, name="mint-outbox", daemon=True)
+    worker["thread"].start()
+    return worker
 
 # --- GLOBAL CONSTANTS ---
-LOCAL_TZ = pytz.timezone('US/Eastern')
 GEOFENCE_RADIUS = 150
 HOSPITALS = {"Hospital A": {"lat": 0.0, "lon": 0.0}, "Hospital B": {"lat": 0.0, "lon": 0.0}}
 OPSEC_PW_EXPIRY_DAYS = 90
@@ -75,306 +356,732 @@ def is_strong_password(password):
     if not re.search(r"[!@#$%^&*(),.?\":{}|<>]", password): return False, "Must contain a special character."
     return True, "Valid"
 
-def hash_password(plain_text_password): return bcrypt.hashpw(plain_text_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-def verify_password(plain_text_password, hashed_password):
-    try: return bcrypt.checkpw(plain_text_password.encode('utf-8'), hashed_password.encode('utf-8'))
-    except Exception: return False
-def generate_secure_checksum(doc_number, pin): return hashlib.sha256(f"{doc_number}-{pin}-{os.environ.get('SECURE_SALT', 'EC_PROTOCOL_ENTERPRISE_SALT')}".encode('utf-8')).hexdigest()
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", 1)) # reverse proxies in front of the app that append to X-Forwarded-For
+
 
-def generate_poc_hash(claim_id, pin, room, action, timestamp_str):
-    raw_data = f"{claim_id}|{pin}|{room}|{action}|{timestamp_str}|{os.environ.get('SECURE_SALT', 'CLINICAL_LEDGER_SALT')}"
-    return hashlib.sha256(raw_data.encode('utf-8')).hexdigest()
+@st.cache_resource
+def get_auth_rate_limiter(): return new_auth_rate_limiter()
+
+def get_client_ip():
+    """The address our own proxies saw. Clients control everything left of the hops those proxies appended, so the
+    limiter keys on the TRUSTED_PROXY_COUNT-th entry from the right; with no proxy, X-Forwarded-For is ignored entirely."""
+    try: headers = st.context.headers
+    except Exception: return "unknown"
+    hops = [h.strip() for h in headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+    if TRUSTED_PROXY_COUNT > 0 and hops: return hops[-min(TRUSTED_PROXY_COUNT, len(hops))]
+    if TRUSTED_PROXY_COUNT > 0 and headers.get("X-Real-Ip"): return headers.get("X-Real-Ip")
+    return getattr(st.context, "ip_address", None) or "unknown"
+
+def generate_secure_checksum(doc_number, pin): return hashlib.sha256(f"{doc_number}-{pin}-{os.environ.get('SECURE_SALT', 'EC_PROTOCOL_ENTERPRISE_SALT')}".encode('utf-8')).hexdigest()
 
 # --- MERKLE TREE LAYER 2 BATCHING ---
+# "sha256-bin" hashes the raw 32-byte digests. "legacy-hex" reproduces the original text-concatenation roots.
+# Both sort each pair before hashing, so proofs need no left/right flags, and both duplicate the odd node out on a level.
+MERKLE_DEFAULT_SCHEME = os.environ.get("MERKLE_SCHEME", "sha256-bin")
+MERKLE_CHUNK_SIZE = 5000
+
 def hash_pair(hash1, hash2):
     combined = "".join(sorted([hash1, hash2]))
     return hashlib.sha256(combined.encode('utf-8')).hexdigest()
 
-def build_merkle_root(hash_list):
-    if not hash_list: return None
-    if len(hash_list) == 1: return hash_list[0] 
-    new_level = []
-    for i in range(0, len(hash_list), 2):
-        h1 = hash_list[i]
-        h2 = hash_list[i+1] if (i + 1) < len(hash_list) else h1
-        new_level.append(hash_pair(h1, h2))
-    return build_merkle_root(new_level)
-
-def execute_daily_rollup(target_date_str):
-    raw_claims = run_query("SELECT secure_hash FROM poc_ledger WHERE CAST(timestamp AS TEXT) LIKE :d", {"d": f"{target_date_str}%"})
-    if not raw_claims: return False, "No claims found for this date."
-    hash_list = [claim[0] for claim in raw_claims if claim[0]]
-    if not hash_list: return False, "No valid secure hashes found."
-    merkle_root = build_merkle_root(hash_list)
-    run_transaction("INSERT INTO daily_rollups (date, merkle_root, tx_count, status) VALUES (:d, :mr, :c, 'READY_FOR_L2') ON CONFLICT (date) DO UPDATE SET merkle_root=:mr, tx_count=:c", {"d": target_date_str, "mr": merkle_root, "c": len(hash_list)})
-    return True, merkle_root
-
-# --- BULLETPROOF PDF GENERATOR ---
-def safe_pdf_bytes(pdf_obj):
-    """Writes to temp file and reads as raw bytes to prevent browser corruption errors."""
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            pdf_obj.output(tmp.name)
-            tmp_path = tmp.name
-        with open(tmp_path, "rb") as f:
-            pdf_bytes = f.read()
-        os.remove(tmp_path)
-        return pdf_bytes
-    except Exception: return None
-
-def create_paystub_txt(name, date_str, tx_id, gross, net, tax, dest, shifts_data=None):
-    lines = [
-        "===================================================",
-        "    VICENTUS ENTERPRISE - OFFICIAL PAY RECEIPT     ",
-        "===================================================",
-        f"Operator: {name}",
-        f"Date of Settlement: {date_str}",
-        f"Ledger Tx ID: {tx_id}",
-        f"Routing Method: Fiat Direct Deposit",
-        f"Destination: {dest}",
-        "---------------------------------------------------",
-        "Validated Shift Coverage (Clock In -> Clock Out):"
-    ]
-    if shifts_data and len(shifts_data) > 0:
-        for s_in, s_out in shifts_data: lines.append(f"  * IN: {s_in}    |    OUT: {s_out}")
-    else: lines.append("  * Standard Aggregate Payout (Verified via History Ledger)")
-    lines.extend([
-        "---------------------------------------------------",
-        f"Gross Pay: ${gross:,.2f}",
-        f"Progressive Tax Withholding: ${tax:,.2f}",
-        f"Net Settlement: ${net:,.2f}",
-        "---------------------------------------------------",
-        "This is a cryptographically verifiable ledger receipt."
-    ])
-    return "\n".join(lines).encode('utf-8')
-
-def generate_compliance_report_txt(dept_name, manager_name):
-    lines = [
-        "===================================================",
-        "       VICENTUS COMPLIANCE & PROTOCOL AUDIT        ",
-        "===================================================",
-        f"Department: {dept_name} | Generated By: {manager_name}",
-        f"Date: {datetime.now(LOCAL_TZ).strftime('%Y-%m-%d %H:%M')}",
-        "\nACTIVE PROTOCOLS:",
-        "---------------------------------------------------"
-    ]
-    active_p = run_query("SELECT title, next_review FROM hospital_protocols WHERE status='ACTIVE' AND (department=:d OR department='All')", {"d": dept_name})
-    if active_p:
-        for p in active_p: lines.append(f"[PASS] {p[0]} (Valid until {p[1]})")
-    else: lines.append("No active protocols found.")
-    
-    lines.extend(["\nRECENT PROOF-OF-CARE EXCEPTIONS:", "---------------------------------------------------"])
-    poc_issues = run_query("SELECT claim_id, action, emr_verified FROM poc_ledger WHERE emr_verified=FALSE ORDER BY timestamp DESC LIMIT 5")
-    if poc_issues:
-        for c in poc_issues: lines.append(f"[FLAG] Claim {c[0]}: {c[1]} - EMR SYNC PENDING")
-    else: lines.append("All recent clinical actions properly synced with EMR.")
-    
-    lines.extend(["\n===================================================", "      End of Official Vicentus Audit Report.       "])
-    return "\n".join(lines).encode('utf-8')
-
-def create_paystub_pdf(name, date_str, tx_id, gross, net, tax, dest, shifts_data=None):
-    if not PDF_ACTIVE: return create_paystub_txt(name, date_str, tx_id, gross, net, tax, dest, shifts_data)
-    try:
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(190, 10, txt="VICENTUS ENTERPRISE - OFFICIAL PAY RECEIPT", ln=True, align='C')
-        pdf.set_font("Arial", '', 12)
-        pdf.ln(10)
-        pdf.cell(100, 8, txt=f"Operator: {name}", ln=True)
-        pdf.cell(100, 8, txt=f"Date of Settlement: {date_str}", ln=True)
-        pdf.cell(100, 8, txt=f"Ledger Tx ID: {tx_id}", ln=True)
-        pdf.cell(100, 8, txt=f"Routing Method: Fiat Direct Deposit", ln=True)
-        pdf.cell(100, 8, txt=f"Destination: {dest}", ln=True)
-        pdf.ln(5)
-        pdf.set_font("Arial", 'B', 12)
-        pdf.line(10, 75, 200, 75)
-        pdf.ln(5)
-        pdf.cell(190, 8, txt="Validated Shift Coverage (Clock In -> Clock Out):", ln=True)
-        pdf.set_font("Arial", '', 10)
-        
-        if shifts_data and len(shifts_data) > 0:
-            for s_in, s_out in shifts_data:
-                pdf.cell(190, 6, txt=f"  * IN: {s_in}    |    OUT: {s_out}", ln=True)
+def merkle_pair(left, right, scheme=MERKLE_DEFAULT_SCHEME):
+    if scheme == "legacy-hex": return bytes.fromhex(hash_pair(left.hex(), right.hex()))
+    return hashlib.sha256(min(left, right) + max(left, right)).digest()
+
+def merkle_builder(scheme=MERKLE_DEFAULT_SCHEME, on_node=None):
+    """Streaming builder state. Holds one pending node per level (O(log n) memory); on_node(level, idx, digest) sees every node as it is created."""
+    return {"scheme": scheme, "frontier": {}, "counts": defaultdict(int), "leaves": 0, "on_node": on_node}
+
+def merkle_emit(builder, level, digest):
+    idx = builder["counts"][level]; builder["counts"][level] += 1
+    if builder["on_node"]: builder["on_node"](level, idx, digest)
+
+def merkle_append(builder, leaf):
+    merkle_emit(builder, 0, leaf); builder["leaves"] += 1
+    level, node = 0, leaf
+    while level in builder["frontier"]:
+        node = merkle_pair(builder["frontier"].pop(level), node, builder["scheme"]); level += 1
+        merkle_emit(builder, level, node)
+    builder["frontier"][level] = node
+
+def merkle_restore(leaf_count, peaks, scheme=MERKLE_DEFAULT_SCHEME, on_node=None):
+    """Rebuilds builder state from a leaf count and its concatenated 32-byte peaks. Peaks sit on the set bits of leaf_count, lowest level first."""
+    builder = merkle_builder(scheme, on_node)
+    levels = [lv for lv in range(leaf_count.bit_length()) if leaf_count >> lv & 1]
+    builder["frontier"] = {lv: peaks[i * 32:(i + 1) * 32] for i, lv in enumerate(levels)}
+    for lv in range(leaf_count.bit_length()): builder["counts"][lv] = leaf_count >> lv
+    builder["leaves"] = leaf_count
+    return builder
+
+def merkle_peaks(builder):
+    return b"".join(builder["frontier"][lv] for lv in sorted(builder["frontier"]))
+
+def merkle_finalize(builder):
+    """Closes the tree exactly as the level-by-level build would, duplicating the last node of every odd-sized level."""
+    frontier, scheme = builder["frontier"], builder["scheme"]
+    if not frontier: return None
+    top = max(frontier); carry = None
+    for level in range(top):
+        node = frontier.get(level)
+        if node is None and carry is None: continue
+        if node is not None and carry is not None: carry = merkle_pair(node, carry, scheme)
         else:
-            pdf.cell(190, 6, txt="  * Standard Aggregate Payout (Verified via History Ledger)", ln=True)
-            
-        pdf.ln(5)
-        current_y = pdf.get_y()
-        pdf.line(10, current_y, 200, current_y)
-        pdf.ln(5)
-        pdf.set_font("Arial", '', 12)
-        pdf.cell(100, 10, txt=f"Gross Pay: ${gross:,.2f}", ln=True)
-        pdf.cell(100, 10, txt=f"Progressive Tax Withholding: ${tax:,.2f}", ln=True)
-        pdf.set_font("Arial", 'B', 14)
-        pdf.cell(100, 10, txt=f"Net Settlement: ${net:,.2f}", ln=True)
-        pdf.ln(5)
-        current_y = pdf.get_y()
-        pdf.line(10, current_y, 200, current_y)
-        pdf.ln(10)
-        pdf.set_font("Arial", 'I', 10)
-        pdf.cell(190, 10, txt="This is a cryptographically verifiable ledger receipt generated by Vicentus.", ln=True, align='C')
-        return safe_pdf_bytes(pdf)
-    except Exception: return create_paystub_txt(name, date_str, tx_id, gross, net, tax, dest, shifts_data)
-
-def generate_compliance_report(dept_name, manager_name):
-    if not PDF_ACTIVE: return generate_compliance_report_txt(dept_name, manager_name)
+            odd = node if node is not None else carry
+            carry = merkle_pair(odd, odd, scheme)
+        merkle_emit(builder, level + 1, carry)
+    if carry is None: return frontier[top]
+    root = merkle_pair(frontier[top], carry, scheme)
+    merkle_emit(builder, top + 1, root)
+    return root
+
+def build_merkle_root(hash_list, scheme="legacy-hex"):
+    builder = merkle_builder(scheme)
+    for h in hash_list: merkle_append(builder, bytes.fromhex(h))
+    root = merkle_finalize(builder)
+    return root.hex() if root is not None else None
+
+def merkle_proof_path(leaf_index, leaf_count):
+    """(level, sibling_idx) for every level below the root. A missing sibling on an odd level is the node itself."""
+    path, idx, size, level = [], leaf_index, leaf_count, 0
+    while size > 1:
+        sibling = idx ^ 1
+        path.append((level, sibling if sibling < size else idx))
+        idx //= 2; size = (size + 1) // 2; level += 1
+    return path
+
+def verify_proof(leaf_hex, sibling_hexes, root_hex, scheme=MERKLE_DEFAULT_SCHEME):
+    node = bytes.fromhex(leaf_hex)
+    for sibling in sibling_hexes: node = merkle_pair(node, bytes.fromhex(sibling), scheme)
+    return node.hex() == root_hex
+
+def get_inclusion_proof(claim_id):
+    leaf = run_query("SELECT l.rollup_date, l.leaf_index, r.merkle_root, r.merkle_scheme, r.tx_count FROM merkle_leaves l JOIN daily_rollups r ON r.date = l.rollup_date WHERE l.claim_id=:c", {"c": claim_id})
+    if not leaf: return None
+    rollup_date, leaf_index, root_hex, scheme, leaf_count = leaf[0]
+    if int(leaf_index) >= int(leaf_count): return None # sealed after the day was last finalized
+    path = merkle_proof_path(int(leaf_index), int(leaf_count))
+    wanted = [(0, int(leaf_index))] + path
+    # unnest pairs the two arrays positionally, so only the exact (level, idx) path nodes are read, not their cross product.
+    nodes = run_query("SELECT n.level, n.idx, n.hash FROM unnest(CAST(:lv AS INT[]), CAST(:ix AS BIGINT[])) AS w(level, idx) JOIN merkle_nodes n ON n.rollup_date=:d AND n.level=w.level AND n.idx=w.idx", {"d": rollup_date, "lv": [w[0] for w in wanted], "ix": [w[1] for w in wanted]})
+    by_pos = {(int(n[0]), int(n[1])): bytes(n[2]).hex() for n in nodes} if nodes else {}
+    if any(w not in by_pos for w in wanted): return None
+    return {"claim_id": claim_id, "date": rollup_date, "leaf_index": int(leaf_index), "leaf": by_pos[wanted[0]], "siblings": [by_pos[w] for w in path], "root": root_hex, "scheme": scheme}
+
+def local_day_bounds(first_day, last_day):
+    """Half-open [local midnight of first_day, local midnight after last_day) as aware datetimes, so 23h/25h DST days are exact."""
+    range_start = LOCAL_TZ.localize(datetime.combine(first_day, datetime.min.time()))
+    range_end = LOCAL_TZ.localize(datetime.combine(last_day + timedelta(days=1), datetime.min.time()))
+    return range_start, range_end
+
+def execute_rollup_range(first_day, last_day, scheme=MERKLE_DEFAULT_SCHEME):
+    """Rolls up every rollup day in [first_day, last_day] in one pass over a (rollup_date, timestamp)-sorted server-side cursor.
+    Each day's tree is finalized when the cursor crosses into the next day, so only one frontier is ever in memory.
+    Only LOCAL_TZ days that have ended can be rolled up: finalizing an open day would push its later seals onto the next day."""
+    if last_day >= datetime.now(LOCAL_TZ).date(): raise ValueError(f"{last_day} has not ended yet ({LOCAL_TZ.zone}); only closed days can be rolled up.")
+    roots = {}
+    with db_unit_of_work() as uow:
+        run_query("SELECT pg_advisory_xact_lock(:k)", {"k": POC_ACCUMULATOR_LOCK_ID}, conn=uow)
+        run_transaction("DELETE FROM merkle_accumulators WHERE rollup_date >= :a AND rollup_date <= :b", {"a": str(first_day), "b": str(last_day)}, conn=uow)
+        run_transaction("DELETE FROM merkle_nodes WHERE rollup_date >= :a AND rollup_date <= :b", {"a": str(first_day), "b": str(last_day)}, conn=uow)
+        run_transaction("DELETE FROM merkle_leaves WHERE rollup_date >= :a AND rollup_date <= :b", {"a": str(first_day), "b": str(last_day)}, conn=uow)
+        node_buf, leaf_buf = [], []
+        current = {"day": None, "builder": None}
+        def flush_buffers():
+            if node_buf: run_transaction("INSERT INTO merkle_nodes (rollup_date, level, idx, hash) VALUES (:d, :l, :i, :h)", list(node_buf), conn=uow); node_buf.clear()
+            if leaf_buf: run_transaction("INSERT INTO merkle_leaves (claim_id, rollup_date, leaf_index) VALUES (:c, :d, :i) ON CONFLICT (claim_id) DO UPDATE SET rollup_date=:d, leaf_index=:i", list(leaf_buf), conn=uow); leaf_buf.clear()
+        def close_day():
+            builder = current["builder"]
+            root = merkle_finalize(builder)
+            flush_buffers()
+            run_transaction("INSERT INTO daily_rollups (date, merkle_root, tx_count, status, merkle_scheme) VALUES (:d, :mr, :c, 'READY_FOR_L2', :sc) ON CONFLICT (date) DO UPDATE SET status=CASE WHEN daily_rollups.merkle_root=:mr THEN daily_rollups.status ELSE 'READY_FOR_L2' END, merkle_root=:mr, tx_count=:c, merkle_scheme=:sc", {"d": current["day"], "mr": root.hex(), "c": builder["leaves"], "sc": scheme}, conn=uow)
+            run_transaction("INSERT INTO merkle_accumulators (rollup_date, scheme, leaf_count, peaks, updated_at, finalized_at) VALUES (:d, :sc, :n, :pk, NOW(), NOW())", {"d": current["day"], "sc": scheme, "n": builder["leaves"], "pk": merkle_peaks(builder)}, conn=uow)
+            roots[current["day"]] = (root.hex(), builder["leaves"])
+        claims = uow.execute(text(SQL_POC_DAY_RANGE).execution_options(stream_results=True, yield_per=MERKLE_CHUNK_SIZE), {"a": str(first_day), "b": str(last_day)})
+        for chunk in claims.partitions(MERKLE_CHUNK_SIZE):
+            for claim_id, secure_hash, rollup_day in chunk:
+                day_str = str(rollup_day)
+                if day_str != current["day"]:
+                    if current["builder"]: close_day()
+                    current["day"] = day_str
+                    current["builder"] = merkle_builder(scheme, on_node=lambda level, idx, digest, d=day_str: node_buf.append({"d": d, "l": level, "i": idx, "h": digest}))
+                leaf_buf.append({"c": claim_id, "d": day_str, "i": current["builder"]["leaves"]})
+                merkle_append(current["builder"], bytes.fromhex(secure_hash))
+            flush_buffers()
+        if current["builder"]: close_day()
+    return roots
+
+def execute_daily_rollup(target_date_str, scheme=MERKLE_DEFAULT_SCHEME):
+    try: roots = execute_rollup_range(date.fromisoformat(target_date_str), date.fromisoformat(target_date_str), scheme)
+    except Exception as e: return False, f"Rollup aborted: {e}"
+    if target_date_str not in roots: return False, "No claims with valid secure hashes found for this date."
+    return True, roots[target_date_str][0]
+
+# --- INCREMENTAL MERKLE ACCUMULATOR (one row of peaks per LOCAL_TZ day, appended at seal time) ---
+POC_ACCUMULATOR_LOCK_ID = 60050002 # pg_advisory_xact_lock key serializing seals, finalization and rebuilds
+
+def seal_poc_claim(claim_id, pin, room, action, secure_hash, seal_ts, conn):
+    """Inserts a sealed claim and appends it to its day's accumulator inside the caller's unit of work: O(log n) node writes per seal.
+    Taking the lock before stamping clock_timestamp() keeps leaf order identical to the (rollup_date, timestamp, claim_id) order a full rebuild uses.
+    A finalized day is closed (its root may already be published or anchored), so a seal landing on one rolls forward to the next open day."""
+    run_query("SELECT pg_advisory_xact_lock(:k)", {"k": POC_ACCUMULATOR_LOCK_ID}, conn=conn)
+    run_transaction("INSERT INTO poc_ledger (claim_id, pin, patient_room, action, timestamp, ble_verified, emr_verified, ai_verified, status, secure_hash, seal_ts) VALUES (:cid, :p, :r, :a, clock_timestamp(), TRUE, FALSE, TRUE, 'PENDING_EMR', :h, :ts)", {"cid": claim_id, "p": pin, "r": room, "a": action, "h": secure_hash, "ts": seal_ts}, conn=conn)
+    day_str = str(run_query("SELECT (timestamp::timestamptz AT TIME ZONE :tz)::date FROM poc_ledger WHERE claim_id=:cid", {"tz": LOCAL_TZ.zone, "cid": claim_id}, conn=conn)[0][0])
+    while True:
+        acc = run_query("SELECT scheme, leaf_count, peaks, finalized_at FROM merkle_accumulators WHERE rollup_date=:d", {"d": day_str}, conn=conn)
+        if not acc or acc[0][3] is None: break
+        day_str = str(date.fromisoformat(day_str) + timedelta(days=1))
+    run_transaction("UPDATE poc_ledger SET rollup_date=:d WHERE claim_id=:cid", {"d": day_str, "cid": claim_id}, conn=conn)
+    scheme, leaf_count, peaks = acc[0][:3] if acc else (MERKLE_DEFAULT_SCHEME, 0, b"")
+    node_buf = []
+    builder = merkle_restore(int(leaf_count), bytes(peaks or b""), scheme, on_node=lambda level, idx, digest: node_buf.append({"d": day_str, "l": level, "i": idx, "h": digest}))
+    merkle_append(builder, bytes.fromhex(secure_hash))
+    run_transaction("INSERT INTO merkle_nodes (rollup_date, level, idx, hash) VALUES (:d, :l, :i, :h) ON CONFLICT (rollup_date, level, idx) DO UPDATE SET hash=EXCLUDED.hash", node_buf, conn=conn)
+    run_transaction("INSERT INTO merkle_leaves (claim_id, rollup_date, leaf_index) VALUES (:c, :d, :i) ON CONFLICT (claim_id) DO UPDATE SET rollup_date=:d, leaf_index=:i", {"c": claim_id, "d": day_str, "i": int(leaf_count)}, conn=conn)
+    run_transaction("INSERT INTO merkle_accumulators (rollup_date, scheme, leaf_count, peaks, updated_at) VALUES (:d, :sc, :n, :pk, NOW()) ON CONFLICT (rollup_date) DO UPDATE SET leaf_count=:n, peaks=:pk, updated_at=NOW()", {"d": day_str, "sc": scheme, "n": builder["leaves"], "pk": merkle_peaks(builder)}, conn=conn)
+    return day_str
+
+def get_live_merkle_root(day_str):
+    """Current root of a day's accumulator, computed from its stored peaks without reading the ledger or persisting closing nodes."""
+    acc = run_query("SELECT scheme, leaf_count, peaks, finalized_at FROM merkle_accumulators WHERE rollup_date=:d", {"d": day_str})
+    if not acc: return None
+    scheme, leaf_count, peaks, finalized_at = acc[0]
+    root = merkle_finalize(merkle_restore(int(leaf_count), bytes(peaks), scheme))
+    return {"date": day_str, "root": root.hex(), "leaves": int(leaf_count), "scheme": scheme, "finalized": finalized_at is not None}
+
+def finalize_rollup_day(day_str):
+    """Publishes a day's accumulator to daily_rollups. Only the O(log n) closing nodes are computed; the ledger is never rescanned."""
+    if day_str >= str(datetime.now(LOCAL_TZ).date()): return False, f"{day_str} has not ended yet ({LOCAL_TZ.zone}); it can be finalized from tomorrow."
     try:
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(190, 10, txt="VICENTUS COMPLIANCE & PROTOCOL AUDIT", ln=True, align='C')
-        pdf.set_font("Arial", 'I', 10)
-        pdf.cell(190, 6, txt=f"Department: {dept_name} | Generated By: {manager_name} | Date: {datetime.now(LOCAL_TZ).strftime('%Y-%m-%d %H:%M')}", ln=True, align='C')
-        pdf.ln(10)
-        
-        pdf.set_font("Arial", 'B', 12)
-        pdf.cell(190, 8, txt="ACTIVE PROTOCOLS:", ln=True)
-        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-        pdf.ln(2)
-        
-        pdf.set_font("Arial", '', 10)
-        active_p = run_query("SELECT title, next_review FROM hospital_protocols WHERE status='ACTIVE' AND (department=:d OR department='All')", {"d": dept_name})
-        if active_p:
-            for p in active_p: pdf.cell(190, 6, txt=f"[PASS] {p[0]} (Valid until {p[1]})", ln=True)
-        else:
-            pdf.cell(190, 6, txt="No active protocols found.", ln=True)
-            
-        pdf.ln(10)
-        pdf.set_font("Arial", 'B', 12)
-        pdf.cell(190, 8, txt="RECENT PROOF-OF-CARE EXCEPTIONS:", ln=True)
-        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-        pdf.ln(2)
-        
-        pdf.set_font("Arial", '', 10)
-        poc_issues = run_query("SELECT claim_id, action, emr_verified FROM poc_ledger WHERE emr_verified=FALSE ORDER BY timestamp DESC LIMIT 5")
-        if poc_issues:
-            for c in poc_issues: pdf.cell(190, 6, txt=f"[FLAG] Claim {c[0]}: {c[1]} - EMR SYNC PENDING", ln=True)
+        with db_unit_of_work() as uow:
+            run_query("SELECT pg_advisory_xact_lock(:k)", {"k": POC_ACCUMULATOR_LOCK_ID}, conn=uow)
+            acc = run_query("SELECT scheme, leaf_count, peaks FROM merkle_accumulators WHERE rollup_date=:d", {"d": day_str}, conn=uow)
+            if not acc: return False, "No sealed claims accumulated for this date."
+            scheme, leaf_count, peaks = acc[0]
+            node_buf = []
+            root = merkle_finalize(merkle_restore(int(leaf_count), bytes(peaks), scheme, on_node=lambda level, idx, digest: node_buf.append({"d": day_str, "l": level, "i": idx, "h": digest})))
+            if node_buf: run_transaction("INSERT INTO merkle_nodes (rollup_date, level, idx, hash) VALUES (:d, :l, :i, :h) ON CONFLICT (rollup_date, level, idx) DO UPDATE SET hash=EXCLUDED.hash", node_buf, conn=uow)
+            run_transaction("INSERT INTO daily_rollups (date, merkle_root, tx_count, status, merkle_scheme) VALUES (:d, :mr, :c, 'READY_FOR_L2', :sc) ON CONFLICT (date) DO UPDATE SET status=CASE WHEN daily_rollups.merkle_root=:mr THEN daily_rollups.status ELSE 'READY_FOR_L2' END, merkle_root=:mr, tx_count=:c, merkle_scheme=:sc", {"d": day_str, "mr": root.hex(), "c": int(leaf_count), "sc": scheme}, conn=uow)
+            run_transaction("UPDATE merkle_accumulators SET finalized_at=NOW() WHERE rollup_date=:d", {"d": day_str}, conn=uow)
+        return True, root.hex()
+    except Exception as e: return False, f"Finalization aborted: {e}"
+
+# --- POC LEDGER INTEGRITY AUDIT ---
+POC_AUDIT_CHUNK_SIZE = 20000
+POC_AUDIT_WORKERS = int(os.environ.get("POC_AUDIT_WORKERS", os.cpu_count() or 1))
+
+def pool_context():
+    """Start method for the process pools. Never fork: this server runs the mint, change-feed and ingest threads and holds pooled
+    DB sockets, all of which a forked child would inherit mid-state. Children start clean and import their work from pool_workers."""
+    return multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+def sign_audit_summary(summary):
+    """HMAC-SHA256 under AUDIT_SIGNING_KEY, or None when no key is configured. There is deliberately no fallback: a default
+    key ships with the source, so anything signed with it could be forged by anyone."""
+    key = os.environ.get("AUDIT_SIGNING_KEY")
+    if not key: return None
+    return hmac.new(key.encode('utf-8'), json.dumps(summary, sort_keys=True, default=str).encode('utf-8'), hashlib.sha256).hexdigest()
+
+def verify_audit_signature(summary, signature):
+    """True/False for a signed summary; None when the summary is unsigned or no key is configured to check it."""
+    expected = sign_audit_summary(summary)
+    if not signature or expected is None: return None
+    return hmac.compare_digest(expected, signature)
+
+def audit_poc_ledger(max_workers=POC_AUDIT_WORKERS, chunk_size=POC_AUDIT_CHUNK_SIZE):
+    """Streams poc_ledger in chunks and re-derives every secure_hash across a process pool, keeping at most two chunks per worker in flight.
+    Only the parent reads the database; workers get plain row tuples and SECURE_SALT from the environment. One worker checks in-process."""
+    engine = get_db_engine()
+    if isinstance(engine, str) or engine is None: return False, "Database offline."
+    workers = max(1, max_workers)
+    totals = {"rows": 0, "reconstructed": 0}; mismatches = []
+    def collect(result):
+        checked, reconstructed, bad = result
+        totals["rows"] += checked; totals["reconstructed"] += reconstructed; mismatches.extend(bad)
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            stream = conn.execute(text("SELECT claim_id, pin, patient_room, action, seal_ts, secure_hash FROM poc_ledger ORDER BY claim_id").execution_options(stream_results=True, yield_per=chunk_size))
+            chunks = ([tuple(r) for r in chunk] for chunk in stream.partitions(chunk_size))
+            if workers <= 1:
+                for chunk in chunks: collect(verify_poc_chunk(chunk))
+            else:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+                    inflight = deque()
+                    for chunk in chunks:
+                        inflight.append(pool.submit(verify_poc_chunk, chunk))
+                        if len(inflight) >= workers * 2: collect(inflight.popleft().result())
+                    while inflight: collect(inflight.popleft().result())
+    except Exception as e:
+        record_db_error("poc_ledger audit", e)
+        return False, f"Audit aborted: {e}"
+    seconds = time.perf_counter() - started
+    rate = totals["rows"] / seconds if seconds > 0 else 0.0
+    summary = {
+        "audited_at": datetime.now(LOCAL_TZ).isoformat(timespec="seconds"), "rows": totals["rows"], "mismatches": len(mismatches),
+        "verified_by_reconstruction": totals["reconstructed"], "workers": workers, "seconds": round(seconds, 3),
+        "hashes_per_sec": round(rate, 1), "hashes_per_sec_per_core": round(rate / workers, 1),
+        "mismatch_digest": hashlib.sha256("\n".join(sorted(m["claim_id"] for m in mismatches)).encode('utf-8')).hexdigest(),
+    }
+    signature = sign_audit_summary(summary)
+    run_transaction("INSERT INTO poc_audits (audit_id, rows_checked, mismatches, summary, signature) VALUES (:a, :r, :m, :s, :sig)", {"a": f"AUD-{int(time.time()*1000)}", "r": summary["rows"], "m": summary["mismatches"], "s": json.dumps(summary, sort_keys=True), "sig": signature})
+    return True, {"summary": summary, "signature": signature, "mismatches": mismatches}
+
+# --- RECEIPT & REPORT CACHES (renderers live in pool_workers) ---
+RECEIPT_CACHE_MAX_BYTES = int(os.environ.get("RECEIPT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+@st.cache_resource
+def get_receipt_cache():
+    """Process-wide LRU of rendered receipts. Settled payouts are immutable, so an entry stays valid for as long as it is kept."""
+    return {"lock": threading.Lock(), "items": {}, "bytes": 0, "hits": 0, "misses": 0}
+
+def cached_paystub(name, date_str, tx_id, gross, net, tax, dest, shifts_data=None):
+    """create_paystub_pdf behind the receipt cache. The key is the tx_id plus a digest of every rendered field, so a hit is byte-identical to a fresh render."""
+    key = (tx_id, hashlib.sha256(repr((name, date_str, gross, net, tax, dest, shifts_data, PDF_ACTIVE)).encode('utf-8')).hexdigest())
+    cache = get_receipt_cache()
+    with cache["lock"]:
+        if key in cache["items"]:
+            cache["items"][key] = cache["items"].pop(key); cache["hits"] += 1
+            return cache["items"][key]
+        cache["misses"] += 1
+    file_data = create_paystub_pdf(name, date_str, tx_id, gross, net, tax, dest, shifts_data)
+    if not file_data: return file_data
+    with cache["lock"]:
+        if key not in cache["items"]: cache["items"][key] = file_data; cache["bytes"] += len(file_data)
+        while cache["bytes"] > RECEIPT_CACHE_MAX_BYTES and len(cache["items"]) > 1:
+            cache["bytes"] -= len(cache["items"].pop(next(iter(cache["items"]))))
+    return file_data
+
+def fetch_compliance_data(dept_name):
+    """Everything a compliance report prints, as plain tuples, so rendering needs no database (and can run in a pool worker)."""
+    active_p = run_query(SQL_ACTIVE_PROTOCOLS, {"d": dept_name})
+    poc_issues = run_query(SQL_POC_EMR_EXCEPTIONS)
+    return {"protocols": [tuple(p) for p in active_p or []], "poc_issues": [tuple(c) for c in poc_issues or []], "generated_at": datetime.now(LOCAL_TZ).strftime('%Y-%m-%d %H:%M')}
+
+def generate_compliance_report(dept_name, manager_name, data=None):
+    return render_compliance_report(dept_name, manager_name, data or fetch_compliance_data(dept_name))
+
+@st.cache_resource
+def get_compliance_report_cache():
+    return {"lock": threading.Lock(), "items": {}}
+
+def cached_compliance_report(dept_name, manager_name):
+    """Builds a department's audit at most once per manager, LOCAL_TZ day and poc_ledger change-feed version; the report prints who
+    generated it, so managers never share an entry. A ledger write or a new day supersedes the entry, which is dropped on the next build."""
+    today = str(datetime.now(LOCAL_TZ).date())
+    key = (dept_name, manager_name, today, change_version(("poc_ledger",)))
+    cache = get_compliance_report_cache()
+    with cache["lock"]:
+        for stale in [k for k in cache["items"] if k[2] != today or (k[:2] == key[:2] and k != key)]: del cache["items"][stale]
+        if key in cache["items"]: return cache["items"][key]
+    report = generate_compliance_report(dept_name, manager_name)
+    if report:
+        with cache["lock"]: cache["items"][key] = report
+    return report
+
+# --- BULK EXPORT (process-pool rendering streamed into a ZIP) ---
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", os.cpu_count() or 1))
+
+def export_zip(jobs, zip_file, on_progress=None, max_workers=EXPORT_WORKERS):
+    """Renders jobs across a process pool (see pool_context) and writes each file into the archive as soon as it arrives.
+    At most two renders per worker are in flight, so only the compressed archive grows with the file count. zip_file is a path or a
+    writable binary file object such as io.BytesIO. Returns files written."""
+    workers = max(1, max_workers)
+    progress = {"done": 0, "written": 0}
+    with zipfile.ZipFile(zip_file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        def write(result):
+            arcname, data = result
+            if data: zf.writestr(arcname, data); progress["written"] += 1
+            progress["done"] += 1
+            if on_progress: on_progress(progress["done"], len(jobs))
+        if workers <= 1 or len(jobs) < 2:
+            for job in jobs: write(render_export_job(job))
         else:
-            pdf.cell(190, 6, txt="All recent clinical actions properly synced with EMR.", ln=True)
-            
-        pdf.ln(15)
-        pdf.set_font("Arial", 'I', 8)
-        pdf.cell(190, 10, txt="End of Official Vicentus Audit Report.", ln=True, align='C')
-        return safe_pdf_bytes(pdf)
-    except Exception: return generate_compliance_report_txt(dept_name, manager_name)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as pool:
+                inflight = deque()
+                for job in jobs:
+                    inflight.append(pool.submit(render_export_job, job))
+                    if len(inflight) >= workers * 2: write(inflight.popleft().result())
+                while inflight: write(inflight.popleft().result())
+    return progress["written"]
+
+def paystub_export_jobs(start_day, end_day):
+    users, ext = load_all_users(), "pdf" if PDF_ACTIVE else "txt"
+    jobs = []
+    for stub in get_period_paystubs(start_day, end_day):
+        name = users.get(str(stub["pin"]), {}).get('name', f"User {stub['pin']}")
+        dt_str = stub["timestamp"].strftime("%Y-%m-%d %H:%M") if hasattr(stub["timestamp"], 'strftime') else str(stub["timestamp"])
+        # Same arguments THE BANK renders with, so bulk and single downloads are byte-identical.
+        jobs.append((f"{stub['pin']}_{re.sub(r'[^A-Za-z0-9]+', '_', name)}/Paystub_{stub['tx_id']}.{ext}", "paystub", (name, dt_str, stub["tx_id"], stub["amount"], stub["amount"], 0.0, stub["dest"], stub["shifts_data"])))
+    return jobs
+
+def compliance_export_jobs(manager_name):
+    ext = "pdf" if PDF_ACTIVE else "txt"
+    load_all_users()
+    return [(f"Vicentus_Audit_{re.sub(r'[^A-Za-z0-9]+', '_', str(dept))}_{date.today()}.{ext}", "compliance", (dept, manager_name, fetch_compliance_data(dept))) for dept in sorted(d for d in get_user_directory()["by_dept"] if d)]
+
+# --- QUERY PLAN AUDIT (migrations and hot statements live in db_schema) ---
+def audit_hot_query_plans():
+    engine = get_db_engine()
+    if isinstance(engine, str) or engine is None: return None
+    with engine.connect() as conn: return explain_hot_queries(conn)
 
 # --- DATABASE ENGINE ---
-@st.cache_resource(ttl=60)
-def get_db_engine():
+def resolve_database_url():
     url = os.environ.get("SUPABASE_URL")
     if not url:
         try: url = st.secrets["SUPABASE_URL"]
         except: pass
+    if url and url.startswith("postgres://"): url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 15000))
+
+@st.cache_resource
+def get_db_telemetry():
+    """Process-wide ring buffers of recent statement timings and failures, shared by every session."""
+    return {"timings": deque(maxlen=1000), "errors": deque(maxlen=100), "memo": {"hits": 0, "misses": 0}}
+
+def record_db_error(query, error):
+    get_db_telemetry()["errors"].append((datetime.now(LOCAL_TZ), " ".join(str(query).split())[:160], str(error)[:300]))
+
+def attach_statement_timer(engine):
+    timings = get_db_telemetry()["timings"]
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000.0
+        timings.append((" ".join(statement.split())[:160], elapsed_ms))
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+        if started: started.pop()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+@st.cache_resource
+def create_db_engine(url):
+    """One long-lived pool per process. Never expires; pool_pre_ping recycles dead connections instead."""
+    engine = create_engine(url, pool_pre_ping=True, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        # Set per physical connection rather than via startup options, which the Supabase pooler rejects.
+        @event.listens_for(engine, "connect")
+        def set_statement_timeout(dbapi_conn, connection_record):
+            with dbapi_conn.cursor() as cursor: cursor.execute(f"SET statement_timeout = {DB_STATEMENT_TIMEOUT_MS}")
+            dbapi_conn.commit()
+    attach_statement_timer(engine)
+    return engine
+
+@st.cache_resource
+def bootstrap_database(_engine, url):
+    """Migrations and seed data, once per process. The advisory lock serializes concurrent processes during a deploy."""
+    started = time.perf_counter()
+    with _engine.connect() as conn: applied, seeded = bootstrap_schema(conn)
+    return {"applied": applied, "seeded": seeded, "seconds": time.perf_counter() - started, "at": datetime.now(LOCAL_TZ)}
+
+def get_bootstrap_report():
+    engine = get_db_engine()
+    if isinstance(engine, str) or engine is None: return None
+    return bootstrap_database(engine, resolve_database_url())
+
+def get_db_engine():
+    url = resolve_database_url()
     if not url: return "URL_MISSING"
-    
-    if url.startswith("postgres://"): url = url.replace("postgres://", "postgresql://", 1)
-    
     try:
-        engine = create_engine(url, pool_pre_ping=True)
-        with engine.connect() as conn:
-            conn.execute(text("CREATE TABLE IF NOT EXISTS enterprise_users (pin TEXT PRIMARY KEY, email TEXT UNIQUE, password_hash TEXT, name TEXT, role TEXT, dept TEXT, access_level TEXT, hourly_rate NUMERIC, phone TEXT, last_pw_change TIMESTAMP DEFAULT CURRENT_TIMESTAMP);"))
-            conn.execute(text("ALTER TABLE enterprise_users ADD COLUMN IF NOT EXISTS last_pw_change TIMESTAMP DEFAULT CURRENT_TIMESTAMP;"))
-            
-            res = conn.execute(text("SELECT COUNT(*) FROM enterprise_users")).fetchone()
-            if True: 
-                seed_data = [
-                    ("1001", "liam@ecprotocol.com", hash_password("password123"), "Liam O'Neil", "RRT", "Respiratory", "Worker", 70.00, None),
-                    ("1002", "charles@ecprotocol.com", hash_password("password123"), "Charles Morgan", "RRT", "Respiratory", "Worker", 65.00, None),
-                    ("1003", "sarah@ecprotocol.com", hash_password("password123"), "Sarah Jenkins", "Charge RRT", "Respiratory", "Supervisor", 75.00, None),
-                    ("1004", "manager@ecprotocol.com", hash_password("password123"), "David Clark", "Manager", "Respiratory", "Manager", 90.00, None),
-                    ("9001", "ceo@ecprotocol.com", hash_password("password123"), "CEO View", "CEO", "Executive", "Admin", 0.00, None),
-                    ("9002", "coo@ecprotocol.com", hash_password("password123"), "COO View", "COO", "Executive", "Admin", 0.00, None),
-                    ("9003", "cno@ecprotocol.com", hash_password("password123"), "CNO View", "CNO", "Executive", "Admin", 0.00, None),
-                    ("9004", "cco@ecprotocol.com", hash_password("password123"), "CCO View", "CCO", "Executive", "Admin", 0.00, None),
-                    ("9005", "cto@ecprotocol.com", hash_password("password123"), "CTO View", "CTO", "Executive", "Admin", 0.00, None),
-                    ("9006", "cfo@ecprotocol.com", hash_password("password123"), "CFO View", "CFO", "Executive", "Admin", 0.00, None),
-                    ("9007", "chro@ecprotocol.com", hash_password("password123"), "CHRO View", "CHRO", "Executive", "Admin", 0.00, None),
-                    ("8001", "resp_dir@ecprotocol.com", hash_password("password123"), "Alice Wright", "Director", "Respiratory", "Director", 100.00, None),
-                    ("8002", "nursing_dir@ecprotocol.com", hash_password("password123"), "Marcus Cole", "Director", "Nursing", "Director", 100.00, None)
-                ]
-                for sd in seed_data: conn.execute(text("INSERT INTO enterprise_users (pin, email, password_hash, name, role, dept, access_level, hourly_rate, phone, last_pw_change) VALUES (:p, :e, :pw, :n, :r, :d, :al, :hr, :ph, NOW() - INTERVAL '100 days') ON CONFLICT DO NOTHING"), {"p": sd[0], "e": sd[1], "pw": sd[2], "n": sd[3], "r": sd[4], "d": sd[5], "al": sd[6], "hr": sd[7], "ph": sd[8]})
-            
-            conn.execute(text("CREATE TABLE IF NOT EXISTS workers (pin text PRIMARY KEY, status text, start_time numeric, earnings numeric, last_active timestamp, lat numeric, lon numeric);"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS history (pin text, action text, timestamp timestamp DEFAULT NOW(), amount numeric, note text);"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS marketplace (shift_id text PRIMARY KEY, poster_pin text, role text, date text, start_time text, end_time text, rate numeric, status text, claimed_by text, escrow_status text);"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS shift_bids (bid_id text PRIMARY KEY, shift_id text, pin text, counter_rate numeric, status text DEFAULT 'PENDING', timestamp timestamp DEFAULT NOW());"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS transactions (tx_id text PRIMARY KEY, pin text, amount numeric, timestamp timestamp DEFAULT NOW(), status text, destination_pubkey text, tx_type text, note text);"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS schedules (shift_id text PRIMARY KEY, pin text, shift_date text, shift_time text, department text, status text DEFAULT 'SCHEDULED');"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS unit_census (dept text PRIMARY KEY, total_pts int, high_acuity int, vented_pts int DEFAULT 0, nipvv_pts int DEFAULT 0, last_updated timestamp DEFAULT NOW());"))
-            try: conn.execute(text("ALTER TABLE unit_census ADD COLUMN IF NOT EXISTS vented_pts int DEFAULT 0;")); conn.execute(text("ALTER TABLE unit_census ADD COLUMN IF NOT EXISTS nipvv_pts int DEFAULT 0;"))
-            except: pass
-            
-            conn.execute(text("CREATE TABLE IF NOT EXISTS messages (msg_id text PRIMARY KEY, sender_pin text, target_dept text, message text, is_sos boolean DEFAULT FALSE, recipient_pin text, timestamp timestamp DEFAULT NOW());"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS hr_onboarding (pin text PRIMARY KEY, w4_filing_status text, w4_allowances int, dd_bank text, dd_acct_last4 text, signed_date timestamp DEFAULT NOW());"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS pto_requests (req_id text PRIMARY KEY, pin text, start_date text, end_date text, reason text, status text DEFAULT 'PENDING', submitted timestamp DEFAULT NOW());"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS credentials (doc_id text PRIMARY KEY, pin text, doc_type text, doc_number text, exp_date text, status text);"))
-            
-            conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS obt_ledger (
-                    token_id TEXT PRIMARY KEY, 
-                    pin TEXT, 
-                    accolade_type TEXT, 
-                    clinical_context TEXT, 
-                    timestamp TIMESTAMP DEFAULT NOW(), 
-                    facility_origin TEXT, 
-                    encryption_hash TEXT
-                );
-            """))
-
-            conn.execute(text("CREATE TABLE IF NOT EXISTS poc_ledger (claim_id text PRIMARY KEY, pin text, patient_room text, action text, timestamp timestamp DEFAULT NOW(), ble_verified boolean, emr_verified boolean, ai_verified boolean, status text, secure_hash text);"))
-            try: conn.execute(text("ALTER TABLE poc_ledger ADD COLUMN IF NOT EXISTS secure_hash text;"))
-            except: pass
-
-            conn.execute(text("CREATE TABLE IF NOT EXISTS hospital_treasury (id INT PRIMARY KEY, available_balance NUMERIC, last_refill TIMESTAMP DEFAULT NOW());"))
-            conn.execute(text("INSERT INTO hospital_treasury (id, available_balance) VALUES (1, 50000.00) ON CONFLICT DO NOTHING;"))
-            conn.execute(text("CREATE TABLE IF NOT EXISTS hospital_protocols (protocol_id text PRIMARY KEY, title text, department text, status text, author_pin text, last_signed timestamp, next_review timestamp);"))
-            
-            conn.execute(text("CREATE TABLE IF NOT EXISTS staff_competencies (comp_id text PRIMARY KEY, pin text, competency_name text, completed_date date, expires_date date, status text);"))
-            # Insert real David Clark expiry data to replace hardcoded UI
-            conn.execute(text("INSERT INTO staff_competencies (comp_id, pin, competency_name, completed_date, expires_date, status) VALUES ('COMP-1004', '1004', 'Advanced Ventilator Setup (Annual)', '2024-01-01', :exp, 'EXPIRED') ON CONFLICT DO NOTHING"), {"exp": str(date.today() - timedelta(days=45))})
-            
-            conn.execute(text("CREATE TABLE IF NOT EXISTS daily_rollups (date TEXT PRIMARY KEY, merkle_root TEXT, tx_count INT, status TEXT);"))
-
-            conn.commit()
+        # Failures raise out of the cached functions, so they are retried on the next call rather than cached.
+        engine = create_db_engine(url)
+        bootstrap_database(engine, url)
         return engine
     except Exception as e: 
         return f"DB_ERROR: {str(e)}"
 
-def run_query(query, params=None):
+# --- PER-RERUN QUERY MEMO ---
+# Streamlit re-executes this script on every full rerun, which rebuilds these globals. Fragment reruns and threads started
+# from st.cache_resource keep using the globals of an earlier run, so the memo is only consulted inside the full run that owns it.
+QUERY_MEMO = {}
+QUERY_MEMO_STATS = {"hits": 0, "misses": 0}
+QUERY_MEMO_RUN = os.urandom(8).hex()
+st.session_state.query_memo_run = QUERY_MEMO_RUN
+SQL_READ_TABLES = re.compile(r"\b(?:FROM|JOIN)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+SQL_WRITE_TABLES = re.compile(r"\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|LOCK\s+TABLE)\s+([a-z_][a-z0-9_]*)", re.IGNORECASE)
+
+def record_memo_lookup(hit):
+    outcome = "hits" if hit else "misses"
+    QUERY_MEMO_STATS[outcome] += 1; get_db_telemetry()["memo"][outcome] += 1
+
+def query_memo_active():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None or getattr(ctx, "fragment_ids_this_run", None): return False
+    return st.session_state.get("query_memo_run") == QUERY_MEMO_RUN
+
+def invalidate_query_memo(query=None):
+    """Drops memoized reads of any table the write touches. A write we cannot attribute to a table clears everything."""
+    written = {t.lower() for t in SQL_WRITE_TABLES.findall(query)} if query else set()
+    if not written or "enterprise_users" in written: invalidate_user_directory()
+    note_change(written or LIVE_TABLES)
+    if not written: QUERY_MEMO.clear(); return
+    for key in [k for k, (tables, _) in QUERY_MEMO.items() if tables & written]: del QUERY_MEMO[key]
+
+# --- CHANGE FEED (Postgres LISTEN/NOTIFY fanned out to session fragments) ---
+CHANGE_CHANNEL = "ec_changes"
+LIVE_TABLES = ("messages", "marketplace", "workers", "poc_ledger")
+LIVE_CHECK_SECONDS = int(os.environ.get("LIVE_CHECK_SECONDS", 3))
+CHANGE_LISTEN_TIMEOUT = 30 # idle seconds before a keepalive query, so a dead socket surfaces and reconnects
+
+@st.cache_resource
+def get_change_feed():
+    """Process-wide table versions. The listener thread and this process's own writes bump them; session fragments only compare."""
+    return {"lock": threading.Lock(), "versions": defaultdict(int), "listening": False, "notifies": 0, "last_event": None, "last_error": None}
+
+def note_change(tables):
+    feed = get_change_feed()
+    with feed["lock"]:
+        for t in tables: feed["versions"][t] += 1
+
+def change_version(tables):
+    versions = get_change_feed()["versions"]
+    return tuple(versions.get(t, 0) for t in tables)
+
+@st.cache_resource
+def get_change_listener(_engine):
+    """One LISTEN connection per process on its own NullPool engine. Transaction-mode poolers (Supabase :6543) never deliver
+    notifications, so that port is swapped for the session-mode 5432 unless CHANGE_FEED_URL says otherwise."""
+    feed = get_change_feed()
+    listen_url = os.environ.get("CHANGE_FEED_URL") or (_engine.url.set(port=5432) if _engine.url.port == 6543 else _engine.url)
+    def listen_forever():
+        backoff = 1
+        while True:
+            try:
+                listen_engine = create_engine(listen_url, poolclass=NullPool)
+                raw = listen_engine.raw_connection()
+                try:
+                    dbapi = raw.driver_connection; dbapi.autocommit = True
+                    with dbapi.cursor() as cursor: cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+                    feed["listening"] = True; backoff = 1
+                    # Writes made while disconnected were never announced, so every watcher refreshes once.
+                    note_change(LIVE_TABLES)
+                    while True:
+                        if select.select([dbapi], [], [], CHANGE_LISTEN_TIMEOUT)[0]: dbapi.poll()
+                        else:
+                            with dbapi.cursor() as cursor: cursor.execute("SELECT 1")
+                        tables = set()
+                        while dbapi.notifies: tables.add(dbapi.notifies.pop(0).payload)
+                        if tables: note_change(tables); feed["notifies"] += len(tables); feed["last_event"] = datetime.now(LOCAL_TZ)
+                finally:
+                    feed["listening"] = False; raw.close(); listen_engine.dispose()
+            except Exception as e: feed["last_error"] = str(e)
+            time.sleep(backoff); backoff = min(backoff * 2, 60)
+    thread = threading.Thread(target=listen_forever, name="change-feed", daemon=True)
+    thread.start()
+    return thread
+
+def live_rows(key, tables, query, params=None, max_age=None):
+    """run_query whose result stays in the session until the change feed reports a write to one of `tables` (or max_age seconds pass).
+    Fragment ticks read only in-memory versions until then. The refresh skips the per-run memo, which belongs to an earlier full run."""
+    stamp = (change_version(tables), repr(sorted((params or {}).items())))
+    cache = st.session_state.setdefault("live_rows", {})
+    if key in cache and cache[key][0] == stamp and (max_age is None or time.time() - cache[key][2] < max_age): return cache[key][1]
+    rows = run_query(query, params, memo=False)
+    if rows is not None: cache[key] = (stamp, rows, time.time())
+    return rows
+
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_staff_metrics():
+    active_count = (live_rows("live_staff", ("workers",), "SELECT COUNT(*) FROM workers WHERE status='Active'") or [[0]])[0][0]
+    shifts_count = (live_rows("open_shifts", ("marketplace",), "SELECT COUNT(*) FROM marketplace WHERE status='OPEN'") or [[0]])[0][0]
+    c1, c2, c3 = st.columns(3); c1.metric("Live Staff", active_count); c2.metric("Critical Shifts", shifts_count, f"{shifts_count} Open" if shifts_count > 0 else "Fully Staffed", delta_color="inverse"); c3.metric("Approvals", "Active")
+
+@contextmanager
+def db_unit_of_work():
+    """Checks out one connection and runs everything in one transaction: commit on clean exit, rollback on any error.
+    Pass the yielded connection as conn= to run_query/run_transaction; inside a unit of work failures raise instead of being swallowed."""
+    engine = get_db_engine()
+    if isinstance(engine, str) or engine is None: raise RuntimeError(f"Database unavailable: {engine}")
+    with engine.begin() as conn: yield conn
+
+def run_query(query, params=None, conn=None, memo=True):
+    if conn is not None:
+        # Reads inside a unit of work must see its own uncommitted writes, so they bypass the memo.
+        try: return conn.execute(text(query), params or {}).fetchall()
+        except Exception as e: record_db_error(query, e); raise
+    memo = memo and query_memo_active()
+    memo_key = (query, repr(sorted((params or {}).items())))
+    if memo and memo_key in QUERY_MEMO: record_memo_lookup(True); return QUERY_MEMO[memo_key][1]
     engine = get_db_engine()
     if isinstance(engine, str) or engine is None: return None
     try:
-        with engine.connect() as conn: return conn.execute(text(query), params or {}).fetchall()
-    except: return None
-
-def run_transaction(query, params=None):
+        with engine.connect() as conn: rows = conn.execute(text(query), params or {}).fetchall()
+    except Exception as e: record_db_error(query, e); return None
+    if memo:
+        record_memo_lookup(False)
+        QUERY_MEMO[memo_key] = ({t.lower() for t in SQL_READ_TABLES.findall(query)}, rows)
+    return rows
+
+def run_transaction(query, params=None, conn=None):
+    invalidate_query_memo(query)
+    if conn is not None:
+        try: return conn.execute(text(query), params or {}).rowcount
+        except Exception as e: record_db_error(query, e); raise
     engine = get_db_engine()
     if isinstance(engine, str) or engine is None: return 0
     try:
         with engine.connect() as conn: 
             result = conn.execute(text(query), params or {})
             conn.commit()
-            return result.rowcount
-    except: return 0
+    except Exception as e: record_db_error(query, e); return 0
+    # Invalidate again after commit so a concurrent session cannot re-cache the pre-write state.
+    invalidate_query_memo(query)
+    return result.rowcount
+
+# --- WORKER ROLLUPS (per-worker daily pay buckets maintained by log_action) ---
+def rebuild_worker_rollups():
+    """Drops and re-derives every bucket from the raw history table in a single transaction."""
+    engine = get_db_engine()
+    if isinstance(engine, str) or engine is None: return False, "Database offline."
+    invalidate_query_memo("DELETE FROM worker_rollups")
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("LOCK TABLE worker_rollups IN EXCLUSIVE MODE"))
+            conn.execute(text("DELETE FROM worker_rollups"))
+            rows = conn.execute(text(WORKER_ROLLUPS_BACKFILL_SQL)).rowcount
+        return True, rows
+    except Exception as e: return False, str(e)
+
+def get_spend_by_dept_day(start_day, end_day):
+    """CLOCK OUT spend per (dept, day) for the range, summed in SQL from worker_rollups. Result size is depts x days, independent of history volume."""
+    rows = run_query(SQL_SPEND_BY_DEPT_DAY, {"a": start_day, "b": end_day})
+    return pd.DataFrame([(r[0], r[1], float(r[2])) for r in rows or []], columns=["Dept", "Date", "Amount"])
+
+def check_worker_rollups():
+    """Returns (pin, day, rollup_gross, history_gross, rollup_count, history_count) for every bucket that disagrees with history."""
+    return run_query("""
+        SELECT COALESCE(r.pin, h.pin), COALESCE(r.day, h.day), COALESCE(r.clock_out_gross + r.payout_gross, 0), COALESCE(h.gross, 0), COALESCE(r.clock_out_count, 0), COALESCE(h.clock_out_count, 0)
+        FROM worker_rollups r
+        FULL OUTER JOIN (
+            SELECT pin, DATE(timestamp) AS day, COALESCE(SUM(amount), 0) AS gross, COUNT(*) FILTER (WHERE action='CLOCK OUT') AS clock_out_count
+            FROM history WHERE action IN ('CLOCK OUT', 'MANUAL PAYOUT RELEASED') GROUP BY pin, DATE(timestamp)
+        ) h ON h.pin = r.pin AND h.day = r.day
+        WHERE COALESCE(r.clock_out_gross + r.payout_gross, 0) <> COALESCE(h.gross, 0) OR COALESCE(r.clock_out_count, 0) <> COALESCE(h.clock_out_count, 0)
+        ORDER BY 2, 1
+    """)
+
+# --- USER DIRECTORY (process-wide, shared by every session) ---
+USER_DIRECTORY_TTL = int(os.environ.get("USER_DIRECTORY_TTL", 300))
+
+@st.cache_resource
+def get_user_directory():
+    return {"lock": threading.Lock(), "users": None, "by_email": {}, "by_dept": {}, "loaded_at": 0.0}
+
+def invalidate_user_directory():
+    get_user_directory()["loaded_at"] = 0.0
 
 def load_all_users():
-    res = run_query("SELECT pin, email, password_hash, name, role, dept, access_level, hourly_rate, phone, last_pw_change FROM enterprise_users")
-    if not res: return {} 
-    users_dict = {}
-    for r in res: 
-        users_dict[str(r[0])] = {
-            "pin": str(r[0]), "email": r[1], "password_hash": r[2], "name": r[3], 
-            "role": r[4], "dept": r[5], "level": r[6], "rate": float(r[7]), 
-            "phone": r[8], "vip": (r[6] in ['Admin', 'Manager', 'Executive', 'Director']),
-            "last_pw_change": r[9]
-        }
-    return users_dict
-
-def log_action(pin, action, amount, note): return run_transaction("INSERT INTO history (pin, action, timestamp, amount, note) VALUES (:p, :a, NOW(), :amt, :n)", {"p": pin, "a": action, "amt": amount, "n": note})
-def update_status(pin, status, start, earn, lat=0.0, lon=0.0): return run_transaction("INSERT INTO workers (pin, status, start_time, earnings, last_active, lat, lon) VALUES (:p, :s, :t, :e, NOW(), :lat, :lon) ON CONFLICT (pin) DO UPDATE SET status = :s, start_time = :t, earnings = :e, last_active = NOW(), lat = :lat, lon = :lon;", {"p": pin, "s": status, "t": start, "e": earn, "lat": float(lat), "lon": float(lon)})
+    """Serves the shared directory, reloading from enterprise_users only after USER_DIRECTORY_TTL or a write to that table."""
+    directory = get_user_directory()
+    with directory["lock"]:
+        if directory["users"] is not None and time.time() - directory["loaded_at"] < USER_DIRECTORY_TTL: return directory["users"]
+        # Straight from the database: a memoized read could predate the invalidation that emptied this cache.
+        res = run_query("SELECT pin, email, password_hash, name, role, dept, access_level, hourly_rate, phone, last_pw_change FROM enterprise_users", memo=False)
+        if not res: return directory["users"] or {}
+        users_dict = {}; by_email = {}; by_dept = defaultdict(list)
+        for r in res: 
+            users_dict[str(r[0])] = {
+                "pin": str(r[0]), "email": r[1], "password_hash": r[2], "name": r[3], 
+                "role": r[4], "dept": r[5], "level": r[6], "rate": float(r[7]), 
+                "phone": r[8], "vip": (r[6] in ['Admin', 'Manager', 'Executive', 'Director']),
+                "last_pw_change": r[9]
+            }
+            if r[1]: by_email[r[1].strip().lower()] = users_dict[str(r[0])]
+            by_dept[r[5]].append(str(r[0]))
+        directory.update({"users": users_dict, "by_email": by_email, "by_dept": dict(by_dept), "loaded_at": time.time()})
+        return users_dict
+
+def find_user_by_email(email):
+    load_all_users()
+    return get_user_directory()["by_email"].get((email or "").strip().lower())
+
+def users_in_dept(dept):
+    load_all_users()
+    return get_user_directory()["by_dept"].get(dept, [])
+
+def log_action(pin, action, amount, note, conn=None):
+    if action in ROLLUP_ACTIONS:
+        # History row and its daily bucket are written by one statement so the rollup can never drift from the ledger.
+        return run_transaction("""
+            WITH h AS (INSERT INTO history (pin, action, timestamp, amount, note) VALUES (:p, :a, NOW(), :amt, :n) RETURNING pin, action, timestamp, amount)
+            INSERT INTO worker_rollups (pin, day, clock_out_gross, clock_out_count, payout_gross)
+            SELECT pin, DATE(timestamp), CASE WHEN action='CLOCK OUT' THEN COALESCE(amount, 0) ELSE 0 END, CASE WHEN action='CLOCK OUT' THEN 1 ELSE 0 END, CASE WHEN action='MANUAL PAYOUT RELEASED' THEN COALESCE(amount, 0) ELSE 0 END FROM h
+            ON CONFLICT (pin, day) DO UPDATE SET clock_out_gross = worker_rollups.clock_out_gross + EXCLUDED.clock_out_gross, clock_out_count = worker_rollups.clock_out_count + EXCLUDED.clock_out_count, payout_gross = worker_rollups.payout_gross + EXCLUDED.payout_gross
+        """, {"p": pin, "a": action, "amt": amount, "n": note}, conn=conn)
+    return run_transaction("INSERT INTO history (pin, action, timestamp, amount, note) VALUES (:p, :a, NOW(), :amt, :n)", {"p": pin, "a": action, "amt": amount, "n": note}, conn=conn)
+def update_status(pin, status, start, earn, lat=0.0, lon=0.0, conn=None): return run_transaction("INSERT INTO workers (pin, status, start_time, earnings, last_active, lat, lon) VALUES (:p, :s, :t, :e, NOW(), :lat, :lon) ON CONFLICT (pin) DO UPDATE SET status = :s, start_time = :t, earnings = :e, last_active = NOW(), lat = :lat, lon = :lon;", {"p": pin, "s": status, "t": start, "e": earn, "lat": float(lat), "lon": float(lon)}, conn=conn)
 def haversine_distance(lat1, lon1, lat2, lon2): R = 6371000; phi1, phi2 = math.radians(lat1), math.radians(lat2); dphi = math.radians(lat2 - lat1); dlam = math.radians(lon2 - lon1); a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlam/2)**2; return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
 
+# --- GEOFENCE ENGINE (grid index and vectorized haversine live in geo_index) ---
+GEOFENCE_RECHECK_SECONDS = int(os.environ.get("GEOFENCE_RECHECK_SECONDS", 30))
+GEOFENCE_SNOOZE_SECONDS = 900 # a dismissed alert stays quiet this long
+
+@st.cache_resource
+def get_facility_registry():
+    """HOSPITALS plus any sites listed in the FACILITIES_JSON file ({"name": {"lat": .., "lon": ..}})."""
+    registry = dict(HOSPITALS)
+    if os.environ.get("FACILITIES_JSON"):
+        with open(os.environ["FACILITIES_JSON"]) as f: registry.update(json.load(f))
+    return registry
+
+@st.cache_resource
+def get_facility_index():
+    return build_facility_index(get_facility_registry(), GEOFENCE_RADIUS)
+
+def find_geofence_breaches(radius_m=GEOFENCE_RADIUS):
+    """Pins of active workers whose last workers.lat/lon lies outside every facility's geofence, checked in one bulk pass.
+    Workers without a fix (NULL or the 0,0 VIP placeholder) are never flagged, nor is anyone while only demo facilities exist."""
+    index = get_facility_index()
+    if not len(index["names"]): return set()
+    rows = run_query("SELECT pin, lat, lon FROM workers WHERE status='Active' AND lat IS NOT NULL AND lon IS NOT NULL AND NOT (lat = 0 AND lon = 0)")
+    if not rows: return set()
+    pins = np.array([str(r[0]) for r in rows], dtype=object)
+    inside = np.zeros(len(pins), dtype=bool)
+    inside[facilities_within(index, [float(r[1]) for r in rows], [float(r[2]) for r in rows], radius_m)[0]] = True
+    return set(pins[~inside])
+
+@st.cache_resource
+def get_geofence_monitor():
+    return {"lock": threading.Lock(), "breaches": set(), "checked_at": 0.0, "seconds": 0.0, "checks": 0}
+
+def current_geofence_breaches():
+    """Process-wide breach set, recomputed at most every GEOFENCE_RECHECK_SECONDS no matter how many sessions ask."""
+    monitor = get_geofence_monitor()
+    with monitor["lock"]:
+        if time.time() - monitor["checked_at"] >= GEOFENCE_RECHECK_SECONDS:
+            t0 = time.perf_counter(); monitor["breaches"] = find_geofence_breaches()
+            monitor["checked_at"] = time.time(); monitor["seconds"] = time.perf_counter() - t0; monitor["checks"] += 1
+        return monitor["breaches"]
+
+# --- POSITION INGESTION (bounded ping queue, per-worker coalescing and timed batch updates live in ping_ingest) ---
+POSITION_PING_SECONDS = int(os.environ.get("POSITION_PING_SECONDS", 15)) # how often an on-clock browser reports a fix
+
+@st.cache_resource
+def get_position_ingest(_engine):
+    """Process-wide ping pipeline. Sessions call submit_position(); one daemon thread drains, coalesces, checks fences and flushes."""
+    return start_position_ingest(_engine, get_facility_index, GEOFENCE_RADIUS)
+
+def submit_position(pin, lat, lon): return queue_position(POSITION_INGEST, pin, lat, lon)
+def take_geofence_exit(pin): return pop_geofence_exit(POSITION_INGEST, pin)
+
+@st.fragment(run_every=POSITION_PING_SECONDS)
+def position_stream(pin):
+    """Keeps an on-clock browser reporting its GPS fix every POSITION_PING_SECONDS without rerunning the page. A fresh component key per tick
+    makes the browser re-read the fix; a stream-detected exit escalates to a full rerun so the dashboard can raise the geofence alert."""
+    tick = int(time.time() // POSITION_PING_SECONDS)
+    ping = get_geolocation(component_key=f"gps_ping_{tick}")
+    if ping and st.session_state.get('last_ping_tick') != tick:
+        st.session_state.last_ping_tick = tick
+        submit_position(pin, ping['coords']['latitude'], ping['coords']['longitude'])
+    if not st.session_state.get('geofence_alert') and time.time() >= st.session_state.get('geofence_snoozed_until', 0.0) and take_geofence_exit(pin):
+        st.session_state.geofence_alert = True; st.rerun()
+
 def force_cloud_sync(pin):
     rows = run_query("SELECT status, start_time, earnings FROM workers WHERE pin = :pin", {"pin": pin})
     if rows and len(rows) > 0: 
@@ -382,9 +1089,9 @@ def force_cloud_sync(pin):
         return True
     st.session_state.user_state['active'] = False; return False
 
-def calculate_taxes(pin, gross_amount):
+def calculate_taxes(pin, gross_amount, conn=None):
     if gross_amount <= 0.0: return 0.0, 0.0, 0.0, 0.0, 0.0
-    res = run_query("SELECT SUM(amount) FROM history WHERE pin=:p AND action IN ('CLOCK OUT', 'MANUAL PAYOUT RELEASED') AND EXTRACT(YEAR FROM timestamp) = EXTRACT(YEAR FROM NOW())", {"p": pin})
+    res = run_query("SELECT SUM(clock_out_gross + payout_gross) FROM worker_rollups WHERE pin=:p AND day >= DATE_TRUNC('year', NOW())", {"p": pin}, conn=conn)
     ytd_gross = float(res[0][0]) if res and res[0][0] else 0.0
     def calculate_federal_bracket(income):
         tax = 0.0
@@ -403,83 +1110,316 @@ def calculate_taxes(pin, gross_amount):
     total_tax = fed_withholding + ma_withholding + ss_withholding + med_withholding
     return total_tax, fed_withholding, ma_withholding, ss_withholding, med_withholding
 
-def execute_split_stream_payout(pin, gross_amount):
+def execute_split_stream_payout(pin, gross_amount, conn=None):
     TREASURY_DEST = "IRS_TREASURY_ACCOUNT"
-    total_tax, fed, ma, ss, med = calculate_taxes(pin, gross_amount)
+    total_tax, fed, ma, ss, med = calculate_taxes(pin, gross_amount, conn=conn)
     net_payout = gross_amount - total_tax
     tx_base_id = int(time.time())
     dest_account = "FIAT_DIRECT_DEPOSIT"
     note_str = f"Gross: {gross_amount} | Tax: {total_tax}"
-    run_transaction("INSERT INTO transactions (tx_id, pin, amount, status, destination_pubkey, tx_type, note) VALUES (:id, :p, :amt, 'APPROVED', :dest, 'NET_PAY', :note)", {"id": f"TX-NET-{tx_base_id}", "p": pin, "amt": net_payout, "dest": dest_account, "note": note_str})
-    run_transaction("INSERT INTO transactions (tx_id, pin, amount, status, destination_pubkey, tx_type) VALUES (:id, :p, :amt, 'APPROVED', :dest, 'TAX_WITHHOLDING')", {"id": f"TX-TAX-{tx_base_id}", "p": pin, "amt": total_tax, "dest": TREASURY_DEST})
-    log_action(pin, "FUNDS WITHDRAWN", net_payout, f"Settled to {dest_account}")
-    log_action(pin, "TAX WITHHELD", total_tax, f"Routed to Treasury")
+    run_transaction("INSERT INTO transactions (tx_id, pin, amount, status, destination_pubkey, tx_type, note) VALUES (:id, :p, :amt, 'APPROVED', :dest, 'NET_PAY', :note)", {"id": f"TX-NET-{tx_base_id}", "p": pin, "amt": net_payout, "dest": dest_account, "note": note_str}, conn=conn)
+    run_transaction("INSERT INTO transactions (tx_id, pin, amount, status, destination_pubkey, tx_type) VALUES (:id, :p, :amt, 'APPROVED', :dest, 'TAX_WITHHOLDING')", {"id": f"TX-TAX-{tx_base_id}", "p": pin, "amt": total_tax, "dest": TREASURY_DEST}, conn=conn)
+    log_action(pin, "FUNDS WITHDRAWN", net_payout, f"Settled to {dest_account}", conn=conn)
+    log_action(pin, "TAX WITHHELD", total_tax, f"Routed to Treasury", conn=conn)
     return net_payout, total_tax
 
-def calculate_shift_differentials(start_timestamp, base_rate):
-    start_dt = datetime.fromtimestamp(start_timestamp, tz=LOCAL_TZ)
-    end_dt = datetime.now(LOCAL_TZ)
-    total_seconds = (end_dt - start_dt).total_seconds()
-    if total_seconds <= 0: return 0.0, 0.0, "Invalid Shift"
-    base_pay = 0.0; diff_pay = 0.0; notes = set()
-    current_dt = start_dt
-    while current_dt < end_dt:
-        minute_base = base_rate / 60.0
-        minute_diff = 0.0
-        if current_dt.weekday() >= 5: minute_diff += (3.00 / 60.0); notes.add("WKD(+$3)")
-        if 15 <= current_dt.hour < 19: minute_diff += (3.00 / 60.0); notes.add("EVE(+$3)")
-        elif current_dt.hour >= 19 or current_dt.hour < 7: minute_diff += (5.00 / 60.0); notes.add("NOC(+$5)")
-        base_pay += minute_base; diff_pay += minute_diff
-        current_dt += timedelta(minutes=1)
-    return base_pay, diff_pay, " | ".join(notes)
-
-def calculate_fatigue_score(p_pin, target_dept):
-    res_hrs = run_query("SELECT amount FROM history WHERE pin=:p AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '14 days'", {"p": p_pin})
+PAYSTUB_PAGE_SIZE = 10
+
+def get_paystub_page(pin, page=0, page_size=PAYSTUB_PAGE_SIZE):
+    """One query per page: LAG pairs each NET_PAY with the payout before it, and the page's stubs join the CLOCK IN/OUT history between the two.
+    Returns (total_stubs, [stub dicts with shifts_data]), newest first."""
+    rows = run_query(SQL_PAYSTUB_PAGE, {"p": pin, "lim": page_size, "off": page * page_size})
+    if not rows: return 0, []
+    return int(rows[0][5]), collect_paystubs(rows, ("tx_id", "amount", "timestamp", "dest", "note", "total"))
+
+def collect_paystubs(rows, stub_fields):
+    """Folds (stub columns..., history action, history timestamp) rows into stub dicts, pairing CLOCK IN/OUT exactly as receipts print them."""
+    stubs, current_in = {}, {}
+    for row in rows:
+        fields, action, h_ts = tuple(row[:-2]), row[-2], row[-1]
+        if fields not in stubs:
+            stubs[fields] = dict(zip(stub_fields, fields), shifts_data=[]); stubs[fields]["amount"] = float(stubs[fields]["amount"])
+        if action is None: continue
+        fmt_ts = h_ts.strftime('%m/%d/%Y %H:%M') if hasattr(h_ts, 'strftime') else str(h_ts)
+        if action == 'CLOCK IN': current_in[fields] = fmt_ts
+        else: stubs[fields]["shifts_data"].append((current_in.pop(fields, None) or "Prior to record", fmt_ts))
+    return list(stubs.values())
+
+def get_period_paystubs(start_day, end_day):
+    """Every NET_PAY settled in the LOCAL_TZ period with its shift pairs, using the same LAG window as get_paystub_page partitioned by worker."""
+    range_start, range_end = local_day_bounds(start_day, end_day)
+    rows = run_query(SQL_PERIOD_PAYSTUBS, {"start": range_start, "end": range_end})
+    return collect_paystubs(rows or [], ("pin", "tx_id", "amount", "timestamp", "dest"))
+
+# --- SHIFT DIFFERENTIAL ENGINE ---
+# Each rule adds `rate` $/hr to every paid minute whose local start falls on one of its weekdays and inside one of its hour windows. Rules stack.
+DIFFERENTIAL_RULES = [
+    {"label": "WKD(+$3)", "rate": 3.00, "days": (5, 6), "hours": [(0, 24)]},
+    {"label": "EVE(+$3)", "rate": 3.00, "days": (0, 1, 2, 3, 4, 5, 6), "hours": [(15, 19)]},
+    {"label": "NOC(+$5)", "rate": 5.00, "days": (0, 1, 2, 3, 4, 5, 6), "hours": [(19, 24), (0, 7)]},
+]
+
+def build_differential_segments(start_ts, end_ts, rules=None):
+    """Splits [start_ts, end_ts) at local midnight and every rule hour edge (localized per day, so DST shifts are honored). Returns (seg_start, seg_end, active_rule_indexes)."""
+    rules = rules or DIFFERENTIAL_RULES
+    edges = sorted({h for r in rules for window in r["hours"] for h in window if 0 < h < 24} | {0})
+    day = datetime.fromtimestamp(start_ts, tz=LOCAL_TZ).date()
+    last_day = datetime.fromtimestamp(end_ts, tz=LOCAL_TZ).date()
+    points = [start_ts]
+    while day <= last_day:
+        for h in edges:
+            b = LOCAL_TZ.localize(datetime(day.year, day.month, day.day, h)).timestamp()
+            if start_ts < b < end_ts: points.append(b)
+        day += timedelta(days=1)
+    points.append(end_ts)
+    points = sorted(set(points))
+    segments = []
+    for a, b in zip(points, points[1:]):
+        local = datetime.fromtimestamp(a, tz=LOCAL_TZ)
+        active = tuple(i for i, r in enumerate(rules) if local.weekday() in r["days"] and any(lo <= local.hour < hi for lo, hi in r["hours"]))
+        segments.append((a, b, active))
+    return segments
+
+def calculate_shift_differentials_batch(shifts, end_timestamp=None, rules=None):
+    """Prices many (start_timestamp, base_rate) shifts in one pass, matching the legacy per-minute walk on each shift's own minute grid.
+    Segment edges fall on local hours, so a segment between two edges holds the same whole minutes for every worker: rule minutes are
+    accumulated across segments once, and each worker only adds its partial first and last segments. Missing or non-positive starts are invalid."""
+    rules = rules or DIFFERENTIAL_RULES
+    if not shifts: return []
+    end_ts = float(end_timestamp) if end_timestamp is not None else datetime.now(LOCAL_TZ).timestamp()
+    starts = np.array([s[0] for s in shifts], dtype=float); rates = np.array([s[1] for s in shifts], dtype=float)
+    valid = np.isfinite(starts) & (starts > 0) & (starts < end_ts)
+    if not valid.any(): return [(0.0, 0.0, "Invalid Shift")] * len(shifts)
+    segments = build_differential_segments(float(starts[valid].min()), end_ts, rules)
+    membership = np.zeros((len(segments), len(rules)))
+    for i, seg in enumerate(segments): membership[i, list(seg[2])] = 1.0
+    edges = np.array([seg[0] for seg in segments[1:]])
+    whole = np.rint(np.array([seg[1] - seg[0] for seg in segments]) / 60.0)[:, None] * membership
+    cumulative = np.vstack([np.zeros(len(rules)), np.cumsum(whole, axis=0)]) # cumulative[k] = rule minutes of segments < k (edge-to-edge ones only are used)
+    s = np.where(valid, starts, end_ts)
+    minutes = np.where(valid, np.ceil((end_ts - s) / 60.0), 0.0)
+    first = np.searchsorted(edges, s, side="left") # segment each shift starts in
+    last = len(segments) - 1
+    if len(edges): head = np.where(first < last, np.ceil((edges[np.minimum(first, last - 1)] - s) / 60.0), minutes); tail = np.where(first < last, minutes - np.ceil((edges[-1] - s) / 60.0), 0.0)
+    else: head, tail = minutes, np.zeros(len(s))
+    rule_minutes = head[:, None] * membership[first] + (cumulative[last] - cumulative[np.minimum(first + 1, last)]) + tail[:, None] * membership[last]
+    base_pay = minutes * rates / 60.0
+    diff_pay = rule_minutes @ np.array([float(r["rate"]) for r in rules]) / 60.0
+    results = []
+    for w in range(len(shifts)):
+        if not valid[w]: results.append((0.0, 0.0, "Invalid Shift")); continue
+        notes = [r["label"] for i, r in enumerate(rules) if rule_minutes[w, i] > 0]
+        results.append((float(base_pay[w]), float(diff_pay[w]), " | ".join(notes)))
+    return results
+
+def calculate_shift_differentials(start_timestamp, base_rate, end_timestamp=None):
+    return calculate_shift_differentials_batch([(start_timestamp, base_rate)], end_timestamp)[0]
+
+# --- FLEET SNAPSHOT ---
+FLEET_CARD_PAGE_SIZE = 25
+FLEET_HEXAGON_THRESHOLD = int(os.environ.get("FLEET_HEXAGON_THRESHOLD", 300)) # above this many mapped workers the map shows aggregated cells
+FLEET_GRID_DEGREES = 0.002 # ~200m cells for server-side position binning
+
+def get_fleet_snapshot(now_ts=None):
+    """Every active worker as one columnar frame from a single query: identity, position, hours on clock and accrued pay priced in one vectorized batch.
+    A worker with no usable start_time is kept but flagged start_missing: it accrues no pay and has no hours instead of being priced from 1970."""
+    now_ts = now_ts or time.time()
+    rows = live_rows("fleet", ("workers",), SQL_ACTIVE_FLEET, max_age=POSITION_PING_SECONDS) # positions never notify, so they are re-read on the ping cadence
+    fleet = pd.DataFrame(rows or [], columns=["pin", "name", "rate", "start_time", "earnings", "lat", "lon"])
+    fleet["name"] = fleet["name"].fillna("Unknown")
+    for col in ("rate", "start_time", "earnings", "lat", "lon"): fleet[col] = pd.to_numeric(fleet[col], errors="coerce")
+    fleet[["rate", "earnings"]] = fleet[["rate", "earnings"]].fillna(0.0)
+    fleet["start_missing"] = ~(fleet["start_time"] > 0)
+    fleet.loc[fleet["start_missing"], "start_time"] = np.nan
+    priced = calculate_shift_differentials_batch(list(zip(fleet["start_time"], fleet["rate"])), end_timestamp=now_ts)
+    fleet["base_pay"] = [p[0] for p in priced]; fleet["diff_pay"] = [p[1] for p in priced]; fleet["diff_notes"] = [p[2] for p in priced]
+    fleet["hours"] = (now_ts - fleet["start_time"]) / 3600
+    fleet["est_gross"] = fleet["earnings"] + fleet["base_pay"] + fleet["diff_pay"]
+    return fleet
+
+def bin_fleet_positions(fleet, cell=FLEET_GRID_DEGREES):
+    """Snaps positions to a lat/lon grid and sums each cell, so the browser receives one row per occupied cell instead of one per worker."""
+    mapped = fleet.dropna(subset=["lat", "lon"])
+    snapped = mapped.assign(lat=(mapped["lat"] / cell).round() * cell, lon=(mapped["lon"] / cell).round() * cell)
+    return snapped.groupby(["lat", "lon"], as_index=False).agg(workers=("pin", "size"), accrued=("est_gross", "sum"))
+
+def score_fatigue_factors(p_pin, gross_14d, wknd_count, recent_count, acc_count, target_dept=None):
     base_rate = float(USERS.get(p_pin, {}).get('rate', 0.1)) if p_pin in USERS else 0.1
-    hrs_worked = (sum([float(r[0]) for r in res_hrs]) / base_rate) if res_hrs else 0.0
-    score = hrs_worked 
+    hrs_worked = (gross_14d / base_rate) if gross_14d else 0.0
+    score = hrs_worked
     notes = []
-    current_weekday = date.today().weekday()
-    if current_weekday >= 5: 
-        res_wknds = run_query("SELECT count(*) FROM history WHERE pin=:p AND action='CLOCK OUT' AND extract(isodow from timestamp) >= 6 AND timestamp >= NOW() - INTERVAL '30 days'", {"p": p_pin})
-        if res_wknds and res_wknds[0][0] > 1: score += 50.0; notes.append(f"Weekend Equality (Worked {res_wknds[0][0]} recently)")
-    res_acc = run_query("SELECT count(*) FROM obt_ledger WHERE pin=:p AND timestamp >= NOW() - INTERVAL '7 days'", {"p": p_pin})
-    if res_acc and res_acc[0][0] > 0: score += 20.0; notes.append("Acuity Burnout Risk (+20)")
-    res_rec = run_query("SELECT count(*) FROM history WHERE pin=:p AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '48 hours'", {"p": p_pin})
-    if res_rec and res_rec[0][0] > 0 and USERS.get(p_pin, {}).get('dept') == target_dept: score -= 15.0; notes.append("Continuity Match (-15)")
+    if date.today().weekday() >= 5 and wknd_count > 1: score += 50.0; notes.append(f"Weekend Equality (Worked {wknd_count} recently)")
+    if acc_count > 0: score += 20.0; notes.append("Acuity Burnout Risk (+20)")
+    home_dept = USERS.get(p_pin, {}).get('dept')
+    if recent_count > 0 and home_dept == (target_dept if target_dept is not None else home_dept): score -= 15.0; notes.append("Continuity Match (-15)")
     return score, hrs_worked, " | ".join(notes)
 
+def calculate_fatigue_scores(pins, target_dept=None):
+    """Scores every pin from two grouped queries. target_dept=None scores each operator against their own home unit."""
+    pins = [str(p) for p in pins]
+    if not pins: return {}
+    res_hist = run_query(SQL_FATIGUE_HISTORY, {"pins": pins})
+    res_acc = run_query(SQL_FATIGUE_ACCOLADES, {"pins": pins})
+    hist = {str(r[0]): (float(r[1]), int(r[2]), int(r[3])) for r in res_hist} if res_hist else {}
+    acc = {str(r[0]): int(r[1]) for r in res_acc} if res_acc else {}
+    scores = {}
+    for p_pin in pins:
+        gross_14d, wknd_count, recent_count = hist.get(p_pin, (0.0, 0, 0))
+        scores[p_pin] = score_fatigue_factors(p_pin, gross_14d, wknd_count, recent_count, acc.get(p_pin, 0), target_dept)
+    return scores
+
+def calculate_fatigue_score(p_pin, target_dept):
+    return calculate_fatigue_scores([p_pin], target_dept)[str(p_pin)]
+
 def get_rolling_weekly_hours(p_pin):
-    res_wk = run_query("SELECT amount FROM history WHERE pin=:p AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '7 days'", {"p": p_pin})
+    # Whole days come from worker_rollups; only the partial day at the window edge touches history.
+    res_wk = run_query(SQL_ROLLING_WEEKLY_GROSS, {"p": p_pin})
     base_rate = float(USERS.get(p_pin, {}).get('rate', 0.1)) if p_pin in USERS else 0.1
-    return (sum([float(r[0]) for r in res_wk]) / base_rate) if res_wk else 0.0
+    gross_7d = float(res_wk[0][0]) if res_wk and res_wk[0][0] else 0.0
+    return (gross_7d / base_rate) if gross_7d else 0.0
 
-def proprietary_flex_oracle(dept_name):
-    active_staff = run_query("SELECT pin FROM workers WHERE status='Active'")
-    if not active_staff: return {"error": "No active operators found."}
+def proprietary_flex_oracle(dept_name, top_k=3):
+    """Ranks every Active operator in dept_name from one grouped query. Score = OT severity x100 + fatigue score."""
+    rows = run_query(SQL_FLEX_ORACLE, {"d": dept_name})
+    if rows is None: return {"error": "No active operators found."}
     candidates = []
-    for s in active_staff:
-        w_pin = s[0]
-        if USERS.get(str(w_pin), {}).get('dept') != dept_name: continue
-        hrs_worked_7d = get_rolling_weekly_hours(w_pin)
-        f_score, _, _ = calculate_fatigue_score(w_pin, dept_name)
-        rate = USERS.get(str(w_pin), {}).get('rate', 0.0)
-        name = USERS.get(str(w_pin), {}).get('name', 'Unknown')
+    for r in rows:
+        w_pin = str(r[0])
+        base_rate = float(USERS.get(w_pin, {}).get('rate', 0.1)) if w_pin in USERS else 0.1
+        hrs_worked_7d = (float(r[1]) / base_rate) if float(r[1]) else 0.0
+        f_score, f_hrs, f_notes = score_fatigue_factors(w_pin, float(r[2]), int(r[3]), int(r[4]), int(r[5]), dept_name)
         is_ot = hrs_worked_7d > 40.0
         ot_severity = hrs_worked_7d - 40.0 if is_ot else 0
         score = (ot_severity * 100) + f_score
-        candidates.append({"pin": w_pin, "name": name, "score": score, "is_ot": is_ot, "hrs": hrs_worked_7d, "f_score": f_score, "rate": rate})
+        candidates.append({"pin": w_pin, "name": USERS.get(w_pin, {}).get('name', 'Unknown'), "score": score, "is_ot": is_ot, "hrs": hrs_worked_7d, "f_score": f_score, "rate": USERS.get(w_pin, {}).get('rate', 0.0),
+                           "breakdown": {"ot_severity": ot_severity * 100, "fatigue": f_score, "fatigue_hrs_14d": f_hrs, "fatigue_factors": f_notes}})
     if not candidates: return {"error": f"No active staff in {dept_name} to flex."}
     candidates = sorted(candidates, key=lambda x: x['score'], reverse=True)
     top_cand = candidates[0]
     reason = f"Proprietary Engine Selected {top_cand['name']}. "
     if top_cand['is_ot']: reason += f"Operator is in critical Overtime ({top_cand['hrs']:.1f} hrs) triggering immediate financial bleed. "
     reason += f"Fatigue Index is {top_cand['f_score']:.1f}. Flexing immediately optimizes both budget variance and clinical safety."
-    return {"selected_pin": top_cand['pin'], "selected_name": top_cand['name'], "reason": reason}
+    return {"selected_pin": top_cand['pin'], "selected_name": top_cand['name'], "reason": reason, "ranked": candidates[:top_k]}
 
 st.set_page_config(page_title="Vicentus Enterprise", page_icon="⚡", layout="wide", initial_sidebar_state="collapsed")
 import base64
 
+# --- LIVE PANELS (change-feed fragments: each refreshes itself, so a write never reruns the whole page) ---
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_fleet_panel():
+    fleet = get_fleet_snapshot()
+    if not fleet.empty:
+        c_f1, c_f2, c_f3 = st.columns(3)
+        c_f1.metric("Operators On Clock", f"{len(fleet):,}"); c_f2.metric("Fleet Accrued (Est.)", f"${fleet['est_gross'].sum():,.2f}"); c_f3.metric("Avg Hours On Clock", f"{fleet['hours'].mean():.2f}" if fleet['hours'].notna().any() else "—")
+        if fleet["start_missing"].any(): st.warning(f"⚠️ {int(fleet['start_missing'].sum())} active operator(s) have no recorded start time; they are excluded from hours and accrual.")
+        mapped = fleet.dropna(subset=["lat", "lon"])
+        if not mapped.empty:
+            view = pdk.ViewState(latitude=float(mapped['lat'].mean()), longitude=float(mapped['lon'].mean()), zoom=11, pitch=45)
+            if len(mapped) > FLEET_HEXAGON_THRESHOLD:
+                layer = pdk.Layer("HexagonLayer", bin_fleet_positions(mapped), get_position='[lon, lat]', get_elevation_weight='workers', get_color_weight='workers', elevation_aggregation='SUM', color_aggregation='SUM', radius=300, elevation_scale=20, extruded=True, pickable=True)
+            else:
+                layer = pdk.Layer("ScatterplotLayer", mapped[["name", "lat", "lon"]], get_position='[lon, lat]', get_color='[16, 185, 129, 200]', get_radius=100)
+            st.pydeck_chart(pdk.Deck(layers=[layer], initial_view_state=view, map_style='mapbox://styles/mapbox/dark-v10'))
+        page_count = max(1, math.ceil(len(fleet) / FLEET_CARD_PAGE_SIZE))
+        fleet_page = min(st.session_state.get('fleet_page', 0), page_count - 1)
+        if page_count > 1: fleet_page = st.number_input(f"Roster page (1-{page_count})", min_value=1, max_value=page_count, value=fleet_page + 1, step=1, key="fleet_page_input") - 1
+        st.session_state.fleet_page = fleet_page
+        cards = fleet.iloc[fleet_page * FLEET_CARD_PAGE_SIZE:(fleet_page + 1) * FLEET_CARD_PAGE_SIZE]
+        st.markdown("".join(f"<div class='glass-card' style='border-left: 4px solid #10b981 !important;'><div style='display:flex; justify-content:space-between; align-items:center;'><h4 style='margin:0;'>{w.name}</h4>" + (f"<span style='color:#f59e0b; font-weight:bold;'>⚠️ ON CLOCK (start time missing) | Est: ${w.est_gross:.2f}</span>" if w.start_missing else f"<span style='color:#10b981; font-weight:bold;'>🟢 ON CLOCK ({w.hours:.2f} hrs) | Est: ${w.est_gross:.2f}</span>") + "</div></div>" for w in cards.itertuples()), unsafe_allow_html=True)
+    else: st.info("No active operators in the field.")
+
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_marketplace(pin, dept):
+    open_shifts = live_rows("open_marketplace", ("marketplace",), SQL_OPEN_MARKETPLACE)
+    if open_shifts:
+        for shift in open_shifts:
+            s_id, s_role, s_date, s_time, s_rate, s_escrow = shift[0], shift[1], shift[2], shift[3], float(shift[4]), shift[5]
+            est_payout = s_rate * 12
+            escrow_badge = "<span style='background:#10b981; color:#0b1120; padding:3px 8px; border-radius:4px; font-size:0.75rem; font-weight:bold; margin-left:10px;'>✔️ BASE RATE VERIFIED</span>" if s_escrow == "LOCKED" else ""
+
+            st.markdown(f"<div class='shift-card'><div style='display:flex; justify-content:space-between; align-items:flex-start;'><div><div style='color:#94a3b8; font-weight:800; text-transform:uppercase; font-size:0.9rem;'>{s_date} <span style='color:#38bdf8;'>| {s_time}</span></div><div style='font-size:1.4rem; font-weight:800; color:#f8fafc; margin-top:5px;'>{s_role}{escrow_badge}</div><div class='shift-amount'>${est_payout:,.2f} (Est. Base Pay)</div></div></div></div>", unsafe_allow_html=True)
+
+            if st.button(f"⚡ CLAIM SHIFT", key=f"claim_{s_id}"):
+                creds = run_query("SELECT doc_type, exp_date FROM credentials WHERE pin=:p AND status='ACTIVE'", {"p": pin})
+                expired = [c[0] for c in creds if str(c[1]) < str(date.today())]
+
+                wk_hrs = get_rolling_weekly_hours(pin)
+                will_hit_ot = (wk_hrs + 12) > 40.0
+
+                if expired:
+                    st.error(f"🛑 HARD EMR INTERLOCK: Claim blocked due to expired credentials ({', '.join(expired)}). Please update via HR Vault.")
+                elif will_hit_ot:
+                    st.warning(f"⚠️ CFO OVERTIME LOCK: Claiming this shift pushes you to {wk_hrs+12:.1f} hrs for the week. Shift pended for Manager/CFO Overtime Authorization.")
+                    run_transaction("INSERT INTO shift_bids (bid_id, shift_id, pin, counter_rate, status) VALUES (:bid, :sid, :p, :r, 'PENDING_OT')", {"bid": f"OT-{int(time.time()*1000)}", "sid": s_id, "p": pin, "r": s_rate * 1.5})
+                    time.sleep(3); st.rerun()
+                else:
+                    rows_updated = run_transaction("UPDATE marketplace SET status='CLAIMED', claimed_by=:p WHERE shift_id=:id AND status='OPEN'", {"p": pin, "id": s_id})
+                    if rows_updated > 0:
+                        run_transaction("INSERT INTO schedules (shift_id, pin, shift_date, shift_time, department, status) VALUES (:id, :p, :d, :t, :dept, 'SCHEDULED')", {"id": f"SCH-{s_id}", "p": pin, "d": s_date, "t": s_time, "dept": dept})
+                        st.success("✅ Shift Claimed!"); time.sleep(2); st.rerun()
+                    else:
+                        st.error("❌ Shift Already Claimed!"); time.sleep(2); st.rerun()
+    else: st.markdown("<div class='empty-state'><h3>No Urgent Coverage Needed</h3></div>", unsafe_allow_html=True)
+
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_channel(key, query, params, accent):
+    msgs = live_rows(key, ("messages",), query, params)
+    if msgs:
+        for m in msgs:
+            sender_name = USERS.get(str(m[0]), {}).get('name', 'SYSTEM' if m[0] == 'SYSTEM' else 'Unknown')
+            dt_str = m[2].strftime('%H:%M - %b %d') if hasattr(m[2], 'strftime') else str(m[2])
+            color = "#ef4444" if m[3] else accent
+            bg_color = "rgba(239, 68, 68, 0.1)" if m[3] else "rgba(30, 41, 59, 0.6)"
+            st.markdown(f"<div style='background: {bg_color}; border-left: 4px solid {color}; padding: 15px; border-radius: 8px; margin-bottom: 10px;'><div style='display:flex; justify-content:space-between; margin-bottom:5px;'><strong style='color:#f8fafc;'>{sender_name}</strong><span style='color:#94a3b8; font-size:0.8rem;'>{dt_str}</span></div><div style='color:#cbd5e1;'>{m[1]}</div></div>", unsafe_allow_html=True)
+
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_dm_thread(pin, peer_pin):
+    dm_history = live_rows("dm_thread", ("messages",), SQL_DM_THREAD, {"p": pin, "rp": peer_pin})
+
+    if dm_history:
+        for m in dm_history:
+            is_me = (m[0] == pin)
+            sender_name = "You" if is_me else USERS.get(str(m[0]), {}).get('name', 'Unknown')
+            dt_str = m[2].strftime('%H:%M - %b %d') if hasattr(m[2], 'strftime') else str(m[2])
+            align = "right" if is_me else "left"
+            bg_color = "rgba(16, 185, 129, 0.15)" if is_me else "rgba(30, 41, 59, 0.6)"
+            border_color = "#10b981" if is_me else "#3b82f6"
+
+            st.markdown(f"<div style='text-align: {align}; margin-bottom: 10px;'><div style='display: inline-block; text-align: left; background: {bg_color}; border-left: 4px solid {border_color}; padding: 10px 15px; border-radius: 8px; min-width: 250px; max-width: 80%;'><div style='display:flex; justify-content:space-between; margin-bottom:5px;'><strong style='color:#f8fafc;'>{sender_name}</strong><span style='color:#94a3b8; font-size:0.75rem; margin-left:15px;'>{dt_str}</span></div><div style='color:#cbd5e1;'>{m[1]}</div></div></div>", unsafe_allow_html=True)
+
+@st.fragment(run_every=LIVE_CHECK_SECONDS)
+def live_poc_feed():
+    real_poc_claims = live_rows("poc_feed", ("poc_ledger",), SQL_POC_FEED)
+    
+    if real_poc_claims:
+        for claim in real_poc_claims:
+            c_id, c_pin, c_room, c_action, c_time, c_ble, c_emr, c_ai, c_hash = claim
+            op_name = USERS.get(str(c_pin), {}).get('name', f"Operator {c_pin}")
+            
+            ble_badge = "<span class='badge-pass'>BLE LOC MATCH</span>" if c_ble else "<span class='badge-warn'>BLE SIMULATED</span>"
+            emr_badge = "<span class='badge-pass'>EMR SYNCED</span>" if c_emr else "<span class='badge-fail'>EMR MISMATCH</span>"
+            ai_badge = "<span class='badge-pass'>AI VERIFIED</span>" if c_ai else "<span class='badge-warn'>AI PENDING</span>"
+            
+            border = "#10b981" if c_emr else "#ef4444"
+            status_text = "<span style='color:#10b981; font-weight:bold;'>CLEARED FOR BILLING</span>" if c_emr else "<span style='color:#ef4444; font-weight:bold;'>PENDING EMR SYNC</span>"
+            
+            try: display_time = c_time.strftime("%Y-%m-%d %H:%M:%S")
+            except: display_time = str(c_time)
+
+            st.markdown(f"""
+            <div class='glass-card' style='border-left: 5px solid {border} !important;'>
+                <div style='display:flex; justify-content:space-between;'>
+                    <strong style='font-size:1.1rem;'>{c_action} | {c_room}</strong>
+                    <span>{status_text}</span>
+                </div>
+                <div style='color:#94a3b8; font-size:0.85rem; margin-top:5px; margin-bottom:10px;'>Operator: {op_name} ({c_pin}) | Timestamp: {display_time} | Claim ID: {c_id}</div>
+                <div>{ble_badge} {emr_badge} {ai_badge}</div>
+                <div class='hash-text'>🔒 SHA-256 SEAL: {c_hash}</div>
+            </div>
+            """, unsafe_allow_html=True)
+    else:
+        st.info("No Proof-of-Care claims have been logged by operators yet.")
+
 # --- PWA MOBILE INJECTION ---
 # This forces iOS and Android to treat the website as a native app
 manifest_json = """
@@ -555,10 +1495,14 @@ if isinstance(engine_status, str):
         st.error(f"**RAW DATABASE ERROR LOG:**\n\n{engine_status}")
     st.stop()
 
+MINT_WORKER = get_mint_worker(engine_status)
+POSITION_INGEST = get_position_ingest(engine_status)
+CHANGE_LISTENER = get_change_listener(engine_status)
 USERS = load_all_users()
 
 if 'user_state' not in st.session_state: st.session_state.user_state = {'active': False, 'start_time': 0.0, 'earnings': 0.0}
 if 'geofence_alert' not in st.session_state: st.session_state.geofence_alert = False
+if 'prepared_receipts' not in st.session_state: st.session_state.prepared_receipts = set()
 
 if 'pending_opsec_reset' in st.session_state:
     st.markdown("<br><br><h1 style='text-align: center; color: #ef4444;'>SECURITY MANDATE</h1>", unsafe_allow_html=True)
@@ -595,26 +1539,30 @@ if 'logged_in_user' not in st.session_state:
         st.markdown("<br>", unsafe_allow_html=True)
         if st.button("AUTHENTICATE CONNECTION") and USERS:
             auth_pin = None
-            for p, d in USERS.items():
-                if d.get("email") == login_email.lower():
-                    stored_hash = d.get("password_hash")
-                    pw_expired = False
-                    if d.get("last_pw_change"):
-                        try:
-                            last_update = d["last_pw_change"]
-                            if isinstance(last_update, str): last_update = datetime.fromisoformat(last_update)
-                            if last_update.tzinfo is None: last_update = last_update.replace(tzinfo=pytz.UTC)
-                            if (datetime.now(pytz.UTC) - last_update).days >= OPSEC_PW_EXPIRY_DAYS: pw_expired = True
-                        except: pass 
-                    
-                    is_default = (login_password == "password123")
-                    
-                    if stored_hash and verify_password(login_password, stored_hash): 
-                        if is_default or pw_expired:
-                            st.session_state.pending_opsec_reset = True
-                            st.session_state.pending_opsec_pin = p
-                            st.rerun()
-                        else: auth_pin = p; break
+            allowed, wait = admit_login_attempt(get_auth_rate_limiter(), get_client_ip(), login_email)
+            if not allowed:
+                st.error(f"🛑 Too many sign-in attempts. Try again in {math.ceil(wait)} seconds."); st.stop()
+            d = find_user_by_email(login_email)
+            if d:
+                p = d["pin"]
+                stored_hash = d.get("password_hash")
+                pw_expired = False
+                if d.get("last_pw_change"):
+                    try:
+                        last_update = d["last_pw_change"]
+                        if isinstance(last_update, str): last_update = datetime.fromisoformat(last_update)
+                        if last_update.tzinfo is None: last_update = last_update.replace(tzinfo=pytz.UTC)
+                        if (datetime.now(pytz.UTC) - last_update).days >= OPSEC_PW_EXPIRY_DAYS: pw_expired = True
+                    except: pass 
+                
+                is_default = (login_password == "password123")
+                
+                if stored_hash and verify_password(login_password, stored_hash): 
+                    if is_default or pw_expired:
+                        st.session_state.pending_opsec_reset = True
+                        st.session_state.pending_opsec_pin = p
+                        st.rerun()
+                    else: auth_pin = p
                         
             if auth_pin:
                 st.session_state.logged_in_user = USERS[auth_pin]; st.session_state.pin = auth_pin
@@ -662,10 +1610,11 @@ if nav == "FLIGHT RISK RADAR":
     st.caption("Proactive algorithmic retention. Prevents operators from burning out and migrating to agency networks.")
     
     all_staff = {p: d for p, d in USERS.items() if d['level'] in ['Worker', 'Supervisor']}
+    fatigue = calculate_fatigue_scores(all_staff.keys())
     risk_found = False
     
     for p, d in all_staff.items():
-        f_score, f_hrs, f_notes = calculate_fatigue_score(p, d['dept'])
+        f_score, f_hrs, f_notes = fatigue[p]
         if f_score > 40 or f_hrs > 40: 
             risk_found = True
             color = "#ef4444" if f_score > 70 else "#f59e0b"
@@ -690,17 +1639,41 @@ elif nav == "COMPLIANCE":
     st.markdown("## 🛡️ Enterprise Compliance Engine")
     st.caption("Cryptographic verification of care, automated protocol enforcement, and anti-fraud auditing.")
     
-    c1, c2 = st.columns([8, 2])
-    with c1:
-        if st.button("🔄 Refresh Compliance Database"): st.rerun()
+    _, c2 = st.columns([8, 2])
     with c2:
         if PDF_ACTIVE and user['level'] in ["Admin", "Executive", "Manager", "Director"]:
-            pdf_bytes = generate_compliance_report(user['dept'], user['name'])
-            if pdf_bytes:
-                st.download_button(label="📄 Export Compliance Audit (PDF)", data=pdf_bytes, file_name=f"Vicentus_Audit_{user['dept']}_{date.today()}.pdf", mime="application/pdf")
+            # Built only when asked for, then served from the per-(dept, manager, day, ledger version) cache.
+            if st.session_state.get('compliance_report_requested') or st.button("🧾 Build Compliance Audit"):
+                st.session_state.compliance_report_requested = True
+                pdf_bytes = cached_compliance_report(user['dept'], user['name'])
+                if pdf_bytes:
+                    st.download_button(label="📄 Export Compliance Audit (PDF)", data=pdf_bytes, file_name=f"Vicentus_Audit_{user['dept']}_{date.today()}.pdf", mime="application/pdf")
         elif not PDF_ACTIVE:
             st.warning("⚠️ FPDF library not installed.")
 
+    if user['level'] in ["Admin", "Executive", "Manager", "Director"]:
+        with st.expander("📦 Bulk Export (ZIP)"):
+            export_kinds = ["All Departments' Compliance Audits"] + (["All Paystubs For A Pay Period"] if user['role'] == "CFO" or user['level'] == "Admin" else [])
+            export_kind = st.radio("Export", export_kinds, horizontal=True)
+            if export_kind == "All Paystubs For A Pay Period":
+                c_e1, c_e2 = st.columns(2)
+                period_start = c_e1.date_input("Period Start", value=date.today() - timedelta(days=14), key="export_start")
+                period_end = c_e2.date_input("Period End", value=date.today(), key="export_end")
+            if st.button("⚙️ Run Export Job"):
+                jobs = paystub_export_jobs(period_start, period_end) if export_kind == "All Paystubs For A Pay Period" else compliance_export_jobs(user['name'])
+                if not jobs: st.info("Nothing to export for that selection.")
+                else:
+                    # Built in memory: download_button holds the bytes anyway, and nothing is left on disk when the session ends.
+                    st.session_state.pop('export_zip', None)
+                    buffer = io.BytesIO()
+                    bar = st.progress(0.0, text=f"Rendering 0 / {len(jobs)} files across {EXPORT_WORKERS} workers...")
+                    written = export_zip(jobs, buffer, on_progress=lambda done, total: bar.progress(done / total, text=f"Rendering {done} / {total} files across {EXPORT_WORKERS} workers..."))
+                    label = "Paystubs" if export_kind == "All Paystubs For A Pay Period" else "Compliance"
+                    st.session_state.export_zip = (buffer.getvalue(), f"Vicentus_{label}_{date.today()}.zip", written)
+            if st.session_state.get('export_zip'):
+                zip_bytes, zip_name, written = st.session_state.export_zip
+                st.download_button(label=f"⬇️ Download {zip_name} ({written} files)", data=zip_bytes, file_name=zip_name, mime="application/zip")
+
     tab_poc, tab_proto, tab_comp = st.tabs(["🔒 LIVE PROOF OF CARE (PoC) LEDGER", "🛑 PROTOCOL COMMAND", "🪪 COMPETENCY AUDIT"])
 
     with tab_poc:
@@ -713,36 +1686,7 @@ elif nav == "COMPLIANCE":
                 
         st.caption("Mathematically proves service delivery by correlating BLE indoor geolocation, EMR documentation, and AI verification, sealed with an immutable SHA-256 cryptographic hash.")
         
-        real_poc_claims = run_query("SELECT claim_id, pin, patient_room, action, timestamp, ble_verified, emr_verified, ai_verified, secure_hash FROM poc_ledger ORDER BY timestamp DESC LIMIT 20")
-        
-        if real_poc_claims:
-            for claim in real_poc_claims:
-                c_id, c_pin, c_room, c_action, c_time, c_ble, c_emr, c_ai, c_hash = claim
-                op_name = USERS.get(str(c_pin), {}).get('name', f"Operator {c_pin}")
-                
-                ble_badge = "<span class='badge-pass'>BLE LOC MATCH</span>" if c_ble else "<span class='badge-warn'>BLE SIMULATED</span>"
-                emr_badge = "<span class='badge-pass'>EMR SYNCED</span>" if c_emr else "<span class='badge-fail'>EMR MISMATCH</span>"
-                ai_badge = "<span class='badge-pass'>AI VERIFIED</span>" if c_ai else "<span class='badge-warn'>AI PENDING</span>"
-                
-                border = "#10b981" if c_emr else "#ef4444"
-                status_text = "<span style='color:#10b981; font-weight:bold;'>CLEARED FOR BILLING</span>" if c_emr else "<span style='color:#ef4444; font-weight:bold;'>PENDING EMR SYNC</span>"
-                
-                try: display_time = c_time.strftime("%Y-%m-%d %H:%M:%S")
-                except: display_time = str(c_time)
-
-                st.markdown(f"""
-                <div class='glass-card' style='border-left: 5px solid {border} !important;'>
-                    <div style='display:flex; justify-content:space-between;'>
-                        <strong style='font-size:1.1rem;'>{c_action} | {c_room}</strong>
-                        <span>{status_text}</span>
-                    </div>
-                    <div style='color:#94a3b8; font-size:0.85rem; margin-top:5px; margin-bottom:10px;'>Operator: {op_name} ({c_pin}) | Timestamp: {display_time} | Claim ID: {c_id}</div>
-                    <div>{ble_badge} {emr_badge} {ai_badge}</div>
-                    <div class='hash-text'>🔒 SHA-256 SEAL: {c_hash}</div>
-                </div>
-                """, unsafe_allow_html=True)
-        else:
-            st.info("No Proof-of-Care claims have been logged by operators yet.")
+        live_poc_feed()
 
     with tab_proto:
         st.markdown("### 🛑 Protocol & Policy Command")
@@ -795,7 +1739,7 @@ elif nav == "COMPLIANCE":
             
             with c_sub1:
                 st.markdown(f"#### Active {user['dept']} Protocols")
-                active_p = run_query("SELECT title, next_review FROM hospital_protocols WHERE status='ACTIVE' AND (department=:d OR department='All')", {"d": user['dept']})
+                active_p = run_query(SQL_ACTIVE_PROTOCOLS, {"d": user['dept']})
                 if active_p:
                     for p in active_p:
                         st.markdown(f"<div class='glass-card' style='border-left: 4px solid #10b981 !important;'><strong>{p[0]}</strong><br><span style='color:#94a3b8; font-size:0.85rem;'>Next Review: {p[1]}</span></div>", unsafe_allow_html=True)
@@ -858,11 +1802,8 @@ elif nav == "COMPLIANCE":
 elif nav == "DASHBOARD":
     st.markdown(f"<h2 style='font-weight: 800;'>Status Terminal</h2>", unsafe_allow_html=True)
     st.caption("Enterprise Ledger Metrics Active. Live shift monitoring enabled.")
-    if st.button("🔄 Force Cloud Sync"): force_cloud_sync(pin); st.rerun()
     if user['level'] in ["Admin", "Executive", "Manager", "Director", "Supervisor"]:
-        active_count = run_query("SELECT COUNT(*) FROM workers WHERE status='Active'")[0][0] if run_query("SELECT COUNT(*) FROM workers WHERE status='Active'") else 0
-        shifts_count = run_query("SELECT COUNT(*) FROM marketplace WHERE status='OPEN'")[0][0] if run_query("SELECT COUNT(*) FROM marketplace WHERE status='OPEN'") else 0
-        c1, c2, c3 = st.columns(3); c1.metric("Live Staff", active_count); c2.metric("Critical Shifts", shifts_count, f"{shifts_count} Open" if shifts_count > 0 else "Fully Staffed", delta_color="inverse"); c3.metric("Approvals", "Active")
+        live_staff_metrics()
         st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
 
     active = st.session_state.user_state.get('active', False)
@@ -871,13 +1812,15 @@ elif nav == "DASHBOARD":
         base_pay, diff_pay, diff_str = calculate_shift_differentials(st.session_state.user_state['start_time'], user['rate'])
         running_earn = base_pay + diff_pay
         if diff_pay > 0: st.info(f"✨ Active Shift Differentials Applied: {diff_str}")
+        if not user.get('vip', False): position_stream(pin)
+        if (take_geofence_exit(pin) or pin in current_geofence_breaches()) and time.time() >= st.session_state.get('geofence_snoozed_until', 0.0): st.session_state.geofence_alert = True
         
         if st.session_state.geofence_alert:
             st.markdown("<div class='glass-card' style='border-left: 5px solid #f59e0b !important;'>", unsafe_allow_html=True)
             st.warning("⚠️ GEOFENCE ALERT: Are you still working? Your GPS indicates you left the hospital radius.")
             c_g1, c_g2 = st.columns(2)
             if c_g1.button("✅ Yes, on Official Transport"):
-                st.session_state.geofence_alert = False
+                st.session_state.geofence_alert = False; st.session_state.geofence_snoozed_until = time.time() + GEOFENCE_SNOOZE_SECONDS
                 log_action(pin, "GEOFENCE DISMISSED", 0, "Operator verified official transport.")
                 st.rerun()
             if c_g2.button("🛑 No, Clock Me Out Now"):
@@ -926,7 +1869,10 @@ elif nav == "DASHBOARD":
                         ts_string = datetime.now(LOCAL_TZ).strftime("%Y-%m-%d %H:%M:%S")
                         live_hash = generate_poc_hash(new_claim_id, pin, poc_room, poc_action, ts_string)
                         
-                        db_save = run_transaction("INSERT INTO poc_ledger (claim_id, pin, patient_room, action, timestamp, ble_verified, emr_verified, ai_verified, status, secure_hash) VALUES (:cid, :p, :r, :a, NOW(), TRUE, FALSE, TRUE, 'PENDING_EMR', :h)", {"cid": new_claim_id, "p": pin, "r": poc_room, "a": poc_action, "h": live_hash})
+                        try:
+                            with db_unit_of_work() as uow: seal_poc_claim(new_claim_id, pin, poc_room, poc_action, live_hash, ts_string, conn=uow)
+                            db_save = 1
+                        except Exception: db_save = 0
                         
                         if db_save > 0:
                             st.success(f"✅ Event cryptographically sealed in PoC Ledger! (Awaiting EMR Sync)")
@@ -936,18 +1882,21 @@ elif nav == "DASHBOARD":
                                 action_mapping = {"Endotracheal Intubation": 1, "Initiate Veletri/Flolan": 2, "CRRT Dialysis Setup": 3, "Code Blue Response": 4}
                                 action_id = action_mapping.get(poc_action, 99)
                                 
-                                # 2. Trigger the Web3 Engine (Silently pings Base Sepolia L2)
+                                # 2. Save to internal database and queue the Web3 mint in the same transaction
                                 dummy_wallet = "0xAb8483F64d9C6d1EcF9b849Ae677dD3315835cb2" # Replace with user's actual DB wallet later
-                                tx_receipt = mint_sbt_on_chain(dummy_wallet, action_id)
-                                
-                                # 3. Save to internal database
                                 sbt_id = f"SBT-{pin}-{int(time.time()*1000)}"
-                                run_transaction("""
-                                    INSERT INTO obt_ledger (token_id, pin, accolade_type, clinical_context, facility_origin, encryption_hash) 
-                                    VALUES (:t_id, :p, 'Critical Intervention', :ctx, 'Hospital A', :hash)
-                                """, {"t_id": sbt_id, "p": pin, "ctx": f"{poc_action} | {poc_room}", "hash": tx_receipt})
-                                
-                                st.success(f"🏅 L2 SMART CONTRACT FIRED: {poc_action} permanently added to your Soulbound Portfolio.\n\n`Tx Hash: {tx_receipt}`")
+                                try:
+                                    with db_unit_of_work() as uow:
+                                        run_transaction("""
+                                            INSERT INTO obt_ledger (token_id, pin, accolade_type, clinical_context, facility_origin, encryption_hash, claim_id) 
+                                            VALUES (:t_id, :p, 'Critical Intervention', :ctx, 'Hospital A', :hash, :cid)
+                                        """, {"t_id": sbt_id, "p": pin, "ctx": f"{poc_action} | {poc_room}", "hash": "PENDING_MINT" if SBT_ISSUANCE_MODE == "mint" else "PENDING_ANCHOR", "cid": new_claim_id}, conn=uow)
+                                        if SBT_ISSUANCE_MODE == "mint": enqueue_mint(sbt_id, dummy_wallet, action_id, conn=uow)
+                                except Exception as e: st.error(f"❌ Accolade could not be queued: {e}")
+                                else:
+                                    # 3. Per-event mode wakes the background minter; anchor mode waits for the day's root to be anchored on Base Sepolia L2
+                                    if SBT_ISSUANCE_MODE == "mint": MINT_WORKER["wake"].set()
+                                    st.success(f"🏅 L2 ACCOLADE QUEUED: {poc_action} added to your Soulbound Portfolio. The on-chain receipt will attach automatically.\n\n`Token: {sbt_id}`")
             
             st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
             if st.button("🚙 Simulate Leaving Geofence (FLSA Soft Alert)"):
@@ -955,14 +1904,22 @@ elif nav == "DASHBOARD":
                 st.rerun()
 
     else:
-        selected_facility = st.selectbox("Select Facility", list(HOSPITALS.keys()))
+        facilities = get_facility_registry()
+        loc = get_geolocation() if not user.get('vip', False) else None
+        facility_options = list(facilities.keys())
+        if loc:
+            nearby = nearest_facilities(get_facility_index(), loc['coords']['latitude'], loc['coords']['longitude'])
+            if nearby:
+                # Closest sites first; demo placeholders stay selectable after them.
+                facility_options = [n for n, _ in nearby] + [n for n in facility_options if (float(facilities[n]["lat"]), float(facilities[n]["lon"])) == (0.0, 0.0)]
+                st.caption("📍 Nearest facilities: " + " • ".join(f"{n} ({d / 1000:.2f} km)" for n, d in nearby))
+        selected_facility = st.selectbox("Select Facility", facility_options)
         if not user.get('vip', False):
             st.info("Identity verification required to initiate shift.")
             camera_photo = st.camera_input("Take a photo to verify identity")
-            loc = get_geolocation()
             if camera_photo and loc:
                 user_lat, user_lon = loc['coords']['latitude'], loc['coords']['longitude']
-                fac_lat, fac_lon = HOSPITALS[selected_facility]["lat"], HOSPITALS[selected_facility]["lon"]
+                fac_lat, fac_lon = float(facilities[selected_facility]["lat"]), float(facilities[selected_facility]["lon"])
                 
                 # --- DEMO MODE BYPASS FOR GEOFENCE ---
                 if fac_lat == 0.0 and fac_lon == 0.0:
@@ -970,7 +1927,7 @@ elif nav == "DASHBOARD":
                     start_pin = st.text_input("Enter PIN to Clock In", type="password", key="start_pin_demo")
                     if st.button("PUNCH IN") and start_pin == pin:
                         start_t = time.time(); update_status(pin, "Active", start_t, st.session_state.user_state.get('earnings', 0.0), user_lat, user_lon); st.session_state.user_state['active'] = True; st.session_state.user_state['start_time'] = start_t; log_action(pin, "CLOCK IN", 0, f"Loc: {selected_facility}"); st.rerun()
-                elif haversine_distance(user_lat, user_lon, fac_lat, fac_lon) <= GEOFENCE_RADIUS:
+                elif haversine_vec(user_lat, user_lon, fac_lat, fac_lon) <= GEOFENCE_RADIUS:
                     st.success(f"✅ Geofence Confirmed.")
                     start_pin = st.text_input("Enter PIN to Clock In", type="password", key="start_pin")
                     if st.button("PUNCH IN") and start_pin == pin:
@@ -986,13 +1943,30 @@ elif nav == "DASHBOARD":
 elif nav == "OPSEC & INFRASTRUCTURE":
     st.markdown("## 🔐 Infrastructure Command")
     st.caption("Live network diagnostics, cryptographic load, and API routing telemetry.")
-    if st.button("🔄 Ping Servers"): st.rerun()
+    feed = get_change_feed()
+    st.caption(f"Change feed: {'LISTENING' if feed['listening'] else 'OFFLINE (same-process writes only)'} on '{CHANGE_CHANNEL}' | {feed['notifies']:,} notifications" + (f", last {feed['last_event'].strftime('%H:%M:%S')}" if feed['last_event'] else "") + f" | watchers tick every {LIVE_CHECK_SECONDS}s without querying" + (f" | last error: {feed['last_error']}" if feed['last_error'] else ""))
     
     c1, c2, c3 = st.columns(3)
     c1.metric("Database Gateway", "aws-1-us-east-2", "99.9% Uptime")
     c2.metric("Cryptographic Hashes Logged", "24,102", "SHA-256 Secured")
     c3.metric("Blocked Intrusions (24h)", "14", "-2 from yesterday", delta_color="inverse")
     
+    boot = get_bootstrap_report()
+    if boot:
+        st.caption(f"Schema bootstrap ran once at {boot['at'].strftime('%Y-%m-%d %H:%M:%S')} in {boot['seconds']*1000:.0f} ms (migrations applied: {boot['applied'] or 'none'}, seed accounts hashed: {boot['seeded']}). Subsequent requests reuse the pooled engine.")
+    
+    telemetry = get_db_telemetry()
+    if telemetry["timings"]:
+        timing_df = pd.DataFrame(list(telemetry["timings"]), columns=["Statement", "ms"])
+        st.caption(f"DB pool: size {DB_POOL_SIZE} + overflow {DB_MAX_OVERFLOW} | statement timeout {DB_STATEMENT_TIMEOUT_MS} ms | last {len(timing_df)} statements: p50 {timing_df['ms'].quantile(0.5):.1f} ms, p95 {timing_df['ms'].quantile(0.95):.1f} ms")
+        with st.expander("⏱️ Slowest Recent Statements"):
+            st.dataframe(timing_df.groupby("Statement")["ms"].agg(["count", "mean", "max"]).sort_values("max", ascending=False).head(15), use_container_width=True)
+    memo_total = telemetry["memo"]["hits"] + telemetry["memo"]["misses"]
+    if memo_total: st.caption(f"Per-rerun query memo: {telemetry['memo']['hits']:,} duplicate round-trips saved of {memo_total:,} reads ({telemetry['memo']['hits'] / memo_total:.0%} hit rate) | this rerun: {QUERY_MEMO_STATS['hits']} hits / {QUERY_MEMO_STATS['misses']} misses")
+    if telemetry["errors"]:
+        with st.expander(f"🚨 Recent Database Errors ({len(telemetry['errors'])})"):
+            st.dataframe(pd.DataFrame(list(telemetry["errors"]), columns=["At", "Statement", "Error"]), use_container_width=True, hide_index=True)
+    
     st.markdown("### Live API Telemetry")
     st.markdown("""
     <div class='glass-card' style='font-family: monospace; color: #34d399;'>
@@ -1004,20 +1978,138 @@ elif nav == "OPSEC & INFRASTRUCTURE":
     </div>
     """, unsafe_allow_html=True)
     
+    st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
+    st.markdown("### 🪙 SBT Mint Outbox")
+    st.caption(f"Background minter: {'LIVE' if web3_ready() else 'SIMULATED (no private key)'} | issuance: {SBT_ISSUANCE_MODE} | anchor chain: {MINT_WORKER['anchor_chain'] or 'none'} | {MINT_WORKER['cycles']:,} cycles | {MINT_WORKER['sent']:,} sent | {MINT_WORKER['confirmed']:,} confirmed | {MINT_WORKER['days_finalized']:,} days auto-finalized | {MINT_WORKER['anchors_submitted']:,} roots anchored ({MINT_WORKER['anchors_confirmed']:,} confirmed) | {MINT_WORKER['failed']:,} failed" + (f" | last error: {MINT_WORKER['last_error']}" if MINT_WORKER['last_error'] else ""))
+    anchor_counts = run_query("SELECT status, COUNT(*), MAX(date) FROM daily_rollups GROUP BY status ORDER BY status")
+    if anchor_counts: st.dataframe(pd.DataFrame([{"Rollup Status": r[0], "Days": r[1], "Latest": r[2]} for r in anchor_counts]), use_container_width=True, hide_index=True)
+    outbox_counts = run_query("SELECT status, COUNT(*), MIN(created_at) FROM mint_outbox GROUP BY status ORDER BY status")
+    if outbox_counts: st.dataframe(pd.DataFrame([{"Status": r[0], "Mints": r[1], "Oldest": r[2]} for r in outbox_counts]), use_container_width=True, hide_index=True)
+    if web3_ready():
+        try: w3m = web3_metrics_snapshot(get_web3_client())
+        except Exception as e: w3m = None; st.warning(f"RPC provider unreachable: {e}")
+        if w3m:
+            c_w1, c_w2, c_w3, c_w4 = st.columns(4)
+            c_w1.metric("RPC Latency p50 / p95", f"{w3m['rpc_p50_ms']:.0f} / {w3m['rpc_p95_ms']:.0f} ms" if w3m['rpc_p50_ms'] is not None else "—", f"{w3m['rpc_calls']:,} calls")
+            c_w2.metric("RPC Calls per Tx", f"{w3m['calls_per_send']:.1f}" if w3m['calls_per_send'] is not None else "—")
+            c_w3.metric("Gas Used vs Limit", f"{w3m['gas_used_vs_limit']:.0%}" if w3m['gas_used_vs_limit'] is not None else "—")
+            c_w4.metric("Max Fee / Tip", f"{w3m['max_fee_gwei']:.3f} / {w3m['priority_fee_gwei']:.3f} gwei", f"chain {w3m['chain_id']} • {w3m['fee_window_blocks']} blk window", delta_color="off")
+    if st.button("⏩ Drain Outbox Now"): MINT_WORKER["wake"].set(); st.success("✅ Minter woken.")
+
+    st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
+    st.markdown("### 📍 Geofence Monitor")
+    geo_monitor = get_geofence_monitor()
+    st.caption(f"{len(get_facility_index()['names']):,} geofenced facilities of {len(get_facility_registry()):,} registered | radius {GEOFENCE_RADIUS} m | bulk re-check every {GEOFENCE_RECHECK_SECONDS}s: {geo_monitor['checks']:,} runs, last {geo_monitor['seconds'] * 1000:.1f} ms, {len(geo_monitor['breaches'])} active workers outside every fence")
+    if st.button("🔁 Re-check Active Workers Now"):
+        with geo_monitor["lock"]: geo_monitor["checked_at"] = 0.0
+        st.success(f"✅ {len(current_geofence_breaches())} breach(es) found in {geo_monitor['seconds'] * 1000:.1f} ms.")
+    st.caption(f"Position ingest: queue {POSITION_INGEST['queue'].qsize():,}/{POSITION_QUEUE_MAX:,} | {POSITION_INGEST['accepted']:,} pings accepted, {POSITION_INGEST['coalesced']:,} coalesced, {POSITION_INGEST['dropped']:,} dropped | {POSITION_INGEST['flushes']:,} flushes, {POSITION_INGEST['rows']:,} rows, last {POSITION_INGEST['last_flush_ms']:.1f} ms | {POSITION_INGEST['exits_detected']:,} exits detected" + (f" | last error: {POSITION_INGEST['last_error']}" if POSITION_INGEST['last_error'] else ""))
     st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
     st.markdown("### ⛓️ Layer 2 Merkle Root Batching")
     st.caption("Hash all daily Proof-of-Care transactions into a single Merkle Root for decentralized ledger deployment.")
     
+    live_acc = get_live_merkle_root(str(datetime.now(LOCAL_TZ).date()))
+    if live_acc:
+        c_l1, c_l2 = st.columns([1, 3])
+        c_l1.metric("Claims Sealed Today", f"{live_acc['leaves']:,}", "Finalized" if live_acc['finalized'] else "Open")
+        c_l2.markdown(f"<div class='hash-text' style='font-size:0.9rem;'>LIVE ROOT ({live_acc['scheme']}): {live_acc['root']}</div>", unsafe_allow_html=True)
+
     with st.form("merkle_rollup_form"):
-        target_date = st.date_input("Target Rollup Date", value=date.today())
+        last_closed_day = datetime.now(LOCAL_TZ).date() - timedelta(days=1)
+        target_date = st.date_input("Target Rollup Date", value=last_closed_day, max_value=last_closed_day)
+        legacy_root = st.checkbox("Legacy hex-compatible root (matches roots produced before binary hashing)", value=False)
+        st.caption("Finalize closes the day from its live accumulator. The full rollup re-derives the day from the ledger and resets its accumulator. Only days that have ended are accepted; the mint worker finalizes them automatically after midnight.")
+        if st.form_submit_button("🔒 Finalize Day From Accumulator"):
+            success, result = finalize_rollup_day(str(target_date))
+            if success:
+                st.success("✅ Day finalized from accumulator peaks!")
+                st.markdown(f"<div class='hash-text' style='font-size:1rem;'>ROOT HASH: {result}</div>", unsafe_allow_html=True)
+            else:
+                st.error(f"❌ Finalization Failed: {result}")
         if st.form_submit_button("⚡ Execute Daily Hash Rollup"):
-            success, result = execute_daily_rollup(str(target_date))
+            success, result = execute_daily_rollup(str(target_date), "legacy-hex" if legacy_root else "sha256-bin")
             if success:
                 st.success("✅ Merkle Root successfully generated and stored!")
                 st.markdown(f"<div class='hash-text' style='font-size:1rem;'>ROOT HASH: {result}</div>", unsafe_allow_html=True)
             else:
                 st.error(f"❌ Rollup Failed: {result}")
 
+    with st.form("merkle_backfill_form"):
+        c_b1, c_b2 = st.columns(2)
+        last_closed_day = datetime.now(LOCAL_TZ).date() - timedelta(days=1)
+        backfill_start = c_b1.date_input("Backfill From", value=last_closed_day - timedelta(days=6), max_value=last_closed_day)
+        backfill_end = c_b2.date_input("Backfill Through", value=last_closed_day, max_value=last_closed_day)
+        if st.form_submit_button("⏪ Backfill Rollups For Range"):
+            if backfill_end < backfill_start: st.error("❌ End date precedes start date.")
+            else:
+                try:
+                    backfilled = execute_rollup_range(backfill_start, backfill_end)
+                    if backfilled: st.success(f"✅ Rolled up {len(backfilled)} day(s) covering {sum(c for _, c in backfilled.values()):,} claims in one ledger pass.")
+                    else: st.info("No sealed claims found in that range.")
+                except Exception as e: st.error(f"❌ Backfill aborted: {e}")
+
+    with st.form("merkle_proof_form"):
+        proof_claim = st.text_input("Claim ID", placeholder="CLM-...")
+        if st.form_submit_button("🧾 Generate & Verify Inclusion Proof"):
+            proof = get_inclusion_proof(proof_claim.strip())
+            if not proof: st.error("❌ Claim is not part of any persisted rollup.")
+            else:
+                verified = verify_proof(proof["leaf"], proof["siblings"], proof["root"], proof["scheme"])
+                (st.success if verified else st.error)(f"{'✅ Verified' if verified else '❌ Proof does not match'}: leaf #{proof['leaf_index']} of rollup {proof['date']} ({proof['scheme']}, {len(proof['siblings'])} sibling hashes).")
+                st.json(proof)
+
+    st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
+    st.markdown("### 🛡️ PoC Ledger Integrity Audit")
+    st.caption(f"Re-derives every sealed claim hash from its row contents across {POC_AUDIT_WORKERS} worker processes and signs the result with AUDIT_SIGNING_KEY{'' if os.environ.get('AUDIT_SIGNING_KEY') else ' (not set: results will be stored UNSIGNED)'}.")
+    if st.button("🔬 Run Full Ledger Audit"):
+        with st.spinner("Recomputing seals..."):
+            ok, audit = audit_poc_ledger()
+        if not ok: st.error(f"❌ {audit}")
+        else:
+            summ = audit["summary"]
+            c_a1, c_a2, c_a3, c_a4 = st.columns(4)
+            c_a1.metric("Claims Audited", f"{summ['rows']:,}")
+            c_a2.metric("Mismatches", f"{summ['mismatches']:,}")
+            c_a3.metric("Hashes / sec", f"{summ['hashes_per_sec']:,.0f}")
+            c_a4.metric("Hashes / sec / core", f"{summ['hashes_per_sec_per_core']:,.0f}")
+            if audit["mismatches"]: st.dataframe(pd.DataFrame(audit["mismatches"]), use_container_width=True, hide_index=True)
+            else: st.success("✅ Every stored secure_hash matches its row contents.")
+            if audit["signature"]: st.markdown(f"<div class='hash-text'>AUDIT SIGNATURE (HMAC-SHA256): {audit['signature']}</div>", unsafe_allow_html=True)
+            else: st.warning("⚠️ UNSIGNED: AUDIT_SIGNING_KEY is not set, so this summary was stored without a signature and cannot be verified later.")
+    past_audits = run_query("SELECT audit_id, audited_at, rows_checked, mismatches, summary, signature FROM poc_audits ORDER BY audited_at DESC LIMIT 10")
+    if past_audits:
+        st.dataframe(pd.DataFrame([{"Audit": a[0], "Run": a[1], "Rows": a[2], "Mismatches": a[3], "Signature": {True: "VALID", False: "TAMPERED", None: "UNSIGNED" if not a[5] else "NO KEY TO VERIFY"}[verify_audit_signature(json.loads(a[4]), a[5])]} for a in past_audits]), use_container_width=True, hide_index=True)
+
+    st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
+    st.markdown("### 🧮 Worker Pay Rollups")
+    st.caption("Per-worker daily pay buckets that back YTD tax withholding and rolling overtime checks.")
+    c_r1, c_r2 = st.columns(2)
+    if c_r1.button("🔍 Verify Rollups Against History"):
+        drift = check_worker_rollups()
+        if drift is None: st.error("❌ Consistency check failed to run.")
+        elif not drift: st.success("✅ Worker rollups match the raw history ledger.")
+        else:
+            st.warning(f"⚠️ {len(drift)} bucket(s) drifted from history.")
+            st.dataframe(pd.DataFrame(drift, columns=["PIN", "Day", "Rollup Gross", "History Gross", "Rollup Clock Outs", "History Clock Outs"]), use_container_width=True)
+    if c_r2.button("♻️ Rebuild Rollups From History"):
+        success, result = rebuild_worker_rollups()
+        if success: st.success(f"✅ Rebuilt {result} daily bucket(s).")
+        else: st.error(f"❌ Rebuild Failed: {result}")
+
+    st.markdown("<hr style='border-color: rgba(255,255,255,0.1);'>", unsafe_allow_html=True)
+    st.markdown("### 🧭 Schema Migrations & Query Plan Audit")
+    applied_migrations = run_query("SELECT version, name, applied_at FROM schema_migrations ORDER BY version")
+    if applied_migrations: st.dataframe(pd.DataFrame(applied_migrations, columns=["Version", "Migration", "Applied At"]), use_container_width=True, hide_index=True)
+    st.caption(f"Schema at v{max(m[0] for m in SCHEMA_MIGRATIONS)}. The audit EXPLAINs every hot query with sequential scans disabled; any table still scanned is missing an index.")
+    if st.button("🔬 Audit Hot Query Plans"):
+        plan_report = audit_hot_query_plans()
+        if plan_report is None: st.error("❌ Database offline.")
+        else:
+            regressions = [(label, scans) for label, scans in plan_report if scans]
+            if regressions:
+                for label, scans in regressions: st.error(f"❌ {label}: sequential scan on {', '.join(str(x) for x in scans)}")
+            else: st.success(f"✅ All {len(plan_report)} hot queries are served by indexes.")
+
 elif nav == "EXECUTIVE BRIEFING":
     st.markdown("## 🦅 CEO Global Overview")
     st.caption("Top-line enterprise metrics. Financial efficiency and operational risk.")
@@ -1043,10 +2135,11 @@ elif nav == "FATIGUE MATRIX":
     
     st.markdown("### High-Risk Operators (Action Required)")
     all_staff = {p: d for p, d in USERS.items() if d['level'] in ['Worker', 'Supervisor']}
+    fatigue = calculate_fatigue_scores(all_staff.keys())
     risk_found = False
     
     for p, d in all_staff.items():
-        f_score, f_hrs, f_notes = calculate_fatigue_score(p, d['dept'])
+        f_score, f_hrs, f_notes = fatigue[p]
         if f_score > 40 or f_hrs > 40: 
             risk_found = True
             color = "#ef4444" if f_score > 70 else "#f59e0b"
@@ -1066,19 +2159,18 @@ elif nav == "FATIGUE MATRIX":
 
 elif nav == "COMMAND CENTER":
     st.markdown("## 🦅 Command Center")
-    if st.button("🔄 Refresh Data Link"): st.rerun()
     t_finance, t_fleet = st.tabs(["📈 FINANCIAL INTELLIGENCE", "🗺️ LIVE FLEET TRACKING"])
     
-    raw_history = run_query("SELECT pin, amount, DATE(timestamp) FROM history WHERE action='CLOCK OUT'")
-    if not raw_history:
-        dates = pd.date_range(end=datetime.today(), periods=14).tolist()
-        demo_data = []
-        for d in dates: demo_data.append(["1001", 1200.00, d]); demo_data.append(["1002", 650.00, d]); demo_data.append(["1003", 900.00, d])
-        df = pd.DataFrame(demo_data, columns=["PIN", "Amount", "Date"]); st.warning("⚠️ DEMO DATA MODE ACTIVE")
-    else: df = pd.DataFrame(raw_history, columns=["PIN", "Amount", "Date"])
-
     with t_finance:
-        df['Amount'] = df['Amount'].astype(float); df['Dept'] = df['PIN'].apply(lambda x: USERS.get(str(x), {}).get('dept', 'Unknown'))
+        spend_range = st.date_input("Spend Window", value=(date.today() - timedelta(days=29), date.today()), key="cc_spend_range")
+        range_start, range_end = (spend_range[0], spend_range[-1]) if isinstance(spend_range, (tuple, list)) and spend_range else (date.today() - timedelta(days=29), date.today())
+        df = get_spend_by_dept_day(range_start, range_end)
+        if df.empty:
+            dates = pd.date_range(end=datetime.today(), periods=14).tolist()
+            demo_data = []
+            for d in dates:
+                for demo_pin, demo_amt in (("1001", 1200.00), ("1002", 650.00), ("1003", 900.00)): demo_data.append([USERS.get(demo_pin, {}).get('dept', 'Unknown'), d, demo_amt])
+            df = pd.DataFrame(demo_data, columns=["Dept", "Date", "Amount"]); st.warning("⚠️ DEMO DATA MODE ACTIVE")
         total_spend = df['Amount'].sum(); agency_cost = total_spend * 2.5; agency_avoidance = agency_cost - total_spend
         c1, c2, c3 = st.columns(3); c1.metric("Internal Labor Spend", f"${total_spend:,.2f}"); c2.metric("Projected Agency Cost", f"${agency_cost:,.2f}"); c3.metric("Agency Avoidance Savings", f"${agency_avoidance:,.2f}")
         col_chart1, col_chart2 = st.columns(2)
@@ -1087,17 +2179,7 @@ elif nav == "COMMAND CENTER":
         st.plotly_chart(px.area(df.groupby('Date')['Amount'].sum().reset_index(), x="Date", y="Amount", template="plotly_dark").update_layout(plot_bgcolor="rgba(0,0,0,0)", paper_bgcolor="rgba(0,0,0,0)", margin=dict(l=0, r=0, t=20, b=0)), use_container_width=True)
 
     with t_fleet:
-        active_workers = run_query("SELECT pin, start_time, earnings, lat, lon FROM workers WHERE status='Active'")
-        if active_workers:
-            map_data = []
-            for w in active_workers:
-                w_pin, w_start, w_lat, w_lon = str(w[0]), float(w[1]), w[3], w[4]; w_name = USERS.get(w_pin, {}).get("name", "Unknown"); hrs = (time.time() - w_start) / 3600
-                base_pay, diff_pay, diff_str = calculate_shift_differentials(w_start, float(USERS.get(w_pin, {}).get("rate", 0.0)))
-                est_gross = float(w[2]) + base_pay + diff_pay
-                st.markdown(f"<div class='glass-card' style='border-left: 4px solid #10b981 !important;'><div style='display:flex; justify-content:space-between; align-items:center;'><h4 style='margin:0;'>{w_name}</h4><span style='color:#10b981; font-weight:bold;'>🟢 ON CLOCK ({hrs:.2f} hrs) | Est: ${est_gross:.2f}</span></div></div>", unsafe_allow_html=True)
-                if w_lat and w_lon: map_data.append({"name": w_name, "lat": float(w_lat), "lon": float(w_lon)})
-            if map_data: st.pydeck_chart(pdk.Deck(layers=[pdk.Layer("ScatterplotLayer", pd.DataFrame(map_data), get_position='[lon, lat]', get_color='[16, 185, 129, 200]', get_radius=100)], initial_view_state=pdk.ViewState(latitude=pd.DataFrame(map_data)['lat'].mean(), longitude=pd.DataFrame(map_data)['lon'].mean(), zoom=11, pitch=45), map_style='mapbox://styles/mapbox/dark-v10'))
-        else: st.info("No active operators in the field.")
+        live_fleet_panel()
 
 elif nav == "FINANCIAL FORECAST":
     st.markdown("## 📊 Predictive Payroll Outflow")
@@ -1108,7 +2190,7 @@ elif nav == "FINANCIAL FORECAST":
     critical_outflow = sum((float(m[0]) * 12) for m in open_markets) if open_markets else 0.0
     c1, c2, c3 = st.columns(3); c1.metric("Scheduled Baseline", f"${base_outflow:,.2f}"); c2.metric("Critical Liability", f"${critical_outflow:,.2f}", delta_color="inverse"); c3.metric("Total Forecasted Outflow", f"${base_outflow + critical_outflow:,.2f}")
     st.markdown("<br><hr style='border-color: rgba(255,255,255,0.1);'><br>", unsafe_allow_html=True)
-    full_scheds = run_query("SELECT shift_id, pin, shift_date, shift_time, department FROM schedules WHERE status='SCHEDULED' ORDER BY shift_date ASC")
+    full_scheds = run_query(SQL_SCHEDULED_BASELINE)
     if full_scheds:
         for s in full_scheds: st.markdown(f"<div class='sched-row'><div class='sched-time'>{s[2]}</div><div style='flex-grow: 1; padding-left: 15px;'><span class='sched-name'>{USERS.get(str(s[1]), {}).get('name', f'User {s[1]}')}</span> | {s[4]}</div></div>", unsafe_allow_html=True)
     else: st.info("No baseline shifts scheduled.")
@@ -1130,7 +2212,8 @@ elif nav == "CENSUS & ACUITY":
     else:
         req_staff = math.ceil(curr_high / 3) + math.ceil(max(0, curr_pts - curr_high) / 6)
         
-    actual_staff = sum(1 for r in run_query("SELECT pin FROM workers WHERE status='Active'") if USERS.get(str(r[0]), {}).get('dept') == user['dept']) if run_query("SELECT pin FROM workers WHERE status='Active'") else 0
+    dept_pins = set(users_in_dept(user['dept']))
+    actual_staff = sum(1 for r in run_query("SELECT pin FROM workers WHERE status='Active'") if str(r[0]) in dept_pins) if run_query("SELECT pin FROM workers WHERE status='Active'") else 0
     variance = actual_staff - req_staff
     
     col1, col2, col3 = st.columns(3)
@@ -1156,6 +2239,9 @@ elif nav == "CENSUS & ACUITY":
                     <div style='color:#94a3b8; font-size:0.95rem; margin-top:8px;'>{result['reason']}</div>
                 </div>
                 """, unsafe_allow_html=True)
+                for rank, cand in enumerate(result['ranked'], start=1):
+                    bd = cand['breakdown']
+                    st.caption(f"#{rank} {cand['name']} ({cand['pin']}) | Score: {cand['score']:.1f} = OT {bd['ot_severity']:.1f} + Fatigue {bd['fatigue']:.1f} | 7-Day Hours: {cand['hrs']:.1f}" + (f" | {bd['fatigue_factors']}" if bd['fatigue_factors'] else ""))
                 
                 if st.button("⚡ EXECUTE FLEX DIRECTIVE"):
                     run_transaction("INSERT INTO messages (msg_id, sender_pin, target_dept, recipient_pin, message) VALUES (:id, :p, 'DM', :rp, :m)", {"id": f"MSG-{int(time.time()*1000)}", "p": pin, "rp": result['selected_pin'], "m": f"Census has dropped. You have been selected for Down-Staffing (Flex) due to operational algorithms. Please wrap up current tasks and clock out."})
@@ -1182,42 +2268,10 @@ elif nav == "CENSUS & ACUITY":
 
 elif nav == "MARKETPLACE":
     st.markdown("<h2 style='font-weight:900; margin-bottom:5px;'>⚡ INTERNAL SHIFT MARKETPLACE</h2>", unsafe_allow_html=True)
-    if st.button("🔄 Refresh Market"): st.rerun()
-    
-    open_shifts = run_query("SELECT shift_id, role, date, start_time, rate, escrow_status FROM marketplace WHERE status='OPEN' ORDER BY date ASC")
-    if open_shifts:
-        for shift in open_shifts:
-            s_id, s_role, s_date, s_time, s_rate, s_escrow = shift[0], shift[1], shift[2], shift[3], float(shift[4]), shift[5]
-            est_payout = s_rate * 12
-            escrow_badge = "<span style='background:#10b981; color:#0b1120; padding:3px 8px; border-radius:4px; font-size:0.75rem; font-weight:bold; margin-left:10px;'>✔️ BASE RATE VERIFIED</span>" if s_escrow == "LOCKED" else ""
-            
-            st.markdown(f"<div class='shift-card'><div style='display:flex; justify-content:space-between; align-items:flex-start;'><div><div style='color:#94a3b8; font-weight:800; text-transform:uppercase; font-size:0.9rem;'>{s_date} <span style='color:#38bdf8;'>| {s_time}</span></div><div style='font-size:1.4rem; font-weight:800; color:#f8fafc; margin-top:5px;'>{s_role}{escrow_badge}</div><div class='shift-amount'>${est_payout:,.2f} (Est. Base Pay)</div></div></div></div>", unsafe_allow_html=True)
-            
-            if st.button(f"⚡ CLAIM SHIFT", key=f"claim_{s_id}"):
-                creds = run_query("SELECT doc_type, exp_date FROM credentials WHERE pin=:p AND status='ACTIVE'", {"p": pin})
-                expired = [c[0] for c in creds if str(c[1]) < str(date.today())]
-                
-                wk_hrs = get_rolling_weekly_hours(pin)
-                will_hit_ot = (wk_hrs + 12) > 40.0
-                
-                if expired:
-                    st.error(f"🛑 HARD EMR INTERLOCK: Claim blocked due to expired credentials ({', '.join(expired)}). Please update via HR Vault.")
-                elif will_hit_ot:
-                    st.warning(f"⚠️ CFO OVERTIME LOCK: Claiming this shift pushes you to {wk_hrs+12:.1f} hrs for the week. Shift pended for Manager/CFO Overtime Authorization.")
-                    run_transaction("INSERT INTO shift_bids (bid_id, shift_id, pin, counter_rate, status) VALUES (:bid, :sid, :p, :r, 'PENDING_OT')", {"bid": f"OT-{int(time.time()*1000)}", "sid": s_id, "p": pin, "r": s_rate * 1.5})
-                    time.sleep(3); st.rerun()
-                else:
-                    rows_updated = run_transaction("UPDATE marketplace SET status='CLAIMED', claimed_by=:p WHERE shift_id=:id AND status='OPEN'", {"p": pin, "id": s_id})
-                    if rows_updated > 0:
-                        run_transaction("INSERT INTO schedules (shift_id, pin, shift_date, shift_time, department, status) VALUES (:id, :p, :d, :t, :dept, 'SCHEDULED')", {"id": f"SCH-{s_id}", "p": pin, "d": s_date, "t": s_time, "dept": user['dept']})
-                        st.success("✅ Shift Claimed!"); time.sleep(2); st.rerun()
-                    else:
-                        st.error("❌ Shift Already Claimed!"); time.sleep(2); st.rerun()
-    else: st.markdown("<div class='empty-state'><h3>No Urgent Coverage Needed</h3></div>", unsafe_allow_html=True)
+    live_marketplace(pin, user['dept'])
 
 elif nav == "COMMS":
     st.markdown("## 📡 Secure Comms")
-    if st.button("🔄 Refresh Feed"): st.rerun()
     
     if user['level'] in ["Admin", "Executive", "Manager", "Director", "Supervisor"]: 
         tab_intra, tab_inter, tab_dm, tab_sos = st.tabs([f"🏥 {user['dept']} Channel", "🌍 Hospital-Wide", "💬 Direct Messages", "🚨 SOS Dispatch"])
@@ -1231,24 +2285,10 @@ elif nav == "COMMS":
                 run_transaction("INSERT INTO messages (msg_id, sender_pin, target_dept, message) VALUES (:id, :p, :d, :m)", {"id": f"MSG-{int(time.time()*1000)}", "p": pin, "d": user['dept'], "m": msg})
                 st.rerun()
         
-        msgs = run_query("SELECT sender_pin, message, timestamp, is_sos FROM messages WHERE target_dept=:d ORDER BY timestamp DESC LIMIT 50", {"d": user['dept']})
-        if msgs:
-            for m in msgs:
-                sender_name = USERS.get(str(m[0]), {}).get('name', 'SYSTEM' if m[0] == 'SYSTEM' else 'Unknown')
-                dt_str = m[2].strftime('%H:%M - %b %d') if hasattr(m[2], 'strftime') else str(m[2])
-                color = "#ef4444" if m[3] else "#3b82f6"
-                bg_color = "rgba(239, 68, 68, 0.1)" if m[3] else "rgba(30, 41, 59, 0.6)"
-                st.markdown(f"<div style='background: {bg_color}; border-left: 4px solid {color}; padding: 15px; border-radius: 8px; margin-bottom: 10px;'><div style='display:flex; justify-content:space-between; margin-bottom:5px;'><strong style='color:#f8fafc;'>{sender_name}</strong><span style='color:#94a3b8; font-size:0.8rem;'>{dt_str}</span></div><div style='color:#cbd5e1;'>{m[1]}</div></div>", unsafe_allow_html=True)
+        live_channel("dept_channel", SQL_DEPT_CHANNEL, {"d": user['dept']}, "#3b82f6")
 
     with tab_inter:
-        msgs = run_query("SELECT sender_pin, message, timestamp, is_sos FROM messages WHERE target_dept='All' ORDER BY timestamp DESC LIMIT 50")
-        if msgs:
-            for m in msgs:
-                sender_name = USERS.get(str(m[0]), {}).get('name', 'SYSTEM' if m[0] == 'SYSTEM' else 'Unknown')
-                dt_str = m[2].strftime('%H:%M - %b %d') if hasattr(m[2], 'strftime') else str(m[2])
-                color = "#ef4444" if m[3] else "#10b981"
-                bg_color = "rgba(239, 68, 68, 0.1)" if m[3] else "rgba(30, 41, 59, 0.6)"
-                st.markdown(f"<div style='background: {bg_color}; border-left: 4px solid {color}; padding: 15px; border-radius: 8px; margin-bottom: 10px;'><div style='display:flex; justify-content:space-between; margin-bottom:5px;'><strong style='color:#f8fafc;'>{sender_name}</strong><span style='color:#94a3b8; font-size:0.8rem;'>{dt_str}</span></div><div style='color:#cbd5e1;'>{m[1]}</div></div>", unsafe_allow_html=True)
+        live_channel("hospital_channel", SQL_HOSPITAL_CHANNEL, {}, "#10b981")
 
     with tab_dm:
         peer_dict = {f"{d['name']} ({d['role']} - {d['dept']})": p for p, d in USERS.items() if p != pin}
@@ -1265,18 +2305,7 @@ elif nav == "COMMS":
                     st.rerun()
             
             st.markdown("<hr style='border-color: rgba(255,255,255,0.05);'>", unsafe_allow_html=True)
-            dm_history = run_query("SELECT sender_pin, message, timestamp FROM messages WHERE target_dept='DM' AND ((sender_pin=:p AND recipient_pin=:rp) OR (sender_pin=:rp AND recipient_pin=:p)) ORDER BY timestamp DESC LIMIT 50", {"p": pin, "rp": selected_peer_pin})
-            
-            if dm_history:
-                for m in dm_history:
-                    is_me = (m[0] == pin)
-                    sender_name = "You" if is_me else USERS.get(str(m[0]), {}).get('name', 'Unknown')
-                    dt_str = m[2].strftime('%H:%M - %b %d') if hasattr(m[2], 'strftime') else str(m[2])
-                    align = "right" if is_me else "left"
-                    bg_color = "rgba(16, 185, 129, 0.15)" if is_me else "rgba(30, 41, 59, 0.6)"
-                    border_color = "#10b981" if is_me else "#3b82f6"
-                    
-                    st.markdown(f"<div style='text-align: {align}; margin-bottom: 10px;'><div style='display: inline-block; text-align: left; background: {bg_color}; border-left: 4px solid {border_color}; padding: 10px 15px; border-radius: 8px; min-width: 250px; max-width: 80%;'><div style='display:flex; justify-content:space-between; margin-bottom:5px;'><strong style='color:#f8fafc;'>{sender_name}</strong><span style='color:#94a3b8; font-size:0.75rem; margin-left:15px;'>{dt_str}</span></div><div style='color:#cbd5e1;'>{m[1]}</div></div></div>", unsafe_allow_html=True)
+            live_dm_thread(pin, selected_peer_pin)
 
     if user['level'] in ["Admin", "Executive", "Manager", "Director", "Supervisor"]:
         with tab_sos:
@@ -1299,7 +2328,7 @@ elif nav == "SCHEDULE":
         tab_mine, tab_hist = st.tabs(["🙋 MY UPCOMING", "🕰️ WORKED HISTORY"])
         
     with tab_mine:
-        my_scheds = run_query("SELECT shift_id, shift_date, shift_time, COALESCE(status, 'SCHEDULED'), department FROM schedules WHERE pin=:p AND shift_date >= :today ORDER BY shift_date ASC", {"p": pin, "today": str(date.today())})
+        my_scheds = run_query(SQL_MY_UPCOMING_SHIFTS, {"p": pin, "today": str(date.today())})
         if my_scheds:
             for s in my_scheds:
                 if s[3] == 'SCHEDULED':
@@ -1362,9 +2391,10 @@ elif nav == "SCHEDULE":
                 if 'ai_date' in st.session_state:
                     st.markdown(f"#### Cross-Trained Float Candidates for {st.session_state.ai_date} ({st.session_state.ai_dept})")
                     all_staff = {p: d for p, d in USERS.items() if d['level'] in ['Worker', 'Supervisor']}
+                    fatigue = calculate_fatigue_scores(all_staff.keys(), st.session_state.ai_dept)
                     stats = []
                     for p, d in all_staff.items():
-                        f_score, f_hrs, f_notes = calculate_fatigue_score(p, st.session_state.ai_dept)
+                        f_score, f_hrs, f_notes = fatigue[p]
                         is_native = d['dept'] == st.session_state.ai_dept
                         adjusted_score = f_score if is_native else f_score + 10.0 
                         stats.append({"pin": p, "name": d['name'], "dept": d['dept'], "score": adjusted_score, "is_native": is_native})
@@ -1384,7 +2414,7 @@ elif nav == "APPROVALS":
     tab_ot, tab_pto, tab_cfo = st.tabs(["⚠️ OVERTIME EXCEPTIONS", "🏖️ TIME OFF (PTO)", "💸 CFO SETTLEMENTS"])
     
     with tab_ot:
-        ot_bids = run_query("SELECT bid_id, shift_id, pin, counter_rate FROM shift_bids WHERE status='PENDING_OT'")
+        ot_bids = run_query(SQL_PENDING_OT_BIDS)
         if ot_bids:
             for b in ot_bids:
                 b_id, s_id, p_pin, ot_rate = b
@@ -1401,7 +2431,7 @@ elif nav == "APPROVALS":
         else: st.info("No Overtime overrides pending.")
 
     with tab_pto:
-        ptos = run_query("SELECT req_id, pin, start_date, end_date, reason FROM pto_requests WHERE status='PENDING'")
+        ptos = run_query(SQL_PENDING_PTO)
         if ptos:
             for pto in ptos:
                 r_id, p_pin, sd, ed, rsn = pto
@@ -1418,7 +2448,7 @@ elif nav == "APPROVALS":
         
     with tab_cfo:
         if user['role'] == "CFO" or user['level'] == "Admin":
-            pending_cfo = run_query("SELECT tx_id, pin, amount, timestamp, note FROM transactions WHERE status='PENDING_CFO' ORDER BY timestamp ASC")
+            pending_cfo = run_query(SQL_PENDING_CFO_SETTLEMENTS)
             if pending_cfo:
                 for tx in pending_cfo:
                     tx_note = tx[4] if len(tx) > 4 and tx[4] else "No context provided"
@@ -1442,43 +2472,48 @@ elif nav == "THE BANK":
     
     if banked_gross > 0.01 and not st.session_state.user_state.get('active', False):
         if st.button("⚡ INITIATE FIAT SETTLEMENT", key="web3_btn", use_container_width=True):
-            treasury_res = run_query("SELECT available_balance FROM hospital_treasury WHERE id=1")
-            current_treasury = float(treasury_res[0][0]) if treasury_res else 0.0
-            
-            if current_treasury >= banked_gross:
-                net, tax = execute_split_stream_payout(pin, banked_gross) 
-                run_transaction("UPDATE hospital_treasury SET available_balance = available_balance - :amt WHERE id=1", {"amt": banked_gross})
-                update_status(pin, "Inactive", 0, 0.0); st.session_state.user_state['earnings'] = 0.0
-                st.success(f"✅ Auto-Cleared! ${net:,.2f} routed to Direct Deposit."); time.sleep(2); st.rerun()
-            else:
-                run_transaction("INSERT INTO transactions (tx_id, pin, amount, status, tx_type, note) VALUES (:id, :p, :amt, 'PENDING_CFO', 'NET_PAY', 'Liquidity Low')", {"id": f"TX-PEND-{int(time.time())}", "p": pin, "amt": banked_gross})
-                update_status(pin, "Inactive", 0, 0.0); st.session_state.user_state['earnings'] = 0.0
-                st.warning(f"⏳ Liquidity Pool Low. Pended for CFO authorization."); time.sleep(2); st.rerun()
-
-    paystubs = run_query("SELECT tx_id, amount, timestamp, destination_pubkey, note FROM transactions WHERE pin=:p AND tx_type='NET_PAY' ORDER BY timestamp DESC", {"p": pin})
+            try:
+                # Treasury check, split-stream payout, treasury decrement and balance reset commit or roll back together.
+                with db_unit_of_work() as uow:
+                    treasury_res = run_query("SELECT available_balance FROM hospital_treasury WHERE id=1 FOR UPDATE", conn=uow)
+                    current_treasury = float(treasury_res[0][0]) if treasury_res else 0.0
+                    auto_cleared = current_treasury >= banked_gross
+                    if auto_cleared:
+                        net, tax = execute_split_stream_payout(pin, banked_gross, conn=uow)
+                        run_transaction("UPDATE hospital_treasury SET available_balance = available_balance - :amt WHERE id=1", {"amt": banked_gross}, conn=uow)
+                    else:
+                        run_transaction("INSERT INTO transactions (tx_id, pin, amount, status, tx_type, note) VALUES (:id, :p, :amt, 'PENDING_CFO', 'NET_PAY', 'Liquidity Low')", {"id": f"TX-PEND-{int(time.time())}", "p": pin, "amt": banked_gross}, conn=uow)
+                    update_status(pin, "Inactive", 0, 0.0, conn=uow)
+            except Exception as e:
+                st.error(f"❌ Settlement rolled back. No funds moved. ({e})"); st.stop()
+            st.session_state.user_state['earnings'] = 0.0
+            if auto_cleared: st.success(f"✅ Auto-Cleared! ${net:,.2f} routed to Direct Deposit."); time.sleep(2); st.rerun()
+            else: st.warning(f"⏳ Liquidity Pool Low. Pended for CFO authorization."); time.sleep(2); st.rerun()
+
+    if 'paystub_page' not in st.session_state: st.session_state.paystub_page = 0
+    total_stubs, paystubs = get_paystub_page(pin, st.session_state.paystub_page)
+    if total_stubs and not paystubs and st.session_state.paystub_page > 0:
+        st.session_state.paystub_page = 0; total_stubs, paystubs = get_paystub_page(pin, 0)
     if paystubs:
         for stub in paystubs:
-            tx_id, net_amt, tx_ts, dest, note = stub[0], float(stub[1]), stub[2], stub[3], stub[4]
+            tx_id, net_amt, tx_ts, dest, shifts_data = stub["tx_id"], stub["amount"], stub["timestamp"], stub["dest"], stub["shifts_data"]
             dt_str = tx_ts.strftime("%Y-%m-%d %H:%M") if hasattr(tx_ts, 'strftime') else str(tx_ts)
             with st.expander(f"Payout: {dt_str} | ${net_amt:,.2f} Net"):
-                prev_tx_res = run_query("SELECT timestamp FROM transactions WHERE pin=:p AND tx_type='NET_PAY' AND timestamp < :ts ORDER BY timestamp DESC LIMIT 1", {"p": pin, "ts": tx_ts})
-                prev_ts = prev_tx_res[0][0] if prev_tx_res else datetime.min
-                if prev_ts.tzinfo is None and getattr(tx_ts, 'tzinfo', None) is not None: prev_ts = prev_ts.replace(tzinfo=pytz.UTC)
-                shifts_res = run_query("SELECT action, timestamp FROM history WHERE pin=:p AND action IN ('CLOCK IN', 'CLOCK OUT') AND timestamp > :pts AND timestamp <= :ts ORDER BY timestamp ASC", {"p": pin, "pts": prev_ts, "ts": tx_ts})
-                
-                shifts_data = []
-                current_in = None
-                if shifts_res:
-                    for r in shifts_res:
-                        fmt_ts = r[1].strftime('%m/%d/%Y %H:%M') if hasattr(r[1], 'strftime') else str(r[1])
-                        if r[0] == 'CLOCK IN': current_in = fmt_ts
-                        elif r[0] == 'CLOCK OUT': shifts_data.append((current_in if current_in else "Prior to record", fmt_ts)); current_in = None
-                
-                file_data = create_paystub_pdf(user['name'], dt_str, tx_id, net_amt, net_amt, 0.0, dest, shifts_data)
+                st.caption(f"{len(shifts_data)} validated shift(s) covered by this payout.")
+                # Rendering only happens once the receipt is asked for; the rendered bytes come from the shared receipt cache.
+                if tx_id not in st.session_state.prepared_receipts and not st.button("🧾 Prepare Official Receipt", key=f"prep_{tx_id}"): continue
+                st.session_state.prepared_receipts.add(tx_id)
+                file_data = cached_paystub(user['name'], dt_str, tx_id, net_amt, net_amt, 0.0, dest, shifts_data)
                 ext = "pdf" if PDF_ACTIVE else "txt"
                 mime = "application/pdf" if PDF_ACTIVE else "text/plain"
                 if file_data:
                     st.download_button(label=f"📄 Download Official Receipt ({ext.upper()})", data=file_data, file_name=f"Paystub_{tx_id}.{ext}", mime=mime, key=f"pdf_{tx_id}")
+        page_count = max(1, math.ceil(total_stubs / PAYSTUB_PAGE_SIZE))
+        if page_count > 1:
+            c_pg1, c_pg2, c_pg3 = st.columns([1, 2, 1])
+            if c_pg1.button("◀ Newer", disabled=st.session_state.paystub_page == 0, use_container_width=True): st.session_state.paystub_page -= 1; st.rerun()
+            c_pg2.markdown(f"<p style='text-align:center; color:#94a3b8;'>Page {st.session_state.paystub_page + 1} of {page_count} • {total_stubs:,} payouts</p>", unsafe_allow_html=True)
+            if c_pg3.button("Older ▶", disabled=st.session_state.paystub_page >= page_count - 1, use_container_width=True): st.session_state.paystub_page += 1; st.rerun()
 
 elif nav == "MY PROFILE":
     st.markdown("## 🗄️ Enterprise HR Vault")
@@ -1533,7 +2568,7 @@ elif nav == "MY PROFILE":
                 zk_key = f"{random.choice(['A', 'X', 'K', 'M'])}{random.randint(10,99)}{random.choice(['B', 'Z', 'Q'])}-{random.randint(100,999)}"
                 st.info(f"Access Key: **{zk_key}** (Valid for 24h)")
 
-        my_obts = run_query("SELECT token_id, accolade_type, clinical_context, timestamp, encryption_hash FROM obt_ledger WHERE pin=:p ORDER BY timestamp DESC", {"p": pin})
+        my_obts = run_query(SQL_OBT_PORTFOLIO, {"p": pin})
         if my_obts:
             for obt in my_obts:
                 t_id, a_type, ctx, ts, e_hash = obt
@@ -1551,5 +2586,11 @@ elif nav == "MY PROFILE":
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
+                if st.button("🔍 Verify Against Anchored Root", key=f"verify_obt_{t_id}"):
+                    check = verify_accolade(t_id)
+                    if check is None: st.info("This accolade predates claim linkage; its hash above is the per-event mint receipt.")
+                    elif check["verified"]: st.success(f"✅ Included as leaf #{check['leaf_index']} of {check['date']} and anchored in block {check['anchor_block']} (`{check['anchor_tx']}`).")
+                    elif check.get("reason"): st.warning(f"⏳ {check['reason']}")
+                    else: st.warning(f"⏳ Inclusion proof {'valid' if check['included'] else 'INVALID'}; anchor status {check['anchor_status']}.")
         else:
             st.markdown("<div class='empty-state'><h3 style='color:#94a3b8;'>No OBTs Minted Yet</h3></div>", unsafe_allow_html=True)
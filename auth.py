@@ -0,0 +1,43 @@
+import bcrypt
+import threading
+import time
+
+# Password hashing and the login rate limiter for app.py and the bench/ scripts; kept free of streamlit so both can import it.
+
+# --- PASSWORDS ---
+def hash_password(plain_text_password): return bcrypt.hashpw(plain_text_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def verify_password(plain_text_password, hashed_password):
+    try: return bcrypt.checkpw(plain_text_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    except Exception: return False
+
+# --- LOGIN RATE LIMITER ---
+# Token buckets in front of bcrypt: (capacity, refill per second). Both the email and the client IP must have a token.
+AUTH_RATE_LIMITS = {"email": (5, 5 / 300.0), "ip": (30, 30 / 300.0)}
+AUTH_RATE_LIMIT_MAX_KEYS = 50000
+
+def new_auth_rate_limiter():
+    return {"lock": threading.Lock(), "buckets": {}}
+
+def consume_auth_token(limiter, scope, key):
+    """Takes one token from the (scope, key) bucket. Returns (allowed, seconds_until_next_token)."""
+    capacity, refill = AUTH_RATE_LIMITS[scope]
+    now = time.monotonic()
+    with limiter["lock"]:
+        buckets = limiter["buckets"]
+        if len(buckets) > AUTH_RATE_LIMIT_MAX_KEYS:
+            # Drop buckets that have refilled completely; they carry no state worth keeping.
+            for k in [k for k, (tokens, last) in buckets.items() if tokens + (now - last) * AUTH_RATE_LIMITS[k[0]][1] >= AUTH_RATE_LIMITS[k[0]][0]]: del buckets[k]
+        tokens, last = buckets.get((scope, key), (float(capacity), now))
+        tokens = min(float(capacity), tokens + (now - last) * refill)
+        if tokens < 1.0:
+            buckets[(scope, key)] = (tokens, now)
+            return False, (1.0 - tokens) / refill
+        buckets[(scope, key)] = (tokens - 1.0, now)
+        return True, 0.0
+
+def admit_login_attempt(limiter, ip, email):
+    """Gate in front of bcrypt: the client IP and the lowercased email must each yield a token. Returns (allowed, seconds_to_wait).
+    An attempt refused on its IP does not spend the email's token."""
+    ip_ok, ip_wait = consume_auth_token(limiter, "ip", ip)
+    email_ok, email_wait = consume_auth_token(limiter, "email", email.strip().lower()) if ip_ok else (False, 0.0)
+    return ip_ok and email_ok, max(ip_wait, email_wait)
@@ -0,0 +1,81 @@
+"""Fatigue scoring round-trips per page render at growing staff size: the two grouped queries against the old four-per-operator loop.
+
+    python bench/fatigue_queries.py --db postgresql://... [--sizes 250,500,1000,2000] [--shifts 12]
+
+The statements are Postgres-only (FILTER, ANY, INTERVAL), so --db must point at a scratch Postgres. Migrations are applied to it
+and its history and obt_ledger tables are truncated and reseeded for every size.
+"""
+import argparse
+import os
+import sys
+import time
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_schema import apply_schema_migrations, SQL_FATIGUE_HISTORY, SQL_FATIGUE_ACCOLADES
+
+# The per-operator statements calculate_fatigue_score issued before batching, kept here as the baseline.
+LEGACY_FATIGUE_QUERIES = [
+    "SELECT COALESCE(SUM(amount), 0) FROM history WHERE pin=:p AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '14 days'",
+    "SELECT count(*) FROM history WHERE pin=:p AND action='CLOCK OUT' AND extract(isodow from timestamp) >= 6 AND timestamp >= NOW() - INTERVAL '30 days'",
+    "SELECT count(*) FROM history WHERE pin=:p AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '48 hours'",
+    "SELECT count(*) FROM obt_ledger WHERE pin=:p AND timestamp >= NOW() - INTERVAL '7 days'",
+]
+
+def seed(engine, staff, shifts):
+    """staff operators with `shifts` clock-outs each over the last five weeks, matching clock-ins, and an accolade for every fourth."""
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE history, obt_ledger"))
+        conn.execute(text("""
+            INSERT INTO history (pin, action, timestamp, amount)
+            SELECT (1000 + s % :n)::text, a.action, NOW() - random() * INTERVAL '35 days', round((random() * 400)::numeric, 2)
+            FROM generate_series(1, :rows) s CROSS JOIN (VALUES ('CLOCK IN'), ('CLOCK OUT')) a(action)
+        """), {"n": staff, "rows": staff * shifts})
+        conn.execute(text("INSERT INTO obt_ledger (token_id, pin, accolade_type, timestamp) SELECT 'BENCH-' || s, (1000 + s * 4)::text, 'BENCH', NOW() - random() * INTERVAL '14 days' FROM generate_series(0, :n / 4) s"), {"n": staff})
+        conn.execute(text("ANALYZE history; ANALYZE obt_ledger"))
+
+def batched(conn, pins):
+    hist = {str(r[0]): (float(r[1]), int(r[2]), int(r[3])) for r in conn.execute(text(SQL_FATIGUE_HISTORY), {"pins": pins})}
+    acc = {str(r[0]): int(r[1]) for r in conn.execute(text(SQL_FATIGUE_ACCOLADES), {"pins": pins})}
+    return {p: hist.get(p, (0.0, 0, 0)) + (acc.get(p, 0),) for p in pins}
+
+def legacy(conn, pins):
+    factors = {}
+    for p in pins:
+        gross, wknd, recent, acc = (conn.execute(text(q), {"p": p}).scalar() for q in LEGACY_FATIGUE_QUERIES)
+        factors[p] = (float(gross), int(wknd), int(recent), int(acc))
+    return factors
+
+def measure(engine, scorer, pins):
+    """(statements executed, wall ms, factors) for one render's worth of scoring."""
+    statements = [0]
+    def count(*_): statements[0] += 1
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        with engine.connect() as conn:
+            t0 = time.perf_counter(); factors = scorer(conn, pins); elapsed = time.perf_counter() - t0
+    finally: event.remove(engine, "before_cursor_execute", count)
+    return statements[0], elapsed * 1000, factors
+
+def same_factors(a, b):
+    return a.keys() == b.keys() and all(abs(a[p][0] - b[p][0]) < 0.01 and a[p][1:] == b[p][1:] for p in a)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLAlchemy URL of a scratch Postgres database")
+    parser.add_argument("--sizes", default="250,500,1000,2000", help="comma-separated staff counts")
+    parser.add_argument("--shifts", type=int, default=12, help="clock-outs seeded per operator")
+    args = parser.parse_args()
+    engine = create_engine(args.db)
+    with engine.connect() as conn: apply_schema_migrations(conn)
+    batched_counts, agrees = set(), True
+    print(f"{'staff':>7} | {'batched stmts':>13} {'ms':>9} | {'legacy stmts':>12} {'ms':>9}")
+    for staff in (int(s) for s in args.sizes.split(",")):
+        seed(engine, staff, args.shifts)
+        pins = [str(1000 + i) for i in range(staff)]
+        b_stmts, b_ms, b_factors = measure(engine, batched, pins)
+        l_stmts, l_ms, l_factors = measure(engine, legacy, pins)
+        batched_counts.add(b_stmts); agrees = agrees and same_factors(b_factors, l_factors)
+        print(f"{staff:>7,} | {b_stmts:>13,} {b_ms:>9.1f} | {l_stmts:>12,} {l_ms:>9.1f}")
+    print(f"batched statement count constant across sizes: {'yes' if len(batched_counts) == 1 else 'NO'} | factors match the per-operator loop: {'yes' if agrees else 'NO'}")
+    sys.exit(0 if len(batched_counts) == 1 and agrees else 1)
@@ -0,0 +1,36 @@
+"""Synthetic workers x facilities geofence join: the grid index against a brute-force distance matrix.
+
+    python bench/geofence.py [--workers 10000] [--facilities 10000] [--spread 0.5] [--radius 150]
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geo_index import build_facility_index, facilities_within, haversine_vec
+
+def benchmark_geofence(workers=10000, facilities=10000, spread_deg=0.5, radius_m=150):
+    """Times the index build and the join; brute force runs on a sample and is extrapolated to every worker."""
+    rng = np.random.default_rng(7)
+    fac = {f"F{i}": {"lat": 40.0 + rng.uniform(0, spread_deg), "lon": -75.0 + rng.uniform(0, spread_deg)} for i in range(facilities)}
+    wl, wo = 40.0 + rng.uniform(0, spread_deg, workers), -75.0 + rng.uniform(0, spread_deg, workers)
+    t0 = time.perf_counter(); index = build_facility_index(fac, radius_m); t_build = time.perf_counter() - t0
+    t0 = time.perf_counter(); pts, _, _ = facilities_within(index, wl, wo, radius_m); t_join = time.perf_counter() - t0
+    sample = min(workers, 500)
+    t0 = time.perf_counter(); brute = (haversine_vec(wl[:sample, None], wo[:sample, None], index["lat"][None, :], index["lon"][None, :]) <= radius_m).any(axis=1); t_brute = (time.perf_counter() - t0) * workers / sample
+    inside = np.zeros(workers, dtype=bool); inside[pts] = True
+    return {"build_ms": t_build * 1000, "join_ms": t_join * 1000, "brute_ms_est": t_brute * 1000, "inside": int(inside.sum()), "agrees": bool((inside[:sample] == brute).all())}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=10000)
+    parser.add_argument("--facilities", type=int, default=10000)
+    parser.add_argument("--spread", type=float, default=0.5, help="side of the square (degrees) both sets are scattered over")
+    parser.add_argument("--radius", type=float, default=150, help="geofence radius in meters")
+    args = parser.parse_args()
+    bench = benchmark_geofence(args.workers, args.facilities, args.spread, args.radius)
+    print(f"index build {bench['build_ms']:.0f} ms | grid join {bench['join_ms']:.0f} ms | brute-force matrix (extrapolated) {bench['brute_ms_est']:.0f} ms")
+    print(f"{bench['inside']:,} of {args.workers:,} workers inside a fence | matches brute force: {'yes' if bench['agrees'] else 'NO'}")
+    sys.exit(0 if bench["agrees"] else 1)
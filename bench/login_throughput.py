@@ -0,0 +1,55 @@
+"""Logins per second on one core through the real sign-in gate: IP and email token buckets, email lookup, bcrypt verify.
+
+    python bench/login_throughput.py [--users 10000] [--attempts 100]
+
+Three traffic shapes are timed against a fresh limiter each:
+- legitimate: every attempt is a different user from a different address with the right password
+- brute force: one account hammered with wrong passwords from rotating addresses
+- credential stuffing: one address cycling through every account
+bcrypt is what costs CPU, so the bench reports how many verifications each shape got past the buckets.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from auth import AUTH_RATE_LIMITS, hash_password, verify_password, new_auth_rate_limiter, admit_login_attempt
+
+def build_directory(users):
+    """Email-keyed directory as load_all_users builds it. One real bcrypt hash at the app's cost is shared by every account."""
+    password_hash = hash_password("Correct-Horse-9!")
+    return {f"user{i}@ecprotocol.com": {"pin": str(1000 + i), "password_hash": password_hash} for i in range(users)}
+
+def run(by_email, attempts):
+    """attempts is a list of (ip, email, password). Returns (seconds, signed_in, refused_by_limiter, bcrypt_calls)."""
+    limiter, signed_in, refused, bcrypt_calls = new_auth_rate_limiter(), 0, 0, 0
+    started = time.perf_counter()
+    for ip, email, password in attempts:
+        allowed, _ = admit_login_attempt(limiter, ip, email)
+        if not allowed: refused += 1; continue
+        user = by_email.get(email.strip().lower())
+        if user:
+            bcrypt_calls += 1
+            signed_in += verify_password(password, user["password_hash"])
+    return time.perf_counter() - started, signed_in, refused, bcrypt_calls
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--attempts", type=int, default=100, help="sign-in attempts per traffic shape (each legitimate one costs a full bcrypt verify)")
+    args = parser.parse_args()
+    if hasattr(os, "sched_setaffinity"): os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    by_email = build_directory(args.users)
+    emails = list(by_email)
+    shapes = {
+        "legitimate": [(f"10.0.{i // 250 % 250}.{i % 250}", emails[i % len(emails)], "Correct-Horse-9!") for i in range(args.attempts)],
+        "brute force": [(f"10.1.{i // 250 % 250}.{i % 250}", emails[0], f"guess-{i}") for i in range(args.attempts)],
+        "credential stuffing": [("10.2.0.1", emails[i % len(emails)], "password123") for i in range(args.attempts)],
+    }
+    results = {name: run(by_email, attempts) for name, attempts in shapes.items()}
+    for name, (seconds, signed_in, refused, bcrypt_calls) in results.items():
+        print(f"{name:>20}: {len(shapes[name]) / seconds:>10,.1f} attempts/s | {signed_in / seconds:>6,.1f} logins/s | {refused:,} refused by limiter | {bcrypt_calls:,} bcrypt verifications")
+    capped = results["brute force"][3] <= AUTH_RATE_LIMITS["email"][0] + 1 and results["credential stuffing"][3] <= AUTH_RATE_LIMITS["ip"][0] + 1
+    print(f"attack shapes held to the bucket capacities ({AUTH_RATE_LIMITS['email'][0]} per email, {AUTH_RATE_LIMITS['ip'][0]} per IP): {'yes' if capped else 'NO'}")
+    sys.exit(0 if capped and results["legitimate"][1] == len(shapes["legitimate"]) else 1)
@@ -0,0 +1,67 @@
+"""Position ingest throughput: synthetic GPS pings pushed through the real queue, coalescing, fence check and batch UPDATE.
+
+    python bench/position_ingest.py [--db postgresql://...] [--workers 2000] [--seconds 5] [--flush 0.5]
+
+Without --db the pipeline writes to a throwaway SQLite file; point it at a scratch Postgres for numbers that match production.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from geo_index import build_facility_index
+from ping_ingest import start_position_ingest, queue_position, pop_geofence_exit
+
+RADIUS_M = 150
+
+def seed(engine, workers):
+    """Fresh workers table: every tenth worker is clocked out so the bench can check those rows are never touched."""
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS workers"))
+        conn.execute(text("CREATE TABLE workers (pin text PRIMARY KEY, status text, start_time numeric, earnings numeric, last_active timestamp, lat numeric, lon numeric)"))
+        conn.execute(text("INSERT INTO workers (pin, status, lat, lon) VALUES (:p, :s, 0, 0)"), [{"p": str(i), "s": "Inactive" if i % 10 == 0 else "Active"} for i in range(workers)])
+
+def run(engine, workers, seconds, flush_seconds):
+    facilities = {f"F{i}": {"lat": 40.0 + i * 0.01, "lon": -75.0} for i in range(50)}
+    index = build_facility_index(facilities, RADIUS_M)
+    ingest = start_position_ingest(engine, lambda: index, RADIUS_M, flush_seconds=flush_seconds)
+    leaver = 5 # walks out of its fence halfway through
+    started, sent = time.time(), 0
+    while time.time() - started < seconds:
+        half = time.time() - started > seconds / 2
+        for i in range(workers + 10): # the last ten pins have no workers row and must not gain one
+            queue_position(ingest, i, 40.0 + (i % 50) * 0.01, -75.0 + (0.01 if half and i == leaver else 0.0)); sent += 1
+    elapsed = time.time() - started
+    while not ingest["queue"].empty(): time.sleep(0.05)
+    time.sleep(flush_seconds * 2)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT COUNT(*) FROM workers")).scalar()
+        with_fix = conn.execute(text("SELECT COUNT(*) FROM workers WHERE last_active IS NOT NULL")).scalar() # sqlite reports rowcount -1 for a WITH ... UPDATE
+        touched_inactive = conn.execute(text("SELECT COUNT(*) FROM workers WHERE status <> 'Active' AND NOT (lat = 0 AND lon = 0)")).scalar()
+    return {
+        "pings_per_sec": sent / elapsed, "accepted": ingest["accepted"], "dropped": ingest["dropped"], "coalesced": ingest["coalesced"],
+        "flushes": ingest["flushes"], "rows_with_fix": with_fix, "last_flush_ms": ingest["last_flush_ms"], "last_error": ingest["last_error"],
+        "exit_detected": pop_geofence_exit(ingest, leaver), "exits_detected": ingest["exits_detected"],
+        "rows_unchanged": rows == workers, "inactive_untouched": touched_inactive == 0,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="SQLAlchemy URL of a scratch database (its workers table is dropped and recreated)")
+    parser.add_argument("--workers", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--flush", type=float, default=0.5, help="flush interval in seconds")
+    args = parser.parse_args()
+    engine = create_engine(args.db or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'ingest.db')}")
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", lambda dbapi, rec: dbapi.create_function("NOW", 0, lambda: datetime.now().isoformat(sep=" ")))
+    seed(engine, args.workers)
+    result = run(engine, args.workers, args.seconds, args.flush)
+    print(f"{result['pings_per_sec']:,.0f} pings/s submitted | {result['accepted']:,} accepted, {result['coalesced']:,} coalesced, {result['dropped']:,} dropped")
+    print(f"{result['flushes']:,} flushes, {result['rows_with_fix']:,} workers hold a streamed fix, last flush {result['last_flush_ms']:.1f} ms" + (f" | last error: {result['last_error']}" if result["last_error"] else ""))
+    print(f"exit detected: {result['exit_detected']} ({result['exits_detected']} total) | row count unchanged: {result['rows_unchanged']} | inactive rows untouched: {result['inactive_untouched']}")
+    sys.exit(0 if result["exit_detected"] and result["rows_unchanged"] and result["inactive_untouched"] and not result["last_error"] else 1)
@@ -0,0 +1,31 @@
+"""Query plan regression check: EXPLAINs every hot statement and fails if any table is still read by a sequential scan.
+
+    python bench/query_plans.py --db postgresql://... [--migrate]
+
+Plans are taken with enable_seqscan off, so a Seq Scan left in a plan means no index on that table serves the predicate.
+--migrate applies the schema migrations first, which turns an empty scratch database into one worth checking. Without it the check
+is read-only and safe to point at a copy of production.
+"""
+import argparse
+import os
+import sys
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_schema import SCHEMA_MIGRATIONS, apply_schema_migrations, explain_hot_queries
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLAlchemy URL of a Postgres database")
+    parser.add_argument("--migrate", action="store_true", help="apply pending schema migrations before checking")
+    args = parser.parse_args()
+    engine = create_engine(args.db)
+    with engine.connect() as conn:
+        if args.migrate:
+            applied = apply_schema_migrations(conn); conn.commit()
+            print(f"applied migrations {applied}" if applied else f"schema already at v{max(m[0] for m in SCHEMA_MIGRATIONS)}")
+        report = explain_hot_queries(conn)
+    for label, scans in report: print(f"{'FAIL' if scans else 'ok  '} {label}" + (f": sequential scan on {', '.join(str(x) for x in scans)}" if scans else ""))
+    regressions = sum(1 for _, scans in report if scans)
+    print(f"{len(report) - regressions} of {len(report)} hot queries served by indexes")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,68 @@
+"""Rollup read path over a synthetic poc_ledger: the indexed rollup_date range query against the old per-day CAST ... LIKE scan.
+
+    python bench/rollup_day_range.py --db postgresql://... [--rows 1000000] [--days 90] [--range 7]
+
+--rows scales to 10,000,000 (seeding runs in 1M-row batches; budget a few GB of disk). Both reads stream through a server-side
+cursor the way execute_rollup_range does. --db must be a scratch Postgres: migrations are applied and poc_ledger is truncated.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_schema import apply_schema_migrations, SQL_POC_DAY_RANGE
+
+LEGACY_DAY_QUERY = "SELECT claim_id, secure_hash FROM poc_ledger WHERE CAST(timestamp AS TEXT) LIKE :d AND secure_hash IS NOT NULL AND secure_hash <> '' ORDER BY timestamp, claim_id"
+SEED_BATCH = 1000000
+STREAM_CHUNK = 5000 # MERKLE_CHUNK_SIZE
+
+def seed(engine, rows, days):
+    """rows claims spread evenly over the `days` days ending yesterday. Timestamps are local wall time, as the app writes them,
+    so the seal day and the text prefix the old query matched agree."""
+    first = date.today() - timedelta(days=days)
+    with engine.begin() as conn: conn.execute(text("TRUNCATE poc_ledger"))
+    for offset in range(0, rows, SEED_BATCH):
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO poc_ledger (claim_id, pin, patient_room, action, timestamp, ble_verified, emr_verified, ai_verified, status, secure_hash, rollup_date)
+                SELECT 'BENCH-' || s, (1000 + s % 500)::text, 'RM-' || (s % 40), 'BENCH', ts, TRUE, TRUE, TRUE, 'VERIFIED', md5(s::text) || md5((s + 1)::text), ts::date::text
+                FROM (SELECT s, CAST(:first AS timestamp) + (s::bigint * :span / :rows) * INTERVAL '1 second' AS ts FROM generate_series(:lo, :hi) s) g
+            """), {"first": first, "span": days * 86400, "rows": rows, "lo": offset, "hi": min(offset + SEED_BATCH, rows) - 1})
+        print(f"  seeded {min(offset + SEED_BATCH, rows):,} / {rows:,}", flush=True)
+    with engine.begin() as conn: conn.execute(text("ANALYZE poc_ledger"))
+    return first
+
+def stream(engine, query, params):
+    """(rows read, seconds) for one streamed pass."""
+    started, count = time.perf_counter(), 0
+    with engine.connect() as conn:
+        result = conn.execute(text(query).execution_options(stream_results=True, yield_per=STREAM_CHUNK), params)
+        for chunk in result.partitions(STREAM_CHUNK): count += len(chunk)
+    return count, time.perf_counter() - started
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLAlchemy URL of a scratch Postgres database")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=90, help="days the ledger spans")
+    parser.add_argument("--range", type=int, default=7, help="days in the backfill range")
+    args = parser.parse_args()
+    engine = create_engine(args.db)
+    with engine.connect() as conn: apply_schema_migrations(conn); conn.commit()
+    first = seed(engine, args.rows, args.days)
+    day = first + timedelta(days=args.days // 2)
+    last = day + timedelta(days=args.range - 1)
+    new_day = stream(engine, SQL_POC_DAY_RANGE, {"a": str(day), "b": str(day)})
+    old_day = stream(engine, LEGACY_DAY_QUERY, {"d": f"{day}%"})
+    new_range = stream(engine, SQL_POC_DAY_RANGE, {"a": str(day), "b": str(last)})
+    old_range = [stream(engine, LEGACY_DAY_QUERY, {"d": f"{day + timedelta(days=i)}%"}) for i in range(args.range)]
+    old_range = (sum(r[0] for r in old_range), sum(r[1] for r in old_range))
+    print(f"ledger: {args.rows:,} rows over {args.days} days")
+    print(f"one day        | rollup_date range {new_day[1] * 1000:>9.1f} ms | CAST ... LIKE {old_day[1] * 1000:>9.1f} ms | {new_day[0]:,} claims")
+    print(f"{args.range}-day backfill | one sorted pass   {new_range[1] * 1000:>9.1f} ms | LIKE per day  {old_range[1] * 1000:>9.1f} ms | {new_range[0]:,} claims")
+    agrees = new_day[0] == old_day[0] and new_range[0] == old_range[0]
+    print(f"claim counts match the old query: {'yes' if agrees else 'NO'}")
+    sys.exit(0 if agrees else 1)
@@ -0,0 +1,89 @@
+"""Command Center spend aggregation over a large history table: the worker_rollups query against the old full history load.
+
+    python bench/spend_rollups.py --db postgresql://... [--rows 1000000] [--staff 2000] [--days 365] [--window 30]
+
+Run with --rows 1000000 and --rows 10000000 for the two reference points (seeding goes in 1M-row batches). Three paths are timed:
+- rollups: SQL_SPEND_BY_DEPT_DAY over the page's date window, what the page runs now
+- history GROUP BY: the same aggregate computed from history directly
+- old page: every CLOCK OUT row loaded, dept mapped per row in Python and grouped in pandas, as the page did before
+--db must be a scratch Postgres: migrations are applied and history and worker_rollups are truncated.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_schema import apply_schema_migrations, WORKER_ROLLUPS_BACKFILL_SQL, SQL_SPEND_BY_DEPT_DAY
+
+SEED_BATCH = 1000000
+DEPTS = ["Respiratory", "Nursing", "ICU", "Emergency", "Surgery", "Radiology"]
+SQL_HISTORY_GROUP_BY = """
+    SELECT COALESCE(u.dept, 'Unknown'), DATE(h.timestamp), SUM(h.amount)
+    FROM history h LEFT JOIN enterprise_users u ON u.pin = h.pin
+    WHERE h.action='CLOCK OUT' AND h.timestamp >= :a AND h.timestamp < CAST(:b AS date) + 1
+    GROUP BY 1, 2 ORDER BY 2
+"""
+SQL_OLD_PAGE_LOAD = "SELECT pin, amount, DATE(timestamp) FROM history WHERE action='CLOCK OUT'"
+
+def seed(engine, rows, staff, days):
+    """staff BENCH- operators spread over DEPTS; rows history entries over `days` days, one in five a CLOCK IN. worker_rollups is
+    rebuilt with the app's own backfill statement."""
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE history, worker_rollups"))
+        conn.execute(text("DELETE FROM enterprise_users WHERE pin LIKE 'BENCH-%'"))
+        conn.execute(text("INSERT INTO enterprise_users (pin, email, name, role, dept, access_level, hourly_rate) SELECT 'BENCH-' || s, 'bench' || s || '@ecprotocol.com', 'Bench ' || s, 'RRT', (CAST(:depts AS text[]))[1 + s % :nd], 'Worker', 60 FROM generate_series(0, :n - 1) s"), {"depts": DEPTS, "nd": len(DEPTS), "n": staff})
+    for offset in range(0, rows, SEED_BATCH):
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO history (pin, action, timestamp, amount)
+                SELECT 'BENCH-' || (s % :n), CASE WHEN s % 5 = 0 THEN 'CLOCK IN' ELSE 'CLOCK OUT' END, NOW() - (s::bigint * :span / :rows) * INTERVAL '1 second', round((200 + s % 600)::numeric, 2)
+                FROM generate_series(:lo, :hi) s
+            """), {"n": staff, "span": days * 86400, "rows": rows, "lo": offset, "hi": min(offset + SEED_BATCH, rows) - 1})
+        print(f"  seeded {min(offset + SEED_BATCH, rows):,} / {rows:,}", flush=True)
+    with engine.begin() as conn:
+        conn.execute(text(WORKER_ROLLUPS_BACKFILL_SQL))
+        conn.execute(text("ANALYZE history; ANALYZE worker_rollups; ANALYZE enterprise_users"))
+
+def timed(engine, query, params=None):
+    with engine.connect() as conn:
+        t0 = time.perf_counter(); rows = conn.execute(text(query), params or {}).fetchall()
+    return rows, (time.perf_counter() - t0) * 1000
+
+def old_page(engine):
+    """The pre-rollup COMMAND CENTER: load everything, map dept per row through the user dict, two groupbys."""
+    with engine.connect() as conn:
+        users = {r[0]: {"dept": r[1]} for r in conn.execute(text("SELECT pin, dept FROM enterprise_users"))}
+        t0 = time.perf_counter(); raw_history = conn.execute(text(SQL_OLD_PAGE_LOAD)).fetchall()
+    df = pd.DataFrame(raw_history, columns=["PIN", "Amount", "Date"])
+    df['Amount'] = df['Amount'].astype(float); df['Dept'] = df['PIN'].apply(lambda x: users.get(str(x), {}).get('dept', 'Unknown'))
+    by_dept, by_date = df.groupby('Dept')['Amount'].sum(), df.groupby('Date')['Amount'].sum()
+    return len(raw_history), len(by_dept) + len(by_date), (time.perf_counter() - t0) * 1000, df.memory_usage(deep=True).sum()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="SQLAlchemy URL of a scratch Postgres database")
+    parser.add_argument("--rows", type=int, default=1000000, help="history rows (1M and 10M are the reference points)")
+    parser.add_argument("--staff", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365, help="days of history")
+    parser.add_argument("--window", type=int, default=30, help="days on the page's date-range selector")
+    args = parser.parse_args()
+    engine = create_engine(args.db)
+    with engine.connect() as conn: apply_schema_migrations(conn); conn.commit()
+    seed(engine, args.rows, args.staff, args.days)
+    window = {"a": date.today() - timedelta(days=args.window - 1), "b": date.today()}
+    rollup_rows, rollup_ms = timed(engine, SQL_SPEND_BY_DEPT_DAY, window)
+    history_rows, history_ms = timed(engine, SQL_HISTORY_GROUP_BY, window)
+    loaded, groups, old_ms, old_bytes = old_page(engine)
+    print(f"history: {args.rows:,} rows, {args.staff:,} staff over {args.days} days | {args.window}-day window")
+    print(f"{'rollups':>18}: {rollup_ms:>10.1f} ms | {len(rollup_rows):,} rows to the page")
+    print(f"{'history GROUP BY':>18}: {history_ms:>10.1f} ms | {len(history_rows):,} rows to the page")
+    print(f"{'old page':>18}: {old_ms:>10.1f} ms | {loaded:,} rows loaded, {old_bytes / 2**20:,.0f} MiB DataFrame, {groups:,} groups (whole history, no window)")
+    rollup_totals = {(r[0], str(r[1])): float(r[2]) for r in rollup_rows}
+    history_totals = {(r[0], str(r[1])): float(r[2]) for r in history_rows}
+    agrees = rollup_totals.keys() == history_totals.keys() and all(abs(rollup_totals[k] - history_totals[k]) < 0.01 for k in rollup_totals)
+    print(f"rollup totals match the history aggregate: {'yes' if agrees else 'NO'}")
+    sys.exit(0 if agrees else 1)
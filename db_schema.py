@@ -0,0 +1,307 @@
+import json
+from datetime import datetime, date, timedelta
+from sqlalchemy import text
+from pool_workers import LOCAL_TZ
+from auth import hash_password
+
+# Schema migrations, seed data and the hot statements that run against them. Imported by app.py and the bench/ scripts,
+# so it stays free of streamlit: everything here takes a connection or returns plain data.
+
+# --- SCHEMA MIGRATIONS ---
+# Append-only. Never edit a shipped version; add a new one. Applied versions are recorded in schema_migrations.
+ROLLUP_ACTIONS = ('CLOCK OUT', 'MANUAL PAYOUT RELEASED')
+WORKER_ROLLUPS_BACKFILL_SQL = """
+    INSERT INTO worker_rollups (pin, day, clock_out_gross, clock_out_count, payout_gross)
+    SELECT pin, DATE(timestamp),
+        COALESCE(SUM(amount) FILTER (WHERE action='CLOCK OUT'), 0),
+        COUNT(*) FILTER (WHERE action='CLOCK OUT'),
+        COALESCE(SUM(amount) FILTER (WHERE action='MANUAL PAYOUT RELEASED'), 0)
+    FROM history WHERE action IN ('CLOCK OUT', 'MANUAL PAYOUT RELEASED') GROUP BY pin, DATE(timestamp)
+"""
+
+SCHEMA_MIGRATIONS = [
+    (1, "baseline_tables", [
+        "CREATE TABLE IF NOT EXISTS enterprise_users (pin TEXT PRIMARY KEY, email TEXT UNIQUE, password_hash TEXT, name TEXT, role TEXT, dept TEXT, access_level TEXT, hourly_rate NUMERIC, phone TEXT, last_pw_change TIMESTAMP DEFAULT CURRENT_TIMESTAMP);",
+        "ALTER TABLE enterprise_users ADD COLUMN IF NOT EXISTS last_pw_change TIMESTAMP DEFAULT CURRENT_TIMESTAMP;",
+        "CREATE TABLE IF NOT EXISTS workers (pin text PRIMARY KEY, status text, start_time numeric, earnings numeric, last_active timestamp, lat numeric, lon numeric);",
+        "CREATE TABLE IF NOT EXISTS history (pin text, action text, timestamp timestamp DEFAULT NOW(), amount numeric, note text);",
+        "CREATE TABLE IF NOT EXISTS marketplace (shift_id text PRIMARY KEY, poster_pin text, role text, date text, start_time text, end_time text, rate numeric, status text, claimed_by text, escrow_status text);",
+        "CREATE TABLE IF NOT EXISTS shift_bids (bid_id text PRIMARY KEY, shift_id text, pin text, counter_rate numeric, status text DEFAULT 'PENDING', timestamp timestamp DEFAULT NOW());",
+        "CREATE TABLE IF NOT EXISTS transactions (tx_id text PRIMARY KEY, pin text, amount numeric, timestamp timestamp DEFAULT NOW(), status text, destination_pubkey text, tx_type text, note text);",
+        "CREATE TABLE IF NOT EXISTS schedules (shift_id text PRIMARY KEY, pin text, shift_date text, shift_time text, department text, status text DEFAULT 'SCHEDULED');",
+        "CREATE TABLE IF NOT EXISTS unit_census (dept text PRIMARY KEY, total_pts int, high_acuity int, vented_pts int DEFAULT 0, nipvv_pts int DEFAULT 0, last_updated timestamp DEFAULT NOW());",
+        "ALTER TABLE unit_census ADD COLUMN IF NOT EXISTS vented_pts int DEFAULT 0;",
+        "ALTER TABLE unit_census ADD COLUMN IF NOT EXISTS nipvv_pts int DEFAULT 0;",
+        "CREATE TABLE IF NOT EXISTS messages (msg_id text PRIMARY KEY, sender_pin text, target_dept text, message text, is_sos boolean DEFAULT FALSE, recipient_pin text, timestamp timestamp DEFAULT NOW());",
+        "CREATE TABLE IF NOT EXISTS hr_onboarding (pin text PRIMARY KEY, w4_filing_status text, w4_allowances int, dd_bank text, dd_acct_last4 text, signed_date timestamp DEFAULT NOW());",
+        "CREATE TABLE IF NOT EXISTS pto_requests (req_id text PRIMARY KEY, pin text, start_date text, end_date text, reason text, status text DEFAULT 'PENDING', submitted timestamp DEFAULT NOW());",
+        "CREATE TABLE IF NOT EXISTS credentials (doc_id text PRIMARY KEY, pin text, doc_type text, doc_number text, exp_date text, status text);",
+        "CREATE TABLE IF NOT EXISTS obt_ledger (token_id TEXT PRIMARY KEY, pin TEXT, accolade_type TEXT, clinical_context TEXT, timestamp TIMESTAMP DEFAULT NOW(), facility_origin TEXT, encryption_hash TEXT);",
+        "CREATE TABLE IF NOT EXISTS poc_ledger (claim_id text PRIMARY KEY, pin text, patient_room text, action text, timestamp timestamp DEFAULT NOW(), ble_verified boolean, emr_verified boolean, ai_verified boolean, status text, secure_hash text);",
+        "ALTER TABLE poc_ledger ADD COLUMN IF NOT EXISTS secure_hash text;",
+        "CREATE TABLE IF NOT EXISTS hospital_treasury (id INT PRIMARY KEY, available_balance NUMERIC, last_refill TIMESTAMP DEFAULT NOW());",
+        "CREATE TABLE IF NOT EXISTS hospital_protocols (protocol_id text PRIMARY KEY, title text, department text, status text, author_pin text, last_signed timestamp, next_review timestamp);",
+        "CREATE TABLE IF NOT EXISTS staff_competencies (comp_id text PRIMARY KEY, pin text, competency_name text, completed_date date, expires_date date, status text);",
+        "CREATE TABLE IF NOT EXISTS daily_rollups (date TEXT PRIMARY KEY, merkle_root TEXT, tx_count INT, status TEXT);",
+    ]),
+    (2, "worker_rollups", [
+        "CREATE TABLE IF NOT EXISTS worker_rollups (pin TEXT, day DATE, clock_out_gross NUMERIC DEFAULT 0, clock_out_count INT DEFAULT 0, payout_gross NUMERIC DEFAULT 0, PRIMARY KEY (pin, day));",
+        WORKER_ROLLUPS_BACKFILL_SQL + " ON CONFLICT DO NOTHING",
+    ]),
+    (3, "hot_query_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_history_pin_action_ts ON history (pin, action, timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_history_action_ts ON history (action, timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_pin_type_ts ON transactions (pin, tx_type, timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_transactions_status_ts ON transactions (status, timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_messages_dept_ts ON messages (target_dept, timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_messages_dm_ts ON messages (sender_pin, recipient_pin, timestamp) WHERE target_dept='DM';",
+        "CREATE INDEX IF NOT EXISTS ix_poc_ledger_ts ON poc_ledger (timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_poc_ledger_emr_pending_ts ON poc_ledger (timestamp) WHERE emr_verified=FALSE;",
+        "CREATE INDEX IF NOT EXISTS ix_obt_ledger_pin_ts ON obt_ledger (pin, timestamp);",
+        "CREATE INDEX IF NOT EXISTS ix_workers_status ON workers (status);",
+        "CREATE INDEX IF NOT EXISTS ix_marketplace_status_date ON marketplace (status, date);",
+        "CREATE INDEX IF NOT EXISTS ix_schedules_status_date ON schedules (status, shift_date);",
+        "CREATE INDEX IF NOT EXISTS ix_schedules_pin_date ON schedules (pin, shift_date);",
+        "CREATE INDEX IF NOT EXISTS ix_schedules_date_time ON schedules (shift_date, shift_time);",
+        "CREATE INDEX IF NOT EXISTS ix_shift_bids_status ON shift_bids (status);",
+        "CREATE INDEX IF NOT EXISTS ix_pto_requests_status ON pto_requests (status);",
+        "CREATE INDEX IF NOT EXISTS ix_credentials_pin ON credentials (pin);",
+        "CREATE INDEX IF NOT EXISTS ix_staff_competencies_pin ON staff_competencies (pin);",
+        "CREATE INDEX IF NOT EXISTS ix_staff_competencies_status ON staff_competencies (status);",
+        "CREATE INDEX IF NOT EXISTS ix_hospital_protocols_status_dept ON hospital_protocols (status, department);",
+        "CREATE INDEX IF NOT EXISTS ix_hospital_protocols_author ON hospital_protocols (author_pin);",
+        "CREATE INDEX IF NOT EXISTS ix_enterprise_users_dept ON enterprise_users (dept);",
+    ]),
+    (4, "merkle_tree_storage", [
+        "ALTER TABLE daily_rollups ADD COLUMN IF NOT EXISTS merkle_scheme TEXT DEFAULT 'legacy-hex';",
+        "CREATE TABLE IF NOT EXISTS merkle_nodes (rollup_date TEXT, level INT, idx BIGINT, hash BYTEA, PRIMARY KEY (rollup_date, level, idx));",
+        "CREATE TABLE IF NOT EXISTS merkle_leaves (claim_id TEXT PRIMARY KEY, rollup_date TEXT, leaf_index BIGINT);",
+    ]),
+    (5, "merkle_accumulators", [
+        "CREATE TABLE IF NOT EXISTS merkle_accumulators (rollup_date TEXT PRIMARY KEY, scheme TEXT, leaf_count BIGINT DEFAULT 0, peaks BYTEA, updated_at TIMESTAMP DEFAULT NOW(), finalized_at TIMESTAMP);",
+    ]),
+    (6, "poc_seal_audit", [
+        "ALTER TABLE poc_ledger ADD COLUMN IF NOT EXISTS seal_ts TEXT;",
+        "CREATE TABLE IF NOT EXISTS poc_audits (audit_id TEXT PRIMARY KEY, audited_at TIMESTAMP DEFAULT NOW(), rows_checked BIGINT, mismatches BIGINT, summary TEXT, signature TEXT);",
+    ]),
+    (7, "mint_outbox", [
+        "CREATE TABLE IF NOT EXISTS mint_outbox (mint_id TEXT PRIMARY KEY, token_id TEXT, wallet TEXT, action_id INT, status TEXT DEFAULT 'QUEUED', attempts INT DEFAULT 0, tx_hash TEXT, block_number BIGINT, last_error TEXT, created_at TIMESTAMP DEFAULT NOW(), updated_at TIMESTAMP DEFAULT NOW());",
+        "CREATE INDEX IF NOT EXISTS ix_mint_outbox_status_created ON mint_outbox (status, created_at);",
+    ]),
+    (8, "rollup_anchoring", [
+        "ALTER TABLE daily_rollups ADD COLUMN IF NOT EXISTS anchor_tx_hash TEXT;",
+        "ALTER TABLE daily_rollups ADD COLUMN IF NOT EXISTS anchor_block BIGINT;",
+        "ALTER TABLE daily_rollups ADD COLUMN IF NOT EXISTS anchored_at TIMESTAMP;",
+        "CREATE INDEX IF NOT EXISTS ix_daily_rollups_status ON daily_rollups (status);",
+        "ALTER TABLE obt_ledger ADD COLUMN IF NOT EXISTS claim_id TEXT;",
+        "CREATE INDEX IF NOT EXISTS ix_obt_ledger_claim ON obt_ledger (claim_id);",
+    ]),
+    (9, "spend_rollup_day_index", [
+        "CREATE INDEX IF NOT EXISTS ix_worker_rollups_day ON worker_rollups (day) INCLUDE (pin, clock_out_gross, clock_out_count);",
+    ]),
+    (10, "change_notify_triggers", [
+        # Statement-level, payload = table name: a batch write is one event, and Postgres folds duplicate payloads within a transaction.
+        "CREATE OR REPLACE FUNCTION ec_notify_change() RETURNS trigger AS $$ BEGIN PERFORM pg_notify('ec_changes', TG_TABLE_NAME); RETURN NULL; END; $$ LANGUAGE plpgsql;",
+    ] + [sql for table in ("messages", "marketplace", "workers", "poc_ledger") for sql in (
+        f"DROP TRIGGER IF EXISTS trg_notify_{table} ON {table};",
+        f"CREATE TRIGGER trg_notify_{table} AFTER INSERT OR UPDATE OR DELETE ON {table} FOR EACH STATEMENT EXECUTE FUNCTION ec_notify_change();",
+    )]),
+    (11, "poc_rollup_day_assignment", [
+        # The rollup day a claim belongs to is fixed at seal time; it differs from the local seal day only for seals after early finalization.
+        "ALTER TABLE poc_ledger ADD COLUMN IF NOT EXISTS rollup_date TEXT;",
+        f"UPDATE poc_ledger SET rollup_date = (timestamp::timestamptz AT TIME ZONE '{LOCAL_TZ.zone}')::date::text WHERE rollup_date IS NULL;",
+        "CREATE INDEX IF NOT EXISTS ix_poc_ledger_rollup_day ON poc_ledger (rollup_date, timestamp, claim_id);",
+    ]),
+    (12, "workers_notify_on_shift_changes", [
+        # GPS flushes rewrite lat/lon/last_active every few seconds; only clock-ins, clock-outs and pay changes are worth a refresh.
+        "DROP TRIGGER IF EXISTS trg_notify_workers ON workers;",
+        "CREATE TRIGGER trg_notify_workers AFTER INSERT OR DELETE ON workers FOR EACH STATEMENT EXECUTE FUNCTION ec_notify_change();",
+        "DROP TRIGGER IF EXISTS trg_notify_workers_shift ON workers;",
+        "CREATE TRIGGER trg_notify_workers_shift AFTER UPDATE ON workers FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.start_time IS DISTINCT FROM NEW.start_time OR OLD.earnings IS DISTINCT FROM NEW.earnings) EXECUTE FUNCTION ec_notify_change();",
+    ]),
+    (13, "rollup_anchor_chain", [
+        # Which chain an anchor went to ("live:<chain id>" or "simulated:<chain id>"), so dev-chain anchors can be told apart and redone.
+        "ALTER TABLE daily_rollups ADD COLUMN IF NOT EXISTS anchor_chain TEXT;",
+    ]),
+]
+
+def apply_schema_migrations(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (version INT PRIMARY KEY, name TEXT, applied_at TIMESTAMP DEFAULT NOW());"))
+    conn.commit()
+    applied = {r[0] for r in conn.execute(text("SELECT version FROM schema_migrations")).fetchall()}
+    newly_applied = []
+    for version, name, statements in SCHEMA_MIGRATIONS:
+        if version in applied: continue
+        for stmt in statements: conn.execute(text(stmt))
+        conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"), {"v": version, "n": name})
+        conn.commit()
+        newly_applied.append(version)
+    return newly_applied
+
+# --- SEED DATA ---
+SCHEMA_BOOTSTRAP_LOCK_ID = 60050001 # pg_advisory_lock key shared by every app process
+SEED_USERS = [
+    ("1001", "liam@ecprotocol.com", "Liam O'Neil", "RRT", "Respiratory", "Worker", 70.00, None),
+    ("1002", "charles@ecprotocol.com", "Charles Morgan", "RRT", "Respiratory", "Worker", 65.00, None),
+    ("1003", "sarah@ecprotocol.com", "Sarah Jenkins", "Charge RRT", "Respiratory", "Supervisor", 75.00, None),
+    ("1004", "manager@ecprotocol.com", "David Clark", "Manager", "Respiratory", "Manager", 90.00, None),
+    ("9001", "ceo@ecprotocol.com", "CEO View", "CEO", "Executive", "Admin", 0.00, None),
+    ("9002", "coo@ecprotocol.com", "COO View", "COO", "Executive", "Admin", 0.00, None),
+    ("9003", "cno@ecprotocol.com", "CNO View", "CNO", "Executive", "Admin", 0.00, None),
+    ("9004", "cco@ecprotocol.com", "CCO View", "CCO", "Executive", "Admin", 0.00, None),
+    ("9005", "cto@ecprotocol.com", "CTO View", "CTO", "Executive", "Admin", 0.00, None),
+    ("9006", "cfo@ecprotocol.com", "CFO View", "CFO", "Executive", "Admin", 0.00, None),
+    ("9007", "chro@ecprotocol.com", "CHRO View", "CHRO", "Executive", "Admin", 0.00, None),
+    ("8001", "resp_dir@ecprotocol.com", "Alice Wright", "Director", "Respiratory", "Director", 100.00, None),
+    ("8002", "nursing_dir@ecprotocol.com", "Marcus Cole", "Director", "Nursing", "Director", 100.00, None)
+]
+
+def seed_reference_data(conn):
+    # bcrypt is deliberately slow, so only accounts that are actually missing get hashed.
+    existing = {r[0] for r in conn.execute(text("SELECT pin FROM enterprise_users WHERE pin = ANY(:pins)"), {"pins": [sd[0] for sd in SEED_USERS]}).fetchall()}
+    missing = [sd for sd in SEED_USERS if sd[0] not in existing]
+    for sd in missing: conn.execute(text("INSERT INTO enterprise_users (pin, email, password_hash, name, role, dept, access_level, hourly_rate, phone, last_pw_change) VALUES (:p, :e, :pw, :n, :r, :d, :al, :hr, :ph, NOW() - INTERVAL '100 days') ON CONFLICT DO NOTHING"), {"p": sd[0], "e": sd[1], "pw": hash_password("password123"), "n": sd[2], "r": sd[3], "d": sd[4], "al": sd[5], "hr": sd[6], "ph": sd[7]})
+    conn.execute(text("INSERT INTO hospital_treasury (id, available_balance) VALUES (1, 50000.00) ON CONFLICT DO NOTHING;"))
+    # Insert real David Clark expiry data to replace hardcoded UI
+    conn.execute(text("INSERT INTO staff_competencies (comp_id, pin, competency_name, completed_date, expires_date, status) VALUES ('COMP-1004', '1004', 'Advanced Ventilator Setup (Annual)', '2024-01-01', :exp, 'EXPIRED') ON CONFLICT DO NOTHING"), {"exp": str(date.today() - timedelta(days=45))})
+    return len(missing)
+
+def bootstrap_schema(conn):
+    """Migrations and seed data behind a session advisory lock, so concurrent processes in a deploy run them one at a time.
+    Returns (versions applied, accounts seeded)."""
+    conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": SCHEMA_BOOTSTRAP_LOCK_ID})
+    try:
+        applied = apply_schema_migrations(conn)
+        seeded = seed_reference_data(conn)
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": SCHEMA_BOOTSTRAP_LOCK_ID})
+        conn.commit()
+    return applied, seeded
+
+# --- HOT QUERIES ---
+# Hot statements. Call sites and the OPSEC query plan audit share these exact strings, so the audit EXPLAINs what actually runs.
+SQL_ROLLING_WEEKLY_GROSS = """
+    SELECT COALESCE((SELECT SUM(clock_out_gross) FROM worker_rollups WHERE pin=:p AND day > DATE(NOW() - INTERVAL '7 days')), 0)
+         + COALESCE((SELECT SUM(amount) FROM history WHERE pin=:p AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '7 days' AND timestamp < DATE(NOW() - INTERVAL '7 days') + 1), 0)
+"""
+SQL_FATIGUE_HISTORY = """
+    SELECT pin,
+        COALESCE(SUM(amount) FILTER (WHERE timestamp >= NOW() - INTERVAL '14 days'), 0),
+        COUNT(*) FILTER (WHERE extract(isodow from timestamp) >= 6),
+        COUNT(*) FILTER (WHERE timestamp >= NOW() - INTERVAL '48 hours')
+    FROM history WHERE pin = ANY(:pins) AND action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '30 days' GROUP BY pin
+"""
+SQL_FATIGUE_ACCOLADES = "SELECT pin, count(*) FROM obt_ledger WHERE pin = ANY(:pins) AND timestamp >= NOW() - INTERVAL '7 days' GROUP BY pin"
+SQL_FLEX_ORACLE = """
+    SELECT w.pin, COALESCE(h.gross_7d, 0), COALESCE(h.gross_14d, 0), COALESCE(h.wknd_count, 0), COALESCE(h.recent_count, 0), COALESCE(o.acc_count, 0)
+    FROM workers w
+    JOIN enterprise_users u ON u.pin = w.pin
+    LEFT JOIN (
+        SELECT pin,
+            SUM(amount) FILTER (WHERE timestamp >= NOW() - INTERVAL '7 days') AS gross_7d,
+            SUM(amount) FILTER (WHERE timestamp >= NOW() - INTERVAL '14 days') AS gross_14d,
+            COUNT(*) FILTER (WHERE extract(isodow from timestamp) >= 6) AS wknd_count,
+            COUNT(*) FILTER (WHERE timestamp >= NOW() - INTERVAL '48 hours') AS recent_count
+        FROM history WHERE action='CLOCK OUT' AND timestamp >= NOW() - INTERVAL '30 days' GROUP BY pin
+    ) h ON h.pin = w.pin
+    LEFT JOIN (SELECT pin, COUNT(*) AS acc_count FROM obt_ledger WHERE timestamp >= NOW() - INTERVAL '7 days' GROUP BY pin) o ON o.pin = w.pin
+    WHERE w.status='Active' AND u.dept=:d
+"""
+SQL_SPEND_BY_DEPT_DAY = """
+    SELECT COALESCE(u.dept, 'Unknown'), r.day, SUM(r.clock_out_gross)
+    FROM worker_rollups r LEFT JOIN enterprise_users u ON u.pin = r.pin
+    WHERE r.day >= :a AND r.day <= :b AND r.clock_out_count > 0
+    GROUP BY 1, 2 ORDER BY 2
+"""
+SQL_PAYSTUB_PAGE = """
+    WITH stubs AS (
+        SELECT tx_id, amount, timestamp, destination_pubkey, note,
+            LAG(timestamp) OVER (ORDER BY timestamp, tx_id) AS prev_ts, COUNT(*) OVER () AS total
+        FROM transactions WHERE pin=:p AND tx_type='NET_PAY'
+    ), page AS (
+        SELECT * FROM stubs ORDER BY timestamp DESC, tx_id DESC LIMIT :lim OFFSET :off
+    )
+    SELECT pg.tx_id, pg.amount, pg.timestamp, pg.destination_pubkey, pg.note, pg.total, h.action, h.timestamp
+    FROM page pg
+    LEFT JOIN history h ON h.pin=:p AND h.action IN ('CLOCK IN', 'CLOCK OUT') AND h.timestamp > COALESCE(pg.prev_ts, '-infinity'::timestamp) AND h.timestamp <= pg.timestamp
+    ORDER BY pg.timestamp DESC, pg.tx_id DESC, h.timestamp ASC
+"""
+SQL_PERIOD_PAYSTUBS = """
+    WITH stubs AS (
+        SELECT pin, tx_id, amount, timestamp, destination_pubkey,
+            LAG(timestamp) OVER (PARTITION BY pin ORDER BY timestamp, tx_id) AS prev_ts
+        FROM transactions WHERE tx_type='NET_PAY' AND timestamp < :end
+    )
+    SELECT s.pin, s.tx_id, s.amount, s.timestamp, s.destination_pubkey, h.action, h.timestamp
+    FROM stubs s
+    LEFT JOIN history h ON h.pin=s.pin AND h.action IN ('CLOCK IN', 'CLOCK OUT') AND h.timestamp > COALESCE(s.prev_ts, '-infinity'::timestamp) AND h.timestamp <= s.timestamp
+    WHERE s.timestamp >= :start
+    ORDER BY s.pin, s.timestamp, s.tx_id, h.timestamp
+"""
+SQL_POC_DAY_RANGE = """
+    SELECT claim_id, secure_hash, rollup_date FROM poc_ledger
+    WHERE rollup_date >= :a AND rollup_date <= :b AND secure_hash IS NOT NULL AND secure_hash <> ''
+    ORDER BY rollup_date, timestamp, claim_id
+"""
+SQL_PENDING_CFO_SETTLEMENTS = "SELECT tx_id, pin, amount, timestamp, note FROM transactions WHERE status='PENDING_CFO' ORDER BY timestamp ASC"
+SQL_DEPT_CHANNEL = "SELECT sender_pin, message, timestamp, is_sos FROM messages WHERE target_dept=:d ORDER BY timestamp DESC LIMIT 50"
+SQL_HOSPITAL_CHANNEL = "SELECT sender_pin, message, timestamp, is_sos FROM messages WHERE target_dept='All' ORDER BY timestamp DESC LIMIT 50"
+SQL_DM_THREAD = "SELECT sender_pin, message, timestamp FROM messages WHERE target_dept='DM' AND ((sender_pin=:p AND recipient_pin=:rp) OR (sender_pin=:rp AND recipient_pin=:p)) ORDER BY timestamp DESC LIMIT 50"
+SQL_POC_FEED = "SELECT claim_id, pin, patient_room, action, timestamp, ble_verified, emr_verified, ai_verified, secure_hash FROM poc_ledger ORDER BY timestamp DESC LIMIT 20"
+SQL_POC_EMR_EXCEPTIONS = "SELECT claim_id, action, emr_verified FROM poc_ledger WHERE emr_verified=FALSE ORDER BY timestamp DESC LIMIT 5"
+SQL_OBT_PORTFOLIO = "SELECT token_id, accolade_type, clinical_context, timestamp, encryption_hash FROM obt_ledger WHERE pin=:p ORDER BY timestamp DESC"
+SQL_ACTIVE_FLEET = "SELECT w.pin, u.name, u.hourly_rate, w.start_time, w.earnings, w.lat, w.lon FROM workers w LEFT JOIN enterprise_users u ON u.pin = w.pin WHERE w.status='Active' ORDER BY w.start_time"
+SQL_OPEN_MARKETPLACE = "SELECT shift_id, role, date, start_time, rate, escrow_status FROM marketplace WHERE status='OPEN' ORDER BY date ASC"
+SQL_SCHEDULED_BASELINE = "SELECT shift_id, pin, shift_date, shift_time, department FROM schedules WHERE status='SCHEDULED' ORDER BY shift_date ASC"
+SQL_MY_UPCOMING_SHIFTS = "SELECT shift_id, shift_date, shift_time, COALESCE(status, 'SCHEDULED'), department FROM schedules WHERE pin=:p AND shift_date >= :today ORDER BY shift_date ASC"
+SQL_PENDING_OT_BIDS = "SELECT bid_id, shift_id, pin, counter_rate FROM shift_bids WHERE status='PENDING_OT'"
+SQL_PENDING_PTO = "SELECT req_id, pin, start_date, end_date, reason FROM pto_requests WHERE status='PENDING'"
+SQL_ACTIVE_PROTOCOLS = "SELECT title, next_review FROM hospital_protocols WHERE status='ACTIVE' AND (department=:d OR department='All')"
+
+# Every hot statement above, paired with sample binds. Used by the OPSEC query plan audit.
+HOT_SAMPLE_DAY = LOCAL_TZ.localize(datetime(2000, 1, 1))
+HOT_QUERIES = [
+    ("Rolling weekly gross", SQL_ROLLING_WEEKLY_GROSS, {"p": "1001"}),
+    ("Fatigue history", SQL_FATIGUE_HISTORY, {"pins": ["1001", "1002"]}),
+    ("Fatigue accolades", SQL_FATIGUE_ACCOLADES, {"pins": ["1001", "1002"]}),
+    ("Flex oracle roster", SQL_FLEX_ORACLE, {"d": "Respiratory"}),
+    ("Spend by dept and day", SQL_SPEND_BY_DEPT_DAY, {"a": HOT_SAMPLE_DAY.date(), "b": HOT_SAMPLE_DAY.date() + timedelta(days=30)}),
+    ("Paystub page", SQL_PAYSTUB_PAGE, {"p": "1001", "lim": 10, "off": 0}),
+    ("Period paystubs", SQL_PERIOD_PAYSTUBS, {"start": HOT_SAMPLE_DAY, "end": HOT_SAMPLE_DAY + timedelta(days=14)}),
+    ("CFO pending settlements", SQL_PENDING_CFO_SETTLEMENTS, {}),
+    ("Department channel", SQL_DEPT_CHANNEL, {"d": "Respiratory"}),
+    ("Hospital-wide channel", SQL_HOSPITAL_CHANNEL, {}),
+    ("Direct messages", SQL_DM_THREAD, {"p": "1001", "rp": "1002"}),
+    ("PoC ledger feed", SQL_POC_FEED, {}),
+    ("PoC rollup day range", SQL_POC_DAY_RANGE, {"a": str(HOT_SAMPLE_DAY.date()), "b": str(HOT_SAMPLE_DAY.date())}),
+    ("PoC EMR exceptions", SQL_POC_EMR_EXCEPTIONS, {}),
+    ("OBT portfolio", SQL_OBT_PORTFOLIO, {"p": "1001"}),
+    ("Active workers", SQL_ACTIVE_FLEET, {}),
+    ("Open marketplace", SQL_OPEN_MARKETPLACE, {}),
+    ("Scheduled baseline", SQL_SCHEDULED_BASELINE, {}),
+    ("My upcoming shifts", SQL_MY_UPCOMING_SHIFTS, {"p": "1001", "today": "2000-01-01"}),
+    ("Pending OT bids", SQL_PENDING_OT_BIDS, {}),
+    ("Pending PTO", SQL_PENDING_PTO, {}),
+    ("Active protocols", SQL_ACTIVE_PROTOCOLS, {"d": "Respiratory"}),
+]
+
+def find_seq_scans(plan_node):
+    found = [plan_node.get("Relation Name")] if plan_node.get("Node Type") == "Seq Scan" else []
+    for child in plan_node.get("Plans", []): found.extend(find_seq_scans(child))
+    return found
+
+def explain_hot_queries(conn):
+    """EXPLAINs every HOT_QUERIES entry with seq scans disabled. Any remaining Seq Scan means no usable index covers that predicate.
+    Returns (label, scanned tables) pairs; a statement that fails to plan reports its error in place of the tables."""
+    report = []
+    for label, query, params in HOT_QUERIES:
+        try:
+            with conn.begin():
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+                plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + query), params).scalar()
+                if isinstance(plan, str): plan = json.loads(plan)
+                report.append((label, find_seq_scans(plan[0]["Plan"])))
+        except Exception as e: report.append((label, [f"EXPLAIN failed: {e}"]))
+    return report
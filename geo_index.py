@@ -0,0 +1,56 @@
+import math
+import numpy as np
+
+# Geofence math shared by app.py and bench/geofence.py. Pure numpy: no streamlit, no database.
+
+EARTH_RADIUS_M = 6371000
+METERS_PER_DEGREE_LAT = 111320.0
+NEAREST_FACILITY_CHOICES = 5
+
+def haversine_vec(lat1, lon1, lat2, lon2):
+    """Great-circle meters between broadcastable arrays of degrees."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(np.asarray(lon2) - np.asarray(lon1)) / 2) ** 2
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def build_facility_index(facilities, cell_m):
+    """Grid index: facilities sorted by the key of their cell_m-sized lat/lon cell. Demo placeholders at 0,0 are left out."""
+    live = [(n, float(f["lat"]), float(f["lon"])) for n, f in facilities.items() if (float(f["lat"]), float(f["lon"])) != (0.0, 0.0)]
+    cell = cell_m / METERS_PER_DEGREE_LAT
+    lat = np.array([l[1] for l in live]); lon = np.array([l[2] for l in live])
+    keys = (np.floor(lat / cell).astype(np.int64) << 32) + np.floor(lon / cell).astype(np.int64)
+    order = np.argsort(keys, kind="stable")
+    return {"names": np.array([l[0] for l in live], dtype=object)[order], "lat": lat[order], "lon": lon[order], "keys": keys[order], "cell": cell}
+
+def facilities_within(index, lats, lons, radius_m):
+    """Every (point, facility, meters) pair within radius_m. Only cells that can reach the radius are scanned; each cell is a searchsorted range."""
+    lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    empty = (np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([]))
+    if not len(index["keys"]) or not len(lats): return empty
+    cell = index["cell"]
+    ky, kx = np.floor(lats / cell).astype(np.int64), np.floor(lons / cell).astype(np.int64)
+    span_y = int(math.ceil(radius_m / METERS_PER_DEGREE_LAT / cell))
+    # A degree of longitude shrinks with latitude, so the column span is sized for the most poleward point.
+    span_x = int(math.ceil(radius_m / (METERS_PER_DEGREE_LAT * max(np.cos(np.radians(np.abs(lats).max() + span_y * cell)), 1e-6)) / cell))
+    pts_out, fac_out, dist_out = [], [], []
+    for dy in range(-span_y, span_y + 1):
+        for dx in range(-span_x, span_x + 1):
+            probe = ((ky + dy) << 32) + (kx + dx)
+            lo = np.searchsorted(index["keys"], probe, "left"); counts = np.searchsorted(index["keys"], probe, "right") - lo
+            total = int(counts.sum())
+            if not total: continue
+            pts = np.repeat(np.arange(len(lats)), counts)
+            facs = np.repeat(lo, counts) + (np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts))
+            dist = haversine_vec(lats[pts], lons[pts], index["lat"][facs], index["lon"][facs])
+            hit = dist <= radius_m
+            pts_out.append(pts[hit]); fac_out.append(facs[hit]); dist_out.append(dist[hit])
+    if not pts_out: return empty
+    return np.concatenate(pts_out), np.concatenate(fac_out), np.concatenate(dist_out)
+
+def nearest_facilities(index, lat, lon, k=NEAREST_FACILITY_CHOICES):
+    """[(name, meters)] for the k closest live facilities to one point: a single vectorized pass plus argpartition."""
+    if not len(index["names"]): return []
+    dist = haversine_vec(lat, lon, index["lat"], index["lon"])
+    top = np.argpartition(dist, min(k, len(dist)) - 1)[:k]
+    top = top[np.argsort(dist[top])]
+    return [(index["names"][i], float(dist[i])) for i in top]
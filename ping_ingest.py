@@ -0,0 +1,76 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+from sqlalchemy import text
+from geo_index import facilities_within
+
+# GPS ping pipeline shared by app.py and bench/position_ingest.py: a bounded queue, per-worker coalescing and timed batch updates.
+# No streamlit here; app.py keeps one pipeline per process behind st.cache_resource.
+
+POSITION_QUEUE_MAX = int(os.environ.get("POSITION_QUEUE_MAX", 20000))
+POSITION_FLUSH_SECONDS = float(os.environ.get("POSITION_FLUSH_SECONDS", 2.0))
+POSITION_BATCH_ROWS = 500
+POSITION_SUBMIT_TIMEOUT = 0.05 # how long a full queue may stall a rerun before the ping is dropped
+
+def flush_positions(engine, positions):
+    """Writes {pin: (lat, lon)} as one UPDATE ... FROM a VALUES list per batch. Only existing rows still clocked in take the new fix:
+    a late ping can neither resurrect a finished shift nor create a workers row."""
+    if isinstance(engine, str) or engine is None or not positions: return 0
+    items, written = list(positions.items()), 0
+    with engine.connect() as conn:
+        for i in range(0, len(items), POSITION_BATCH_ROWS):
+            chunk = items[i:i + POSITION_BATCH_ROWS]
+            values = ", ".join(f"(:p{j}, :lat{j}, :lon{j})" for j in range(len(chunk)))
+            params = {}
+            for j, (p, (lat, lon)) in enumerate(chunk): params[f"p{j}"] = p; params[f"lat{j}"] = float(lat); params[f"lon{j}"] = float(lon)
+            written += conn.execute(text(f"WITH v (pin, lat, lon) AS (VALUES {values}) UPDATE workers SET lat = v.lat, lon = v.lon, last_active = NOW() FROM v WHERE workers.pin = v.pin AND workers.status = 'Active'"), params).rowcount
+        conn.commit()
+    return written
+
+def detect_geofence_exits(ingest, positions, index, radius_m):
+    """Vectorized inside/outside test for one coalesced batch. A worker is flagged the first time a fix lands outside every fence after being inside (or unseen, since punch-in verified them)."""
+    if not len(index["names"]) or not positions: return 0
+    pins = list(positions)
+    inside = np.zeros(len(pins), dtype=bool)
+    inside[facilities_within(index, [positions[p][0] for p in pins], [positions[p][1] for p in pins], radius_m)[0]] = True
+    exits = 0
+    for p, now_inside in zip(pins, inside.tolist()):
+        if not now_inside and ingest["inside"].get(p, True): ingest["exits"][p] = time.time(); exits += 1
+        ingest["inside"][p] = now_inside
+    return exits
+
+def start_position_ingest(engine, facility_index, radius_m, flush_seconds=POSITION_FLUSH_SECONDS):
+    """Starts the drain thread and returns the pipeline dict. facility_index() is called per batch so a reloaded registry is picked up.
+    The thread keeps only the latest fix per worker, checks the batch against the fences, then flushes it every flush_seconds."""
+    ingest = {"queue": queue.Queue(maxsize=POSITION_QUEUE_MAX), "lock": threading.Lock(), "inside": {}, "exits": {}, "accepted": 0, "dropped": 0, "coalesced": 0, "flushes": 0, "rows": 0, "exits_detected": 0, "last_flush_ms": 0.0, "last_error": None}
+    def drain_forever():
+        while True:
+            pending, deadline = {}, time.time() + flush_seconds
+            while (remaining := deadline - time.time()) > 0:
+                try: pin, lat, lon = ingest["queue"].get(timeout=remaining)
+                except queue.Empty: break
+                if pin in pending: ingest["coalesced"] += 1
+                pending[pin] = (lat, lon)
+            if not pending: continue
+            try:
+                with ingest["lock"]: ingest["exits_detected"] += detect_geofence_exits(ingest, pending, facility_index(), radius_m)
+                t0 = time.perf_counter()
+                ingest["rows"] += flush_positions(engine, pending)
+                ingest["flushes"] += 1; ingest["last_flush_ms"] = (time.perf_counter() - t0) * 1000
+            except Exception as e: ingest["last_error"] = str(e)
+    ingest["thread"] = threading.Thread(target=drain_forever, name="position-ingest", daemon=True)
+    ingest["thread"].start()
+    return ingest
+
+def queue_position(ingest, pin, lat, lon):
+    """Queues one GPS ping. When the queue is full the caller waits at most POSITION_SUBMIT_TIMEOUT, then the ping is dropped (the next one supersedes it anyway)."""
+    try: ingest["queue"].put((str(pin), float(lat), float(lon)), timeout=POSITION_SUBMIT_TIMEOUT)
+    except queue.Full: ingest["dropped"] += 1; return False
+    ingest["accepted"] += 1
+    return True
+
+def pop_geofence_exit(ingest, pin):
+    """Pops a pending stream-detected exit for this worker, if any."""
+    with ingest["lock"]: return ingest["exits"].pop(str(pin), None) is not None
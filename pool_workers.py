@@ -0,0 +1,193 @@
+import os
+import hashlib
+import pytz
+from datetime import datetime
+
+# Process-pool workers for app.py. Pools use the "spawn" start method, so every child imports this module fresh:
+# keep it free of streamlit, the database engine and anything else that holds threads or sockets.
+
+# --- EXTERNAL LIBRARIES ---
+try:
+    from fpdf import FPDF
+    import fpdf as fpdf_module
+    PDF_ACTIVE = True
+    PDF_OUTPUT_IS_BYTES = not str(getattr(fpdf_module, "FPDF_VERSION", "1.7")).startswith("1.") # fpdf2 returns bytes; fpdf 1.7.x returns a latin-1 str
+except ImportError:
+    PDF_ACTIVE = False
+
+LOCAL_TZ = pytz.timezone('US/Eastern')
+
+# --- POC SEAL VERIFICATION ---
+def generate_poc_hash(claim_id, pin, room, action, timestamp_str):
+    raw_data = f"{claim_id}|{pin}|{room}|{action}|{timestamp_str}|{os.environ.get('SECURE_SALT', 'CLINICAL_LEDGER_SALT')}"
+    return hashlib.sha256(raw_data.encode('utf-8')).hexdigest()
+
+def poc_seal_candidates(claim_id, seal_ts):
+    """Seal-time strings to try. Rows sealed before seal_ts was persisted fall back to the claim id's epoch second and the one after it."""
+    if seal_ts: return [seal_ts]
+    try: epoch = int(str(claim_id).rsplit("-", 1)[-1])
+    except ValueError: return []
+    return [datetime.fromtimestamp(e, LOCAL_TZ).strftime("%Y-%m-%d %H:%M:%S") for e in (epoch, epoch + 1)]
+
+def verify_poc_chunk(rows):
+    """Pool worker: recomputes every seal in the chunk. Returns (checked, verified_by_reconstruction, mismatches)."""
+    reconstructed, mismatches = 0, []
+    for claim_id, pin, room, action, seal_ts, stored in rows:
+        candidates = poc_seal_candidates(claim_id, seal_ts)
+        if stored and any(generate_poc_hash(claim_id, pin, room, action, ts) == stored for ts in candidates):
+            reconstructed += not seal_ts; continue
+        reason = "MISSING_HASH" if not stored else ("NO_SEAL_TIME" if not candidates else "HASH_MISMATCH")
+        mismatches.append({"claim_id": claim_id, "pin": pin, "action": action, "reason": reason})
+    return len(rows), reconstructed, mismatches
+
+# --- BULLETPROOF PDF GENERATOR ---
+def safe_pdf_bytes(pdf_obj):
+    """Renders straight to raw bytes in memory; never touches disk. Both fpdf generations end up as the same byte string."""
+    try:
+        if PDF_OUTPUT_IS_BYTES: return bytes(pdf_obj.output())
+        return pdf_obj.output(dest='S').encode('latin-1')
+    except Exception: return None
+
+def create_paystub_txt(name, date_str, tx_id, gross, net, tax, dest, shifts_data=None):
+    lines = [
+        "===================================================",
+        "    VICENTUS ENTERPRISE - OFFICIAL PAY RECEIPT     ",
+        "===================================================",
+        f"Operator: {name}",
+        f"Date of Settlement: {date_str}",
+        f"Ledger Tx ID: {tx_id}",
+        f"Routing Method: Fiat Direct Deposit",
+        f"Destination: {dest}",
+        "---------------------------------------------------",
+        "Validated Shift Coverage (Clock In -> Clock Out):"
+    ]
+    if shifts_data and len(shifts_data) > 0:
+        for s_in, s_out in shifts_data: lines.append(f"  * IN: {s_in}    |    OUT: {s_out}")
+    else: lines.append("  * Standard Aggregate Payout (Verified via History Ledger)")
+    lines.extend([
+        "---------------------------------------------------",
+        f"Gross Pay: ${gross:,.2f}",
+        f"Progressive Tax Withholding: ${tax:,.2f}",
+        f"Net Settlement: ${net:,.2f}",
+        "---------------------------------------------------",
+        "This is a cryptographically verifiable ledger receipt."
+    ])
+    return "\n".join(lines).encode('utf-8')
+
+def render_compliance_report_txt(dept_name, manager_name, data):
+    lines = [
+        "===================================================",
+        "       VICENTUS COMPLIANCE & PROTOCOL AUDIT        ",
+        "===================================================",
+        f"Department: {dept_name} | Generated By: {manager_name}",
+        f"Date: {data['generated_at']}",
+        "\nACTIVE PROTOCOLS:",
+        "---------------------------------------------------"
+    ]
+    active_p = data["protocols"]
+    if active_p:
+        for p in active_p: lines.append(f"[PASS] {p[0]} (Valid until {p[1]})")
+    else: lines.append("No active protocols found.")
+
+    lines.extend(["\nRECENT PROOF-OF-CARE EXCEPTIONS:", "---------------------------------------------------"])
+    poc_issues = data["poc_issues"]
+    if poc_issues:
+        for c in poc_issues: lines.append(f"[FLAG] Claim {c[0]}: {c[1]} - EMR SYNC PENDING")
+    else: lines.append("All recent clinical actions properly synced with EMR.")
+
+    lines.extend(["\n===================================================", "      End of Official Vicentus Audit Report.       "])
+    return "\n".join(lines).encode('utf-8')
+
+def create_paystub_pdf(name, date_str, tx_id, gross, net, tax, dest, shifts_data=None):
+    if not PDF_ACTIVE: return create_paystub_txt(name, date_str, tx_id, gross, net, tax, dest, shifts_data)
+    try:
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.set_font("Arial", 'B', 16)
+        pdf.cell(190, 10, txt="VICENTUS ENTERPRISE - OFFICIAL PAY RECEIPT", ln=True, align='C')
+        pdf.set_font("Arial", '', 12)
+        pdf.ln(10)
+        pdf.cell(100, 8, txt=f"Operator: {name}", ln=True)
+        pdf.cell(100, 8, txt=f"Date of Settlement: {date_str}", ln=True)
+        pdf.cell(100, 8, txt=f"Ledger Tx ID: {tx_id}", ln=True)
+        pdf.cell(100, 8, txt=f"Routing Method: Fiat Direct Deposit", ln=True)
+        pdf.cell(100, 8, txt=f"Destination: {dest}", ln=True)
+        pdf.ln(5)
+        pdf.set_font("Arial", 'B', 12)
+        pdf.line(10, 75, 200, 75)
+        pdf.ln(5)
+        pdf.cell(190, 8, txt="Validated Shift Coverage (Clock In -> Clock Out):", ln=True)
+        pdf.set_font("Arial", '', 10)
+
+        if shifts_data and len(shifts_data) > 0:
+            for s_in, s_out in shifts_data:
+                pdf.cell(190, 6, txt=f"  * IN: {s_in}    |    OUT: {s_out}", ln=True)
+        else:
+            pdf.cell(190, 6, txt="  * Standard Aggregate Payout (Verified via History Ledger)", ln=True)
+
+        pdf.ln(5)
+        current_y = pdf.get_y()
+        pdf.line(10, current_y, 200, current_y)
+        pdf.ln(5)
+        pdf.set_font("Arial", '', 12)
+        pdf.cell(100, 10, txt=f"Gross Pay: ${gross:,.2f}", ln=True)
+        pdf.cell(100, 10, txt=f"Progressive Tax Withholding: ${tax:,.2f}", ln=True)
+        pdf.set_font("Arial", 'B', 14)
+        pdf.cell(100, 10, txt=f"Net Settlement: ${net:,.2f}", ln=True)
+        pdf.ln(5)
+        current_y = pdf.get_y()
+        pdf.line(10, current_y, 200, current_y)
+        pdf.ln(10)
+        pdf.set_font("Arial", 'I', 10)
+        pdf.cell(190, 10, txt="This is a cryptographically verifiable ledger receipt generated by Vicentus.", ln=True, align='C')
+        return safe_pdf_bytes(pdf)
+    except Exception: return create_paystub_txt(name, date_str, tx_id, gross, net, tax, dest, shifts_data)
+
+def render_compliance_report(dept_name, manager_name, data):
+    """Renders a compliance report from fetch_compliance_data() output; the PDF falls back to text."""
+    if not PDF_ACTIVE: return render_compliance_report_txt(dept_name, manager_name, data)
+    try:
+        pdf = FPDF()
+        pdf.add_page()
+        pdf.set_font("Arial", 'B', 16)
+        pdf.cell(190, 10, txt="VICENTUS COMPLIANCE & PROTOCOL AUDIT", ln=True, align='C')
+        pdf.set_font("Arial", 'I', 10)
+        pdf.cell(190, 6, txt=f"Department: {dept_name} | Generated By: {manager_name} | Date: {data['generated_at']}", ln=True, align='C')
+        pdf.ln(10)
+
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(190, 8, txt="ACTIVE PROTOCOLS:", ln=True)
+        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+        pdf.ln(2)
+
+        pdf.set_font("Arial", '', 10)
+        active_p = data["protocols"]
+        if active_p:
+            for p in active_p: pdf.cell(190, 6, txt=f"[PASS] {p[0]} (Valid until {p[1]})", ln=True)
+        else:
+            pdf.cell(190, 6, txt="No active protocols found.", ln=True)
+
+        pdf.ln(10)
+        pdf.set_font("Arial", 'B', 12)
+        pdf.cell(190, 8, txt="RECENT PROOF-OF-CARE EXCEPTIONS:", ln=True)
+        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+        pdf.ln(2)
+
+        pdf.set_font("Arial", '', 10)
+        poc_issues = data["poc_issues"]
+        if poc_issues:
+            for c in poc_issues: pdf.cell(190, 6, txt=f"[FLAG] Claim {c[0]}: {c[1]} - EMR SYNC PENDING", ln=True)
+        else:
+            pdf.cell(190, 6, txt="All recent clinical actions properly synced with EMR.", ln=True)
+
+        pdf.ln(15)
+        pdf.set_font("Arial", 'I', 8)
+        pdf.cell(190, 10, txt="End of Official Vicentus Audit Report.", ln=True, align='C')
+        return safe_pdf_bytes(pdf)
+    except Exception: return render_compliance_report_txt(dept_name, manager_name, data)
+
+# --- BULK EXPORT ---
+def render_export_job(job):
+    """Pool worker. A job is (arcname, kind, args) built from data the parent already fetched, so children never touch the database."""
+    arcname, kind, args = job
+    return arcname, (create_paystub_pdf(*args) if kind == "paystub" else render_compliance_report(*args))